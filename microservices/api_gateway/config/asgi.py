@@ -0,0 +1,6 @@
+"""ASGI config for API Gateway - serves the async gateway views"""
+import os
+from django.core.asgi import get_asgi_application
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('GATEWAY_ASYNC', '1')
+application = get_asgi_application()
@@ -1,8 +1,13 @@
 """Settings for API Gateway (Microservices)"""
+import os
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Shared helpers in microservices/common
+sys.path.append(str(BASE_DIR.parent))
+
 SECRET_KEY = 'django-insecure-api-gateway-secret-key'
 DEBUG = True
 ALLOWED_HOSTS = ['*']
@@ -19,6 +24,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.metrics.MetricsMiddleware',
+    'common.deadline.DeadlineMiddleware',
+    'common.idempotency.IdempotencyMiddleware',
+    'gateway.admission.AdmissionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,6 +56,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# Serve gateway routes through async views (enabled by config.asgi)
+GATEWAY_ASYNC = os.environ.get('GATEWAY_ASYNC', '0') == '1'
 
 DATABASES = {
     'default': {
@@ -69,6 +82,149 @@ SERVICES = {
     'cart': 'http://localhost:8003',
 }
 
+# Client-side load balancing - a SERVICES entry may also be a list of instance URLs,
+# e.g. 'book': ['http://localhost:8002', 'http://localhost:8012']
+LOAD_BALANCER = {
+    'STRATEGY': 'least_outstanding',  # or 'round_robin'
+    'FAILURE_THRESHOLD': 3,
+    'EJECTION_SECONDS': 10,
+    'MAX_EJECTION_SECONDS': 120,
+}
+
 # Service Discovery
 SERVICE_NAME = 'api-gateway'
 SERVICE_PORT = 8000
+
+# Keep-alive connection pools for downstream services
+PROXY_POOL = {
+    'POOL_CONNECTIONS': 10,     # Host pools kept per service session
+    'POOL_MAXSIZE': 20,         # Keep-alive connections per host
+    'MAX_IDLE_SECONDS': 60,     # Recycle a session after this long without traffic
+    'ASYNC_MAX_CONNECTIONS': 1000,  # Concurrent connections per service in async mode
+    'FANOUT_WORKERS': 32,       # Threads for concurrent downstream calls in composite views
+}
+
+# Per-service (connect, read) timeouts in seconds
+SERVICE_TIMEOUTS = {
+    'default': (2, 10),
+    'customer': (2, 5),
+    'book': (2, 5),
+    'cart': (2, 10),
+}
+
+# Service health probes run concurrently and are cached for FRESHNESS_SECONDS
+HEALTH_CHECK = {
+    'FRESHNESS_SECONDS': 5,
+    'TIMEOUT_SECONDS': 2,
+}
+
+# Response cache for downstream GETs - per-service (path regex, TTL seconds), first match wins
+GATEWAY_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'ROUTES': {
+        'book': [
+            (r'^books/(search|in_stock|bulk_get)/$', 10),
+            (r'^books/$', 30),
+            (r'^books/[^/]+/$', 60),
+        ],
+    },
+    # Per-service (path regex, other services) - writes matching the path also drop the
+    # other services' cached responses
+    'INVALIDATES': {
+        'cart': [
+            (r'^carts/[^/]+/checkout/$', ['book']),    # Checkout takes the books' stock
+        ],
+    },
+}
+
+# Per-service circuit breakers - trip on failure or slow-call rate over a sliding window
+CIRCUIT_BREAKER = {
+    'WINDOW_SIZE': 20,                  # Recent calls considered
+    'MINIMUM_CALLS': 10,                # Calls needed before the breaker may trip
+    'FAILURE_RATE_THRESHOLD': 0.5,      # Errors, timeouts and 5xx
+    'SLOW_CALL_SECONDS': 2.0,
+    'SLOW_CALL_RATE_THRESHOLD': 0.8,
+    'OPEN_SECONDS': 10,                 # Fast-fail period before trial calls
+    'HALF_OPEN_CALLS': 3,               # Successful trials needed to close again
+}
+
+# /api/batch/ - sub-requests per batch and worker threads for parallel reads
+GATEWAY_BATCH = {
+    'MAX_REQUESTS': 20,
+    'WORKERS': 16,
+}
+
+# Hedged GETs - once a GET has run longer than the service's PERCENTILE latency a second
+# copy goes to another instance and the first answer wins. Hedges are capped at
+# BUDGET_PERCENT of requests; MIN_SAMPLES latencies are needed before hedging starts.
+REQUEST_HEDGING = {
+    'ENABLED': True,
+    'SERVICES': ['book', 'customer'],
+    'PERCENTILE': 95,
+    'MIN_DELAY_MS': 10,
+    'MIN_SAMPLES': 50,
+    'WINDOW_SIZE': 500,
+    'BUDGET_PERCENT': 10,
+    'WORKERS': 64,
+}
+
+# Request deadlines - each request gets a budget by route (URL name), capped by any
+# X-Deadline-Ms header from the client. The time left is passed downstream in
+# X-Deadline-Ms and caps every downstream timeout; expired work is rejected with 504.
+REQUEST_DEADLINES = {
+    'DEFAULT_MS': 10000,
+    'ROUTES': {
+        'customer-list': 5000,
+        'customer-detail': 3000,
+        'customer-dashboard': 5000,
+        'book-list': 3000,
+        'book-detail': 3000,
+        'cart': 3000,
+        'cart-checkout': 15000,
+        'batch': 15000,
+    },
+}
+
+# Admission control - an AIMD concurrency limit per downstream service; requests over it
+# wait up to MAX_QUEUE_MS, then get 503 with Retry-After. A priority may only use
+# HEADROOM of the limit, so catalog browsing is shed before checkout.
+ADMISSION_CONTROL = {
+    'ENABLED': True,
+    'INITIAL_LIMIT': 100,
+    'MIN_LIMIT': 10,
+    'MAX_LIMIT': 1000,
+    'BACKOFF_RATIO': 0.9,
+    'SLOW_MS': 2000,
+    'RETRY_AFTER_SECONDS': 1,
+    'PRIORITIES': {
+        'checkout': {'HEADROOM': 1.0, 'MAX_QUEUE_MS': 250},
+        'default': {'HEADROOM': 0.9, 'MAX_QUEUE_MS': 25},
+        'catalog': {'HEADROOM': 0.75, 'MAX_QUEUE_MS': 0},
+    },
+    # URL name -> (downstream service, priority[, weight function])
+    'ROUTES': {
+        # Held for the whole batch, one slot per sub-request; each sub-request is
+        # also admitted against its own service
+        'batch': ('batch', 'default', 'gateway.batch.batch_weight'),
+        'customer-list': ('customer', 'default'),
+        'customer-detail': ('customer', 'default'),
+        'customer-dashboard': ('customer', 'default'),
+        'book-list': ('book', 'catalog'),
+        'book-detail': ('book', 'catalog'),
+        'cart': ('cart', 'default'),
+        'cart-add-item': ('cart', 'default'),
+        'cart-remove-item': ('cart', 'default'),
+        'cart-update-quantity': ('cart', 'default'),
+        'cart-clear': ('cart', 'default'),
+        'cart-checkout': ('cart', 'checkout'),
+    },
+}
+
+# Idempotency-Key support - the first response to a keyed write is replayed to retries
+# (the key is also passed to cart-service, which does the same)
+IDEMPOTENCY = {
+    'ROUTES': ['cart-add-item', 'cart-checkout'],   # URL names
+    'TTL_SECONDS': 3600,
+    'MAX_ENTRIES': 10000,
+    'MAX_RESPONSE_BYTES': 1024 * 1024,
+}
@@ -1,9 +1,11 @@
 """URL configuration for API Gateway"""
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
+from common.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('gateway.urls')),
     path('health/', lambda r: __import__('django.http', fromlist=['JsonResponse']).JsonResponse({'status': 'healthy', 'service': 'api-gateway'})),
+    re_path(r'^metrics/?$', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,280 @@
+"""
+Admission Control for API Gateway
+Adaptive per-service concurrency limits that shed excess load before it queues
+"""
+import asyncio
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from typing import Optional, Dict, Any, Callable, Tuple
+from common import deadline
+from common.metrics import registry, route_label
+from . import breaker
+
+
+SHED = registry.counter(
+    'gateway_admission_shed_total', 'Requests rejected by admission control', ('service', 'priority')
+)
+QUEUE_TIME = registry.histogram(
+    'gateway_admission_queue_seconds', 'Time requests waited for an admission slot', ('service', 'priority'),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
+LIMIT = registry.gauge(
+    'gateway_admission_limit', 'Current adaptive concurrency limit', ('service',)
+)
+IN_FLIGHT = registry.gauge(
+    'gateway_admission_in_flight', 'Admitted requests currently in flight', ('service',)
+)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for requests bound for one downstream service
+    
+    Each good response raises the limit by 1/limit (about +1 per window of
+    requests) while the limit is in use; a slow or failed response cuts it
+    by backoff_ratio, at most once per round trip. A request may take
+    several slots (a batch of sub-requests), never more than the whole
+    limit so that it can still run on an idle service.
+    """
+    
+    # Poll interval for async waiters, which cannot block on the condition
+    ASYNC_POLL_SECONDS = 0.002
+    
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = 100,
+        min_limit: float = 10,
+        max_limit: float = 1000,
+        backoff_ratio: float = 0.9,
+        slow_seconds: float = 2.0
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.slow_seconds = slow_seconds
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        LIMIT.labels(name).set(self.limit)
+    
+    def _try_acquire(self, headroom: float, weight: int) -> int:
+        capacity = max(int(self.limit * headroom), 1)
+        slots = min(weight, capacity)
+        if self.in_flight + slots > capacity:
+            return 0
+        self.in_flight += slots
+        self.admitted += 1
+        IN_FLIGHT.labels(self.name).inc(slots)
+        return slots
+    
+    def _reject(self) -> int:
+        self.shed += 1
+        return 0
+    
+    def acquire(self, headroom: float, max_wait: float, weight: int = 1) -> int:
+        """Take weight slots below limit * headroom, waiting up to max_wait seconds
+        
+        Returns the number of slots taken, 0 when the request is shed.
+        """
+        with self._cond:
+            slots = self._try_acquire(headroom, weight)
+            if slots:
+                return slots
+            wait_until = time.monotonic() + max_wait
+            while True:
+                left = wait_until - time.monotonic()
+                if left <= 0:
+                    return self._reject()
+                self._cond.wait(left)
+                slots = self._try_acquire(headroom, weight)
+                if slots:
+                    return slots
+    
+    async def aacquire(self, headroom: float, max_wait: float, weight: int = 1) -> int:
+        """Async variant of acquire - polls instead of blocking the event loop"""
+        wait_until = time.monotonic() + max_wait
+        while True:
+            with self._cond:
+                slots = self._try_acquire(headroom, weight)
+                if slots:
+                    return slots
+                if time.monotonic() >= wait_until:
+                    return self._reject()
+            await asyncio.sleep(self.ASYNC_POLL_SECONDS)
+    
+    def release(self, started: float, dropped: bool, slots: int = 1) -> None:
+        """Free a request's slots and adapt the limit to how it went"""
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= slots
+            IN_FLIGHT.labels(self.name).dec(slots)
+            if dropped or now - started > self.slow_seconds:
+                # Requests started before the last cut were already accounted for
+                if started >= self._last_decrease:
+                    self.limit = max(self.limit * self.backoff_ratio, self.min_limit)
+                    self._last_decrease = now
+                    LIMIT.labels(self.name).set(self.limit)
+            elif self.in_flight * 2 >= self.limit:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                LIMIT.labels(self.name).set(self.limit)
+            # A freed slot may be enough for a waiter needing several
+            self._cond.notify_all()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'admitted': self.admitted,
+                'shed': self.shed,
+            }
+
+
+class AdmissionController:
+    """Maps gateway routes to a service limiter and a priority"""
+    
+    def __init__(self, config: Dict[str, Any] = None):
+        config = config or {}
+        self.enabled = config.get('ENABLED', False)
+        self.retry_after = config.get('RETRY_AFTER_SECONDS', 1)
+        # URL name -> (service, priority) or (service, priority, weight function path)
+        self.routes: Dict[str, Tuple[str, ...]] = config.get('ROUTES', {})
+        self.weights: Dict[str, Callable[[Any], int]] = {
+            route: import_string(options[2]) for route, options in self.routes.items() if len(options) > 2
+        }
+        self.priorities = {
+            name: (options.get('HEADROOM', 1.0), options.get('MAX_QUEUE_MS', 0) / 1000)
+            for name, options in config.get('PRIORITIES', {}).items()
+        }
+        options = {
+            'initial_limit': config.get('INITIAL_LIMIT', 100),
+            'min_limit': config.get('MIN_LIMIT', 10),
+            'max_limit': config.get('MAX_LIMIT', 1000),
+            'backoff_ratio': config.get('BACKOFF_RATIO', 0.9),
+            'slow_seconds': config.get('SLOW_MS', 2000) / 1000,
+        }
+        self.limiters = {
+            service_name: AdaptiveLimiter(service_name, **options)
+            for service_name in {options[0] for options in self.routes.values()}
+        }
+    
+    def plan(self, request) -> Optional[Tuple[AdaptiveLimiter, str, float, float, int]]:
+        """(limiter, priority, headroom, max wait, weight) for a request, None if not limited"""
+        if not self.enabled:
+            return None
+        label = route_label(request)
+        route = self.routes.get(label)
+        if route is None:
+            return None
+        service_name, priority = route[:2]
+        weight = self.weights[label](request) if label in self.weights else 1
+        headroom, max_wait = self.priorities.get(priority, (1.0, 0.0))
+        # Never queue past the request's own deadline
+        left = deadline.remaining()
+        if left is not None:
+            max_wait = max(min(max_wait, left), 0.0)
+        return self.limiters[service_name], priority, headroom, max_wait, weight
+    
+    def shed_response(self, limiter: AdaptiveLimiter, priority: str) -> JsonResponse:
+        SHED.labels(limiter.name, priority).inc()
+        response = JsonResponse(
+            {'error': f'Service {limiter.name} overloaded, retry later'},
+            status=503
+        )
+        response['Retry-After'] = str(self.retry_after)
+        return response
+    
+    def stats(self) -> Dict[str, Any]:
+        return {service_name: limiter.stats() for service_name, limiter in self.limiters.items()}
+
+
+# Singleton instance
+admission_controller = AdmissionController(getattr(settings, 'ADMISSION_CONTROL', {}))
+
+
+class AdmissionMiddleware:
+    """Admits or sheds each request before its view runs, by route priority"""
+    
+    sync_capable = True
+    async_capable = True
+    
+    # Downstream statuses that mean the service is struggling
+    DROPPED_STATUSES = (502, 503, 504)
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.controller = admission_controller
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Async handlers would run a sync process_view in a worker thread
+            self.process_view = self._aprocess_view
+    
+    def _admission_result(self, request, limiter: AdaptiveLimiter, priority: str, queued_at: float, slots: int):
+        QUEUE_TIME.labels(limiter.name, priority).observe(time.monotonic() - queued_at)
+        if not slots:
+            return self.controller.shed_response(limiter, priority)
+        request._admission = (limiter, time.monotonic(), slots)
+        return None
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        plan = self.controller.plan(request)
+        if plan is None:
+            return None
+        limiter, priority, headroom, max_wait, weight = plan
+        queued_at = time.monotonic()
+        return self._admission_result(request, limiter, priority, queued_at, limiter.acquire(headroom, max_wait, weight))
+    
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        plan = self.controller.plan(request)
+        if plan is None:
+            return None
+        limiter, priority, headroom, max_wait, weight = plan
+        queued_at = time.monotonic()
+        return self._admission_result(
+            request, limiter, priority, queued_at, await limiter.aacquire(headroom, max_wait, weight)
+        )
+    
+    def _dropped(self, limiter: AdaptiveLimiter, response) -> bool:
+        if response is None:
+            return True
+        if response.status_code == 503 and breaker.fast_failed(limiter.name):
+            # The gateway's own breaker answered - the service saw no extra load
+            return False
+        return response.status_code in self.DROPPED_STATUSES
+    
+    def _release(self, request, response) -> None:
+        admission = getattr(request, '_admission', None)
+        if admission is not None:
+            limiter, started, slots = admission
+            limiter.release(started, self._dropped(limiter, response), slots)
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = breaker.track_fast_fails()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._release(request, response)
+            breaker.stop_tracking_fast_fails(token)
+    
+    async def __acall__(self, request):
+        token = breaker.track_fast_fails()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._release(request, response)
+            breaker.stop_tracking_fast_fails(token)
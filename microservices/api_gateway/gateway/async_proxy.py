@@ -0,0 +1,364 @@
+"""
+Async Service Proxy for API Gateway
+asyncio-based counterpart of ServiceProxy used when the gateway is served through ASGI
+"""
+import asyncio
+import time
+import weakref
+from functools import partial
+import httpx
+from django.conf import settings
+from typing import Optional, Dict, Any, Awaitable, List
+from common.balancer import Instance, LoadBalancer
+from common.deadline import DeadlineExceeded, clamp_timeout, outgoing_headers
+from common.metrics import upstream
+from .balancer import load_balancers
+from .breaker import circuit_breakers, note_fast_fail
+from .cache import response_cache
+from .hedging import hedging_policy
+from .singleflight import AsyncSingleFlight
+
+
+class AsyncRawBody:
+    """Undecoded downstream body streamed through to the client
+    
+    The connection is released once the body is read or iteration stops;
+    aclose() releases the body of a response that is abandoned unread.
+    """
+    
+    def __init__(self, response: httpx.Response):
+        self.response = response
+    
+    async def __aiter__(self):
+        try:
+            async for chunk in self.response.aiter_raw():
+                yield chunk
+        finally:
+            await self.response.aclose()
+    
+    async def aclose(self):
+        await self.response.aclose()
+
+
+class AsyncServiceProxy:
+    """Non-blocking proxy for routing requests to downstream services"""
+    
+    def __init__(self):
+        self.services = getattr(settings, 'SERVICES', {})
+        pool_config = getattr(settings, 'PROXY_POOL', {})
+        self.limits = httpx.Limits(
+            max_connections=pool_config.get('ASYNC_MAX_CONNECTIONS', 1000),
+            max_keepalive_connections=pool_config.get('POOL_MAXSIZE', 20),
+            keepalive_expiry=pool_config.get('MAX_IDLE_SECONDS', 60),
+        )
+        self.timeouts = getattr(settings, 'SERVICE_TIMEOUTS', {})
+        self.timeout = self.timeouts.get('default', (2, 10))
+        self.in_flight: Dict[str, int] = {name: 0 for name in self.services}
+        self.requests: Dict[str, int] = {name: 0 for name in self.services}
+        # httpx clients are bound to the event loop that created them
+        self._clients = weakref.WeakKeyDictionary()
+        self.response_cache = response_cache
+        self.circuit_breakers = circuit_breakers
+        self.load_balancers = load_balancers
+        self.single_flight = AsyncSingleFlight()
+        self.hedging = hedging_policy
+    
+    def _get_balancer(self, service_name: str) -> Optional[LoadBalancer]:
+        """Get the instance balancer for a service, None if not configured"""
+        return self.load_balancers.get(service_name)
+    
+    def _get_timeout(self, service_name: str) -> httpx.Timeout:
+        """Get httpx timeout for a service"""
+        connect, read = self.timeouts.get(service_name, self.timeout)
+        return httpx.Timeout(read, connect=connect)
+    
+    def _get_client(self, service_name: str) -> httpx.AsyncClient:
+        """Get the keep-alive client for a service on the running loop"""
+        loop = asyncio.get_running_loop()
+        clients = self._clients.setdefault(loop, {})
+        client = clients.get(service_name)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self._get_timeout(service_name),
+            )
+            clients[service_name] = client
+        return client
+    
+    @staticmethod
+    def _passthrough_headers(response: httpx.Response, encoded: bool = False) -> Dict[str, str]:
+        """Downstream headers forwarded to the client on passthrough"""
+        headers = {
+            name: response.headers[name]
+            for name in ('Content-Type', 'ETag', 'Last-Modified')
+            if name in response.headers
+        }
+        # Only undecoded (streamed) bodies still carry their content encoding
+        if encoded and 'Content-Encoding' in response.headers:
+            headers['Content-Encoding'] = response.headers['Content-Encoding']
+        return headers
+    
+    async def _make_request(
+        self,
+        method: str,
+        service_name: str,
+        path: str,
+        data: Dict = None,
+        params: Dict = None,
+        raw: bool = False,
+        stream: bool = False,
+        tried: List[Instance] = None,
+        extra_headers: Dict[str, str] = None
+    ) -> Dict[str, Any]:
+        """Make request to downstream service
+        
+        Raw results carry the undecoded body in 'content' plus passthrough
+        headers instead of parsed 'data'; stream makes 'content' an async iterator.
+        Instances in tried are avoided and the chosen one is appended to it.
+        """
+        balancer = self._get_balancer(service_name)
+        if balancer is None:
+            return {
+                'success': False,
+                'status_code': 503,
+                'error': f'Service {service_name} not configured'
+            }
+        
+        headers = {}
+        cache_key = entry = None
+        if method == 'GET' and not stream:
+            cache_key, cache_ttl, entry = self.response_cache.lookup(service_name, path, params)
+            if entry is not None:
+                if entry.is_fresh():
+                    return entry.result(raw)
+                if entry.etag:
+                    headers['If-None-Match'] = entry.etag
+        
+        # Reject early when the request's deadline has passed
+        try:
+            connect, read = clamp_timeout(self.timeouts.get(service_name, self.timeout))
+        except DeadlineExceeded:
+            upstream.rejected(service_name, 'deadline')
+            return {
+                'success': False,
+                'status_code': 504,
+                'error': f'Service {service_name} deadline exceeded'
+            }
+        timeout = httpx.Timeout(read, connect=connect)
+        headers.update(outgoing_headers())
+        if extra_headers:
+            headers.update(extra_headers)
+        
+        # Fast-fail while the service's circuit is open
+        breaker = self.circuit_breakers.get(service_name)
+        if not breaker.allow():
+            upstream.rejected(service_name, 'circuit_open')
+            note_fast_fail(service_name)
+            return {
+                'success': False,
+                'status_code': 503,
+                'error': f'Service {service_name} circuit open'
+            }
+        
+        self.in_flight[service_name] += 1
+        self.requests[service_name] += 1
+        instance = balancer.acquire(exclude=tried or ())
+        if tried is not None:
+            tried.append(instance)
+        healthy = False
+        error = None
+        timer = upstream.started(service_name)
+        try:
+            client = self._get_client(service_name)
+            request = client.build_request(
+                method,
+                f"{instance.url}/api/{path}",
+                json=data if method in ['POST', 'PUT', 'PATCH'] else None,
+                params=params,
+                headers=headers,
+                timeout=timeout,
+            )
+            started = time.monotonic()
+            try:
+                response = await client.send(request, stream=stream)
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except Exception:
+                breaker.record(False, time.monotonic() - started)
+                raise
+            healthy = response.status_code < 500
+            duration = time.monotonic() - started
+            breaker.record(healthy, duration)
+            if method == 'GET' and healthy:
+                self.hedging.observe(service_name, duration)
+            
+            if stream:
+                return {
+                    'success': True,
+                    'status_code': response.status_code,
+                    'content': AsyncRawBody(response),
+                    'headers': self._passthrough_headers(response, encoded=True)
+                }
+            
+            if cache_key is not None and response.status_code == 304 and entry is not None:
+                return self.response_cache.revalidated(cache_key, cache_ttl, entry).result(raw)
+            
+            passthrough_headers = self._passthrough_headers(response)
+            if cache_key is not None:
+                self.response_cache.store(
+                    cache_key, cache_ttl, response.status_code, response.content, passthrough_headers
+                )
+            elif method != 'GET':
+                self.response_cache.invalidate_after_write(service_name, path)
+            
+            if raw:
+                return {
+                    'success': True,
+                    'status_code': response.status_code,
+                    'content': response.content,
+                    'headers': passthrough_headers
+                }
+            return {
+                'success': True,
+                'status_code': response.status_code,
+                'data': response.json() if response.content else None
+            }
+        except asyncio.CancelledError:
+            # Abandoned (e.g. a hedge that lost) - not a failure of the instance
+            healthy = None
+            error = 'cancelled'
+            raise
+        except httpx.TimeoutException:
+            error = 'timeout'
+            return {
+                'success': False,
+                'status_code': 504,
+                'error': f'Service {service_name} timeout'
+            }
+        except httpx.TransportError:
+            error = 'unavailable'
+            return {
+                'success': False,
+                'status_code': 503,
+                'error': f'Service {service_name} unavailable'
+            }
+        except Exception as e:
+            error = 'error'
+            return {
+                'success': False,
+                'status_code': 500,
+                'error': str(e)
+            }
+        finally:
+            self.in_flight[service_name] -= 1
+            balancer.release(instance, healthy)
+            upstream.finished(service_name, method, timer, error or (None if healthy else 'server_error'))
+    
+    @staticmethod
+    def _answered(result: Dict[str, Any]) -> bool:
+        return result['success'] and result['status_code'] < 500
+    
+    @staticmethod
+    async def _discard(task: asyncio.Task) -> None:
+        """Stop a hedged call that lost the race and release its body"""
+        if not task.done():
+            task.cancel()
+            return
+        content = task.result().get('content')
+        if hasattr(content, 'aclose'):
+            await content.aclose()
+    
+    async def _hedged_get(self, service_name: str, path: str, params: Dict = None, **options) -> Dict[str, Any]:
+        """GET that sends a second copy, preferably to another instance, when slow
+        
+        The copy goes out once the call has run longer than the service's
+        percentile latency and the hedge budget allows it. The first good
+        answer wins and the other call is cancelled.
+        """
+        call = partial(self._make_request, 'GET', service_name, path, params=params, **options)
+        if self.response_cache.has_fresh(service_name, path, params):
+            return await call()
+        delay = self.hedging.delay_for(service_name)
+        if delay is None:
+            return await call()
+        
+        tried: List[Instance] = []
+        primary = asyncio.ensure_future(call(tried=tried))
+        done, _ = await asyncio.wait((primary,), timeout=delay)
+        if done or not self.hedging.try_hedge(service_name):
+            return await primary
+        
+        hedge = asyncio.ensure_future(call(tried=tried))
+        try:
+            done, _ = await asyncio.wait((primary, hedge), return_when=asyncio.FIRST_COMPLETED)
+            winner, loser = (primary, hedge) if primary in done else (hedge, primary)
+            if not self._answered(winner.result()):
+                # The first copy failed - the other one may still succeed
+                await asyncio.wait((loser,))
+                if self._answered(loser.result()):
+                    winner, loser = loser, winner
+        except asyncio.CancelledError:
+            primary.cancel()
+            hedge.cancel()
+            raise
+        if winner is hedge:
+            self.hedging.record_win(service_name)
+        await self._discard(loser)
+        return winner.result()
+    
+    async def get(self, service_name: str, path: str, params: Dict = None) -> Dict[str, Any]:
+        # Identical concurrent GETs share one downstream call, unless a write came in between
+        key = self.response_cache.flight_key(service_name, path, params)
+        return await self.single_flight.do(key, lambda: self._hedged_get(service_name, path, params))
+    
+    async def passthrough(self, service_name: str, path: str, params: Dict = None) -> Dict[str, Any]:
+        """GET returning the raw downstream body for routes that only forward it
+        
+        Cacheable routes are buffered so the cache and coalesced callers can
+        share the bytes; other routes stream straight from the connection.
+        """
+        if self.response_cache.ttl_for(service_name, path) is None:
+            return await self._hedged_get(service_name, path, params, stream=True)
+        key = self.response_cache.flight_key(service_name, path, params, raw=True)
+        return await self.single_flight.do(
+            key, lambda: self._hedged_get(service_name, path, params, raw=True)
+        )
+    
+    async def post(self, service_name: str, path: str, data: Dict = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return await self._make_request('POST', service_name, path, data=data, extra_headers=headers)
+    
+    async def put(self, service_name: str, path: str, data: Dict = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return await self._make_request('PUT', service_name, path, data=data, extra_headers=headers)
+    
+    async def patch(self, service_name: str, path: str, data: Dict = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return await self._make_request('PATCH', service_name, path, data=data, extra_headers=headers)
+    
+    async def delete(self, service_name: str, path: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return await self._make_request('DELETE', service_name, path, extra_headers=headers)
+    
+    async def gather(self, *calls: Awaitable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fan out several downstream calls concurrently"""
+        return list(await asyncio.gather(*calls))
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Response cache hit/miss and request coalescing counters"""
+        return {**self.response_cache.stats(), 'single_flight': self.single_flight.stats()}
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """In-flight and total request counters per service, plus instance load"""
+        balancer_stats = self.load_balancers.stats()
+        return {
+            service_name: {
+                'in_flight': self.in_flight.get(service_name, 0),
+                'requests': self.requests.get(service_name, 0),
+                'max_keepalive_connections': self.limits.max_keepalive_connections,
+                'instances': balancer_stats.get(service_name, []),
+                'hedging': self.hedging.stats(service_name),
+            }
+            for service_name in self.services
+        }
+
+
+# Singleton instance
+async_service_proxy = AsyncServiceProxy()
@@ -0,0 +1,284 @@
+"""
+Async API Gateway Views
+Non-blocking counterparts of the gateway views, served through ASGI
+"""
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.urls import Resolver404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from common.idempotency import idempotency_headers
+from .admission import admission_controller
+from .async_proxy import async_service_proxy
+from .batch import (
+    BatchError, arender_subresponse, build_subrequest, not_found,
+    parse_batch, plan_groups, subrequest_handler
+)
+from .cache import not_modified
+from .composition import cart_book_ids, compose_dashboard
+from .proxy import service_proxy
+
+
+def _proxy_response(result, error_default=None):
+    """Render a proxy result the same way the sync views do"""
+    if result['success']:
+        if result['data'] is None:
+            return HttpResponse(status=result['status_code'])
+        return JsonResponse(result['data'], status=result['status_code'], safe=False)
+    return JsonResponse(
+        {'error': result.get('error', error_default)},
+        status=result['status_code']
+    )
+
+
+def _passthrough_response(result, error_default=None, request=None):
+    """Send a raw proxy result to the client without decoding the body
+    
+    Given the request, a client whose conditional headers still match the
+    downstream validators gets 304 instead of the body.
+    """
+    if not result['success']:
+        return JsonResponse({'error': result.get('error', error_default)}, status=result['status_code'])
+    if request is not None and result['status_code'] == 200 and isinstance(result['content'], bytes):
+        response = not_modified(request, result['headers'])
+        if response is not None:
+            return response
+    if isinstance(result['content'], bytes):
+        response = HttpResponse(result['content'], status=result['status_code'])
+    else:
+        response = StreamingHttpResponse(result['content'], status=result['status_code'])
+    for header, value in result['headers'].items():
+        response[header] = value
+    return response
+
+
+def _book_page_params(query) -> dict:
+    """Keyset pagination parameters to forward to book-service list endpoints"""
+    return {name: query[name] for name in ('cursor', 'page_size') if query.get(name)}
+
+
+class AsyncProxyView(View):
+    """Base view for async proxy routes - exempt from CSRF like DRF APIView"""
+    
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+    
+    def json_body(self, request):
+        """Parse the JSON request body, None when empty"""
+        if not request.body:
+            return None
+        return json.loads(request.body)
+    
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except json.JSONDecodeError:
+            return JsonResponse({'detail': 'JSON parse error'}, status=400)
+
+
+class HealthCheckView(AsyncProxyView):
+    """Health check for all services - served from the shared health monitor"""
+    
+    async def get(self, request):
+        health = await sync_to_async(service_proxy.health_check, thread_sensitive=False)()
+        all_healthy = all(s.get('healthy', False) for s in health.values())
+        return JsonResponse({
+            'gateway': 'healthy',
+            'services': health,
+            'all_healthy': all_healthy
+        })
+
+
+class PoolStatsView(AsyncProxyView):
+    """In-flight and request counters per service"""
+    
+    async def get(self, request):
+        return JsonResponse(async_service_proxy.pool_stats())
+
+
+class CacheStatsView(AsyncProxyView):
+    """Response cache hit/miss counters"""
+    
+    async def get(self, request):
+        return JsonResponse(async_service_proxy.cache_stats())
+
+
+class AdmissionStatsView(AsyncProxyView):
+    """Adaptive concurrency limits and shed counters per service"""
+    
+    async def get(self, request):
+        return JsonResponse(admission_controller.stats())
+
+
+class BatchView(AsyncProxyView):
+    """Several gateway calls in one round trip - consecutive reads run concurrently"""
+    
+    async def post(self, request):
+        try:
+            items = parse_batch(self.json_body(request))
+        except BatchError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        results = [None] * len(items)
+        for group in plan_groups(items):
+            outcomes = await asyncio.gather(*(self._dispatch(request, items[index]) for index in group))
+            for index, outcome in zip(group, outcomes):
+                results[index] = outcome
+        return JsonResponse({'responses': results})
+    
+    async def _dispatch(self, request, item):
+        try:
+            sub_request = build_subrequest(request, item)
+        except Resolver404:
+            return not_found(item)
+        return await arender_subresponse(await subrequest_handler(is_async=True).get_response_async(sub_request))
+
+
+# ==================== Customer Routes ====================
+
+class CustomerListView(AsyncProxyView):
+    """Proxy for customer list/create"""
+    
+    async def get(self, request):
+        return _passthrough_response(await async_service_proxy.passthrough('customer', 'customers/'))
+    
+    async def post(self, request):
+        result = await async_service_proxy.post('customer', 'customers/', data=self.json_body(request))
+        return _proxy_response(result)
+
+
+class CustomerDetailView(AsyncProxyView):
+    """Proxy for customer detail/update/delete"""
+    
+    async def get(self, request, customer_id):
+        result = await async_service_proxy.passthrough('customer', f'customers/{customer_id}/')
+        return _passthrough_response(result, 'Not found')
+    
+    async def put(self, request, customer_id):
+        result = await async_service_proxy.put('customer', f'customers/{customer_id}/', data=self.json_body(request))
+        return _proxy_response(result)
+    
+    async def delete(self, request, customer_id):
+        result = await async_service_proxy.delete('customer', f'customers/{customer_id}/')
+        if result['success']:
+            return HttpResponse(status=204)
+        return _proxy_response(result)
+
+
+class CustomerDashboardView(AsyncProxyView):
+    """Customer, cart and current book data in one response"""
+    
+    async def get(self, request, customer_id):
+        customer, cart = await async_service_proxy.gather(
+            async_service_proxy.get('customer', f'customers/{customer_id}/'),
+            async_service_proxy.get('cart', f'carts/by-customer/{customer_id}/'),
+        )
+        if not customer['success']:
+            return JsonResponse({'error': customer['error']}, status=customer['status_code'])
+        if customer['status_code'] != 200:
+            return JsonResponse(customer['data'], status=customer['status_code'], safe=False)
+        
+        books = None
+        book_ids = cart_book_ids(cart)
+        if book_ids:
+            books = await async_service_proxy.get('book', 'books/bulk_get/', params={'ids': ','.join(book_ids)})
+        return JsonResponse(compose_dashboard(customer, cart, books))
+
+
+# ==================== Book Routes ====================
+
+class BookListView(AsyncProxyView):
+    """Proxy for book list/create"""
+    
+    async def get(self, request):
+        page_params = _book_page_params(request.GET)
+        if request.GET.get('q'):
+            result = await async_service_proxy.passthrough('book', 'books/search/', params={'q': request.GET['q'], **page_params})
+        elif request.GET.get('in_stock'):
+            result = await async_service_proxy.passthrough('book', 'books/in_stock/', params=page_params)
+        else:
+            result = await async_service_proxy.passthrough('book', 'books/', params=page_params)
+        return _passthrough_response(result, request=request)
+    
+    async def post(self, request):
+        result = await async_service_proxy.post('book', 'books/', data=self.json_body(request))
+        return _proxy_response(result)
+
+
+class BookDetailView(AsyncProxyView):
+    """Proxy for book detail/update/delete"""
+    
+    async def get(self, request, book_id):
+        result = await async_service_proxy.passthrough('book', f'books/{book_id}/')
+        return _passthrough_response(result, 'Not found', request)
+    
+    async def put(self, request, book_id):
+        result = await async_service_proxy.put('book', f'books/{book_id}/', data=self.json_body(request))
+        return _proxy_response(result)
+    
+    async def delete(self, request, book_id):
+        result = await async_service_proxy.delete('book', f'books/{book_id}/')
+        if result['success']:
+            return HttpResponse(status=204)
+        return _proxy_response(result)
+
+
+# ==================== Cart Routes ====================
+
+class CartView(AsyncProxyView):
+    """Proxy for cart operations"""
+    
+    async def get(self, request, customer_id):
+        result = await async_service_proxy.passthrough('cart', f'carts/by-customer/{customer_id}/')
+        return _passthrough_response(result)
+
+
+class CartAddItemView(AsyncProxyView):
+    """Proxy for adding item to cart"""
+    
+    async def post(self, request, customer_id):
+        result = await async_service_proxy.post(
+            'cart', f'carts/{customer_id}/add-item/', data=self.json_body(request), headers=idempotency_headers(request)
+        )
+        return _proxy_response(result, result.get('data', 'Error'))
+
+
+class CartRemoveItemView(AsyncProxyView):
+    """Proxy for removing item from cart"""
+    
+    async def delete(self, request, customer_id, book_id):
+        result = await async_service_proxy.delete('cart', f'carts/{customer_id}/remove-item/{book_id}/')
+        return _proxy_response(result)
+
+
+class CartUpdateQuantityView(AsyncProxyView):
+    """Proxy for updating cart item quantity"""
+    
+    async def put(self, request, customer_id, book_id):
+        result = await async_service_proxy.put(
+            'cart', f'carts/{customer_id}/update-quantity/{book_id}/', data=self.json_body(request)
+        )
+        return _proxy_response(result)
+
+
+class CartClearView(AsyncProxyView):
+    """Proxy for clearing cart"""
+    
+    async def delete(self, request, customer_id):
+        result = await async_service_proxy.delete('cart', f'carts/{customer_id}/clear/')
+        return _proxy_response(result)
+
+
+class CartCheckoutView(AsyncProxyView):
+    """Proxy for cart checkout"""
+    
+    async def post(self, request, customer_id):
+        result = await async_service_proxy.post(
+            'cart', f'carts/{customer_id}/checkout/', headers=idempotency_headers(request)
+        )
+        if result['success']:
+            return JsonResponse(result['data'], status=result['status_code'], safe=False)
+        return JsonResponse(result.get('data', {'error': result['error']}), status=result['status_code'], safe=False)
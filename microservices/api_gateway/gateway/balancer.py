@@ -0,0 +1,13 @@
+"""
+Load Balancers for API Gateway
+Per-service instance selection shared by the sync and async proxies
+"""
+from django.conf import settings
+from common.balancer import LoadBalancerRegistry
+
+
+# Singleton instance shared by the sync and async proxies
+load_balancers = LoadBalancerRegistry(
+    getattr(settings, 'SERVICES', {}),
+    getattr(settings, 'LOAD_BALANCER', {})
+)
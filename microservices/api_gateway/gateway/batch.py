@@ -0,0 +1,176 @@
+"""
+Batch Requests for API Gateway
+Dispatches a list of sub-requests through the gateway route table
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve, Resolver404
+from typing import Dict, Any, List
+from common import deadline
+
+ALLOWED_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Parent request META copied onto every sub-request
+INHERITED_META = ('REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'HTTP_HOST', 'HTTP_AUTHORIZATION')
+
+_DEADLINE_META = 'HTTP_' + deadline.DEADLINE_HEADER.upper().replace('-', '_')
+
+_batch_config = getattr(settings, 'GATEWAY_BATCH', {})
+MAX_REQUESTS = _batch_config.get('MAX_REQUESTS', 20)
+
+# Separate from the proxy fan-out pool, which sub-requests may use themselves
+batch_executor = ThreadPoolExecutor(
+    max_workers=_batch_config.get('WORKERS', 16),
+    thread_name_prefix='gateway-batch'
+)
+
+
+class BatchError(ValueError):
+    """Invalid batch payload"""
+
+
+def parse_batch(data: Any, max_requests: int = MAX_REQUESTS) -> List[Dict[str, Any]]:
+    """Validate the batch payload and normalise each sub-request"""
+    sub_requests = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(sub_requests, list) or not sub_requests:
+        raise BatchError("'requests' must be a non-empty list")
+    if len(sub_requests) > max_requests:
+        raise BatchError(f'At most {max_requests} requests per batch')
+    
+    items = []
+    for index, item in enumerate(sub_requests):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise BatchError(f"Request {index}: 'path' is required")
+        method = str(item.get('method', 'GET')).upper()
+        if method not in ALLOWED_METHODS:
+            raise BatchError(f'Request {index}: method {method} not allowed')
+        path, _, query = item['path'].partition('?')
+        path = '/' + path.strip('/') + '/'
+        if path.startswith('/api/'):
+            path = path[len('/api'):]
+        items.append({
+            'method': method,
+            'path': path,
+            'query': query,
+            'body': item.get('body'),
+            'headers': item.get('headers') or {},
+        })
+    return items
+
+
+def plan_groups(items: List[Dict[str, Any]]) -> List[List[int]]:
+    """Group item indices so consecutive reads run together and writes run alone
+    
+    Writes act as barriers, so a read listed after a write sees its effect.
+    """
+    groups: List[List[int]] = []
+    for index, item in enumerate(items):
+        if item['method'] == 'GET' and groups and items[groups[-1][0]]['method'] == 'GET':
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+    return groups
+
+
+def batch_weight(request) -> int:
+    """Admission weight of a batch - its number of sub-requests"""
+    try:
+        sub_requests = json.loads(request.body).get('requests')
+    except (ValueError, AttributeError):
+        return 1
+    return min(max(len(sub_requests), 1), MAX_REQUESTS) if isinstance(sub_requests, list) else 1
+
+
+def build_subrequest(parent: HttpRequest, item: Dict[str, Any]) -> HttpRequest:
+    """Check a sub-request against the gateway routes and build its request
+    
+    Raises Resolver404 for unknown or non-batchable routes. The request
+    carries the batch's remaining deadline, tightening any the item gives.
+    """
+    match = resolve(item['path'], urlconf='gateway.urls')
+    if match.url_name == 'batch':
+        raise Resolver404({'path': item['path']})
+    
+    request = HttpRequest()
+    request.method = item['method']
+    request.path = request.path_info = '/api' + item['path']
+    request.META = {key: parent.META[key] for key in INHERITED_META if key in parent.META}
+    request.META['REQUEST_METHOD'] = item['method']
+    request.META['QUERY_STRING'] = item['query']
+    request.GET = QueryDict(item['query'])
+    for header, value in item['headers'].items():
+        request.META['HTTP_' + header.upper().replace('-', '_')] = str(value)
+    left = deadline.remaining()
+    if left is not None:
+        budget_ms = max(int(left * 1000), 0)
+        given = request.META.get(_DEADLINE_META, '')
+        if not given.isdigit() or budget_ms < int(given):
+            request.META[_DEADLINE_META] = str(budget_ms)
+    
+    payload = json.dumps(item['body']).encode() if item['body'] is not None else b''
+    request.META['CONTENT_TYPE'] = 'application/json'
+    request.META['CONTENT_LENGTH'] = str(len(payload))
+    request._stream = BytesIO(payload)
+    request._read_started = False
+    return request
+
+
+class SubrequestHandler(BaseHandler):
+    """Runs sub-requests through the full gateway middleware - deadlines,
+    idempotency and admission control apply as if each had been sent alone"""
+    
+    def __init__(self, is_async: bool = False):
+        super().__init__()
+        self.load_middleware(is_async=is_async)
+
+
+_handlers: Dict[bool, SubrequestHandler] = {}
+_handlers_lock = threading.Lock()
+
+
+def subrequest_handler(is_async: bool = False) -> SubrequestHandler:
+    """Shared handler, built on first use once the middleware can be imported"""
+    handler = _handlers.get(is_async)
+    if handler is None:
+        with _handlers_lock:
+            handler = _handlers.get(is_async)
+            if handler is None:
+                handler = _handlers[is_async] = SubrequestHandler(is_async)
+    return handler
+
+
+def not_found(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {'status': 404, 'body': {'error': f"No route for {item['path']}"}}
+
+
+def _decode(content: bytes) -> Any:
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode('utf-8', errors='replace')
+
+
+def render_subresponse(response) -> Dict[str, Any]:
+    """Per-item status and decoded body of a view response"""
+    if getattr(response, 'streaming', False):
+        content = b''.join(response.streaming_content)
+    else:
+        if hasattr(response, 'render'):
+            response.render()
+        content = response.content
+    return {'status': response.status_code, 'body': _decode(content)}
+
+
+async def arender_subresponse(response) -> Dict[str, Any]:
+    """Async variant of render_subresponse for async streaming bodies"""
+    if getattr(response, 'streaming', False) and response.is_async:
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        return {'status': response.status_code, 'body': _decode(content)}
+    return render_subresponse(response)
@@ -0,0 +1,175 @@
+"""
+Circuit Breakers for API Gateway
+Fast-fail calls to a downstream service that keeps failing or answering slowly
+"""
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from django.conf import settings
+from typing import Dict, Any, Optional, Set
+
+
+# Services whose open circuit fast-failed a call made for the request being served
+_fast_failed: ContextVar[Optional[Set[str]]] = ContextVar('breaker_fast_failed', default=None)
+
+
+def track_fast_fails():
+    """Start recording fast-fails for the current request - returns the token to reset"""
+    return _fast_failed.set(set())
+
+
+def stop_tracking_fast_fails(token) -> None:
+    _fast_failed.reset(token)
+
+
+def note_fast_fail(service_name: str) -> None:
+    """Record that the service's breaker answered the current request instead of the service"""
+    services = _fast_failed.get()
+    if services is not None:
+        services.add(service_name)
+
+
+def fast_failed(service_name: str) -> bool:
+    """Whether the service's breaker fast-failed a call for the current request"""
+    services = _fast_failed.get()
+    return services is not None and service_name in services
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a sliding window of recent calls"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(
+        self,
+        window_size: int = 20,
+        minimum_calls: int = 10,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 2.0,
+        slow_call_rate_threshold: float = 0.8,
+        open_seconds: float = 10.0,
+        half_open_calls: int = 3
+    ):
+        self.minimum_calls = minimum_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._window = deque(maxlen=window_size)  # (failed, slow) per call
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._trial_successes = 0
+        self.rejected = 0
+        self.times_opened = 0
+    
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+    
+    def _rates(self):
+        calls = len(self._window)
+        if not calls:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow = sum(1 for _, is_slow in self._window if is_slow)
+        return failures / calls, slow / calls
+    
+    def allow(self) -> bool:
+        """Whether a call may go downstream - False means fast-fail"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_calls = 0
+                self._trial_successes = 0
+            if self.state == self.HALF_OPEN:
+                if self._trial_calls >= self.half_open_calls:
+                    self.rejected += 1
+                    return False
+                self._trial_calls += 1
+            return True
+    
+    def record(self, success: bool, duration: float) -> None:
+        """Record the outcome of a call that was allowed through"""
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if not success or slow:
+                    self._open()
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self.state = self.CLOSED
+                    self._window.clear()
+                return
+            if self.state == self.OPEN:
+                return
+            self._window.append((not success, slow))
+            if len(self._window) < self.minimum_calls:
+                return
+            failure_rate, slow_rate = self._rates()
+            if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                self._open()
+                self._window.clear()
+    
+    def abandon(self) -> None:
+        """A call that was allowed through was cancelled before it finished"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._trial_calls:
+                # Free its trial slot so the half-open probe can complete
+                self._trial_calls -= 1
+    
+    def state_info(self) -> Dict[str, Any]:
+        with self._lock:
+            failure_rate, slow_rate = self._rates()
+            info = {
+                'state': self.state,
+                'failure_rate': round(failure_rate, 4),
+                'slow_call_rate': round(slow_rate, 4),
+                'calls_in_window': len(self._window),
+                'rejected': self.rejected,
+                'times_opened': self.times_opened,
+            }
+            if self.state == self.OPEN:
+                info['retry_in_seconds'] = round(
+                    max(self.open_seconds - (time.monotonic() - self._opened_at), 0), 3
+                )
+            return info
+
+
+class CircuitBreakerRegistry:
+    """One breaker per downstream service, created on first use"""
+    
+    def __init__(self, config: Dict[str, Any] = None):
+        config = config or {}
+        self.options = {
+            'window_size': config.get('WINDOW_SIZE', 20),
+            'minimum_calls': config.get('MINIMUM_CALLS', 10),
+            'failure_rate_threshold': config.get('FAILURE_RATE_THRESHOLD', 0.5),
+            'slow_call_seconds': config.get('SLOW_CALL_SECONDS', 2.0),
+            'slow_call_rate_threshold': config.get('SLOW_CALL_RATE_THRESHOLD', 0.8),
+            'open_seconds': config.get('OPEN_SECONDS', 10.0),
+            'half_open_calls': config.get('HALF_OPEN_CALLS', 3),
+        }
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, service_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(service_name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(service_name, CircuitBreaker(**self.options))
+        return breaker
+
+
+# Singleton instance shared by the sync and async proxies
+circuit_breakers = CircuitBreakerRegistry(getattr(settings, 'CIRCUIT_BREAKER', {}))
@@ -0,0 +1,230 @@
+"""
+Response Cache for API Gateway
+LRU cache of downstream GET responses with per-route TTLs and ETag revalidation
+"""
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from typing import Optional, Dict, Any, Tuple, List
+
+
+# Marker for entries whose JSON body has not been decoded yet
+_UNDECODED = object()
+
+
+class CacheEntry:
+    """Cached downstream response - raw bytes, JSON decoded on first use"""
+    
+    __slots__ = ('status_code', 'content', 'headers', 'expires_at', '_data')
+    
+    def __init__(
+        self,
+        status_code: int,
+        content: bytes,
+        headers: Dict[str, str],
+        ttl: float,
+        data: Any = _UNDECODED
+    ):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.expires_at = time.monotonic() + ttl
+        self._data = data
+    
+    @property
+    def etag(self) -> Optional[str]:
+        return self.headers.get('ETag')
+    
+    @property
+    def data(self) -> Any:
+        if self._data is _UNDECODED:
+            self._data = json.loads(self.content) if self.content else None
+        return self._data
+    
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+    
+    def renewed(self, ttl: float) -> 'CacheEntry':
+        return CacheEntry(self.status_code, self.content, self.headers, ttl, self._data)
+    
+    def result(self, raw: bool = False) -> Dict[str, Any]:
+        """Proxy result for this entry - data is shared and must not be mutated"""
+        if raw:
+            return {
+                'success': True,
+                'status_code': self.status_code,
+                'content': self.content,
+                'headers': dict(self.headers)
+            }
+        return {
+            'success': True,
+            'status_code': self.status_code,
+            'data': self.data
+        }
+
+
+def not_modified(request, headers: Dict[str, str]):
+    """304 when the client already holds this downstream response, judged by its ETag and Last-Modified"""
+    if request.method not in ('GET', 'HEAD') or not ('ETag' in headers or 'Last-Modified' in headers):
+        return None
+    response = get_conditional_response(
+        request,
+        etag=headers.get('ETag'),
+        last_modified=parse_http_date_safe(headers.get('Last-Modified', ''))
+    )
+    if response is not None and response.status_code == 304:
+        for name in ('ETag', 'Last-Modified'):
+            if name in headers:
+                response[name] = headers[name]
+        return response
+    return None
+
+
+class ResponseCache:
+    """Thread-safe LRU cache keyed by service, path and query params"""
+    
+    def __init__(
+        self,
+        routes: Dict[str, List[Tuple[str, float]]] = None,
+        max_entries: int = 1024,
+        invalidates: Dict[str, List[Tuple[str, List[str]]]] = None
+    ):
+        self.routes = {
+            service_name: [(re.compile(pattern), ttl) for pattern, ttl in patterns]
+            for service_name, patterns in (routes or {}).items()
+        }
+        # Writes that change another service's data, e.g. checkout lowering book stock
+        self.invalidates = {
+            service_name: [(re.compile(pattern), others) for pattern, others in patterns]
+            for service_name, patterns in (invalidates or {}).items()
+        }
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[tuple, CacheEntry]' = OrderedDict()
+        # Bumped on invalidation so in-flight misses cannot store stale data
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def ttl_for(self, service_name: str, path: str) -> Optional[float]:
+        """TTL of the first route pattern matching the path, None if not cacheable"""
+        for pattern, ttl in self.routes.get(service_name, ()):
+            if pattern.match(path):
+                return ttl
+        return None
+    
+    def has_fresh(self, service_name: str, path: str, params: Dict = None) -> bool:
+        """Whether a fresh entry exists - without LRU or hit/miss bookkeeping"""
+        if self.ttl_for(service_name, path) is None:
+            return False
+        key = self.make_key(service_name, path, params)
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and entry.is_fresh()
+    
+    def make_key(self, service_name: str, path: str, params: Dict = None) -> tuple:
+        with self._lock:
+            generation = self._generations.get(service_name, 0)
+        return (service_name, path, tuple(sorted((params or {}).items())), generation)
+    
+    def flight_key(self, service_name: str, path: str, params: Dict = None, raw: bool = False) -> tuple:
+        """Single-flight key for a GET - cacheable or not
+        
+        It carries the service's generation, so a GET made after a write to
+        the service never joins a call that started before the write.
+        """
+        return ('raw' if raw else 'data',) + self.make_key(service_name, path, params)
+    
+    def lookup(self, service_name: str, path: str, params: Dict = None) -> Tuple[Optional[tuple], Optional[float], Optional[CacheEntry]]:
+        """Return (key, ttl, entry) - key is None when the route is not cached"""
+        ttl = self.ttl_for(service_name, path)
+        if ttl is None:
+            return None, None, None
+        key = self.make_key(service_name, path, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry.is_fresh():
+                    self.hits += 1
+                    return key, ttl, entry
+            self.misses += 1
+        return key, ttl, entry
+    
+    def store(
+        self,
+        key: tuple,
+        ttl: float,
+        status_code: int,
+        content: bytes,
+        headers: Dict[str, str],
+        data: Any = _UNDECODED
+    ) -> None:
+        """Cache a successful response"""
+        if status_code != 200:
+            return
+        with self._lock:
+            if key[3] != self._generations.get(key[0], 0):
+                return
+            self._entries[key] = CacheEntry(status_code, content, headers, ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def revalidated(self, key: tuple, ttl: float, entry: CacheEntry) -> CacheEntry:
+        """Downstream answered 304 - keep the entry for another TTL"""
+        fresh = entry.renewed(ttl)
+        with self._lock:
+            self.revalidations += 1
+            if key in self._entries:
+                self._entries[key] = fresh
+        return fresh
+    
+    def invalidate(self, service_name: str) -> None:
+        """Drop every cached response of a service after a write"""
+        with self._lock:
+            self._generations[service_name] = self._generations.get(service_name, 0) + 1
+            keys = [key for key in self._entries if key[0] == service_name]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+    
+    def invalidate_after_write(self, service_name: str, path: str) -> None:
+        """Drop the written service's responses and those of services the write also changes"""
+        self.invalidate(service_name)
+        for pattern, others in self.invalidates.get(service_name, ()):
+            if pattern.match(path):
+                for other in others:
+                    self.invalidate(other)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+# Singleton instance shared by the sync and async proxies
+_cache_config = getattr(settings, 'GATEWAY_CACHE', {})
+response_cache = ResponseCache(
+    routes=_cache_config.get('ROUTES'),
+    max_entries=_cache_config.get('MAX_ENTRIES', 1024),
+    invalidates=_cache_config.get('INVALIDATES')
+)
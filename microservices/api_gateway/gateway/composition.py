@@ -0,0 +1,57 @@
+"""
+Response Composition for API Gateway
+Builds backend-for-frontend documents out of several downstream results
+"""
+from typing import Dict, Any, List
+
+
+def _ok(result: Dict[str, Any]) -> bool:
+    return result['success'] and result['status_code'] == 200
+
+
+def _error(result: Dict[str, Any]) -> Any:
+    return result.get('error') or result.get('data') or f"Status {result['status_code']}"
+
+
+def cart_book_ids(cart_result: Dict[str, Any]) -> List[str]:
+    """Distinct book ids referenced by a cart result"""
+    if not _ok(cart_result):
+        return []
+    return sorted({item['book_id'] for item in cart_result['data'].get('items', [])})
+
+
+def compose_dashboard(
+    customer_result: Dict[str, Any],
+    cart_result: Dict[str, Any],
+    books_result: Dict[str, Any] = None
+) -> Dict[str, Any]:
+    """Customer, cart and current book data as one document
+    
+    Downstream data may be shared with the response cache, so new dicts
+    are built instead of mutating it. Cart or book failures degrade to
+    partial data listed under 'errors'.
+    """
+    errors = {}
+    cart = None
+    if _ok(cart_result):
+        books = {}
+        if books_result is not None:
+            if _ok(books_result):
+                books = {book['id']: book for book in books_result['data']}
+            else:
+                errors['book'] = _error(books_result)
+        cart = {
+            **cart_result['data'],
+            'items': [
+                {**item, 'book': books.get(item['book_id'])}
+                for item in cart_result['data'].get('items', [])
+            ]
+        }
+    else:
+        errors['cart'] = _error(cart_result)
+    
+    return {
+        'customer': customer_result['data'],
+        'cart': cart,
+        'errors': errors
+    }
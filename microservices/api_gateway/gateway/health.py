@@ -0,0 +1,78 @@
+"""
+Health Monitor for API Gateway
+Probes downstream services concurrently and serves cached results
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterable
+
+
+class HealthMonitor:
+    """Caches service health probes and refreshes them in the background"""
+    
+    def __init__(
+        self,
+        services: Iterable[str],
+        probe: Callable[[str], Dict[str, Any]],
+        freshness: float = 5.0
+    ):
+        self.services = list(services)
+        self.probe = probe
+        self.freshness = freshness
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(len(self.services), 1),
+            thread_name_prefix='health-probe'
+        )
+    
+    def _timed_probe(self, service_name: str) -> Dict[str, Any]:
+        started = time.monotonic()
+        result = dict(self.probe(service_name))
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 2)
+        return result
+    
+    def refresh(self) -> None:
+        """Probe every service concurrently and store the results"""
+        try:
+            results = self._executor.map(self._timed_probe, self.services)
+            for service_name, result in zip(self.services, results):
+                with self._lock:
+                    self._results[service_name] = result
+                    self._checked_at[service_name] = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+    
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name='health-refresh', daemon=True).start()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return cached results, refreshing stale ones in the background"""
+        if not self._results:
+            # Nothing cached yet - the first caller waits for one probe round
+            with self._lock:
+                self._refreshing = True
+            self.refresh()
+        
+        now = time.monotonic()
+        with self._lock:
+            oldest = min(self._checked_at.values(), default=now)
+            results = {
+                service_name: {
+                    **result,
+                    'age_seconds': round(now - self._checked_at[service_name], 3)
+                }
+                for service_name, result in self._results.items()
+            }
+        
+        if now - oldest > self.freshness:
+            self._refresh_in_background()
+        return results
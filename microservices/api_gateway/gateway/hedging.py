@@ -0,0 +1,137 @@
+"""
+Request Hedging for API Gateway
+Decides when a slow idempotent GET gets a second copy, within a load budget
+"""
+import threading
+from collections import deque
+from django.conf import settings
+from typing import Optional, Dict, Any, Iterable
+from common.metrics import registry
+
+
+HEDGES = registry.counter(
+    'gateway_hedged_requests_total', 'Hedged GETs by outcome', ('service', 'outcome')
+)
+
+
+class _ServiceHedging:
+    """Recent latencies and hedge budget of one service"""
+    
+    __slots__ = ('latencies', 'delay', 'stale', 'tokens', 'requests', 'hedges', 'wins', 'denied')
+    
+    def __init__(self, window_size: int):
+        self.latencies = deque(maxlen=window_size)
+        self.delay: Optional[float] = None
+        self.stale = 0
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self.denied = 0
+
+
+class HedgingPolicy:
+    """Per-service hedge delay from a latency percentile plus a hedge budget
+    
+    Every hedgeable request earns budget_percent / 100 of a token and every
+    hedge spends a whole one, so hedges stay within that share of requests.
+    """
+    
+    # Observations between percentile recomputations
+    RECOMPUTE_EVERY = 32
+    
+    def __init__(
+        self,
+        services: Iterable[str] = (),
+        percentile: float = 95,
+        min_delay: float = 0.01,
+        min_samples: int = 50,
+        window_size: int = 500,
+        budget_percent: float = 10,
+        max_tokens: float = 10
+    ):
+        self.services = set(services)
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window_size = window_size
+        self.budget_ratio = budget_percent / 100
+        self.max_tokens = max_tokens
+        self._state: Dict[str, _ServiceHedging] = {
+            service_name: _ServiceHedging(window_size) for service_name in self.services
+        }
+        self._lock = threading.Lock()
+    
+    def observe(self, service_name: str, duration: float) -> None:
+        """Record the latency of a successful downstream GET"""
+        state = self._state.get(service_name)
+        if state is None:
+            return
+        with self._lock:
+            state.latencies.append(duration)
+            state.stale += 1
+    
+    def delay_for(self, service_name: str) -> Optional[float]:
+        """Seconds to wait before hedging a GET, None when it should not be hedged"""
+        state = self._state.get(service_name)
+        if state is None:
+            return None
+        with self._lock:
+            state.requests += 1
+            state.tokens = min(state.tokens + self.budget_ratio, self.max_tokens)
+            if len(state.latencies) < self.min_samples:
+                return None
+            if state.delay is None or state.stale >= self.RECOMPUTE_EVERY:
+                ordered = sorted(state.latencies)
+                index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+                state.delay = max(ordered[index], self.min_delay)
+                state.stale = 0
+            return state.delay
+    
+    def try_hedge(self, service_name: str) -> bool:
+        """Spend a budget token on a hedge - False when the budget is exhausted"""
+        state = self._state[service_name]
+        with self._lock:
+            if state.tokens < 1:
+                state.denied += 1
+                allowed = False
+            else:
+                state.tokens -= 1
+                state.hedges += 1
+                allowed = True
+        HEDGES.labels(service_name, 'sent' if allowed else 'budget_exhausted').inc()
+        return allowed
+    
+    def record_win(self, service_name: str) -> None:
+        """The hedge answered before the original request"""
+        with self._lock:
+            self._state[service_name].wins += 1
+        HEDGES.labels(service_name, 'won').inc()
+    
+    def stats(self, service_name: str) -> Optional[Dict[str, Any]]:
+        state = self._state.get(service_name)
+        if state is None:
+            return None
+        with self._lock:
+            return {
+                'delay_ms': round(state.delay * 1000, 2) if state.delay is not None else None,
+                'samples': len(state.latencies),
+                'requests': state.requests,
+                'hedges': state.hedges,
+                'hedge_wins': state.wins,
+                'budget_exhausted': state.denied,
+                'budget_tokens': round(state.tokens, 2),
+            }
+
+
+# Singleton instance shared by the sync and async proxies
+_hedging_config = getattr(settings, 'REQUEST_HEDGING', {})
+hedging_policy = HedgingPolicy(
+    services=_hedging_config.get('SERVICES', ()) if _hedging_config.get('ENABLED', False) else (),
+    percentile=_hedging_config.get('PERCENTILE', 95),
+    min_delay=_hedging_config.get('MIN_DELAY_MS', 10) / 1000,
+    min_samples=_hedging_config.get('MIN_SAMPLES', 50),
+    window_size=_hedging_config.get('WINDOW_SIZE', 500),
+    budget_percent=_hedging_config.get('BUDGET_PERCENT', 10),
+    max_tokens=_hedging_config.get('MAX_BUDGET_TOKENS', 10),
+)
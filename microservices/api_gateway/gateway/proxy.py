@@ -2,9 +2,116 @@
 Service Proxy for API Gateway
 Handles routing requests to downstream services
 """
+import threading
+import time
+from contextvars import copy_context
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from functools import partial
 import requests
 from django.conf import settings
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, Callable, List
+from common.balancer import Instance, LoadBalancer
+from common.deadline import DeadlineExceeded, clamp_timeout, outgoing_headers
+from common.metrics import upstream
+from common.pooling import pool_counters, pooled_session
+from .balancer import load_balancers
+from .breaker import circuit_breakers, note_fast_fail
+from .cache import response_cache
+from .health import HealthMonitor
+from .hedging import hedging_policy
+from .singleflight import SingleFlight
+
+
+class PooledSession:
+    """Keep-alive HTTP session for a single downstream service"""
+    
+    def __init__(self, pool_connections: int, pool_maxsize: int, max_idle: float):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self.session = self._new_session()
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self.recycled = 0
+        # Counters carried over from sessions that were recycled
+        self._retired_requests = 0
+        self._retired_connections = 0
+    
+    def _new_session(self) -> requests.Session:
+        return pooled_session(self.pool_connections, self.pool_maxsize)
+    
+    def _recycle(self):
+        """Drop idle keep-alive connections by replacing the session"""
+        requests_count, connections, _ = pool_counters(self.session)
+        self._retired_requests += requests_count
+        self._retired_connections += connections
+        self.session.close()
+        self.session = self._new_session()
+        self.recycled += 1
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        with self._lock:
+            if self.in_flight == 0 and time.monotonic() - self.last_used > self.max_idle:
+                self._recycle()
+            self.in_flight += 1
+            session = self.session
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.last_used = time.monotonic()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy and connection reuse counters"""
+        with self._lock:
+            requests_count, connections, idle = pool_counters(self.session)
+            total_requests = self._retired_requests + requests_count
+            total_connections = self._retired_connections + connections
+            reused = max(total_requests - total_connections, 0)
+            return {
+                'in_flight': self.in_flight,
+                'idle_connections': idle,
+                'pool_maxsize': self.pool_maxsize,
+                'requests': total_requests,
+                'new_connections': total_connections,
+                'reused_connections': reused,
+                'reuse_ratio': round(reused / total_requests, 4) if total_requests else 0.0,
+                'recycled_sessions': self.recycled,
+                'idle_seconds': round(time.monotonic() - self.last_used, 3),
+            }
+    
+    def close(self):
+        with self._lock:
+            self.session.close()
+
+
+class RawBody:
+    """Undecoded downstream body streamed through to the client
+    
+    Reading it to the end returns the connection to the pool; close() drops
+    the connection of a body that is abandoned, even one never iterated.
+    """
+    
+    def __init__(self, response: requests.Response, chunk_size: int = 64 * 1024):
+        self.response = response
+        self.chunk_size = chunk_size
+        self._released = False
+    
+    def __iter__(self):
+        try:
+            yield from self.response.raw.stream(self.chunk_size, decode_content=False)
+        except BaseException:
+            self.close()
+            raise
+        self.response.raw.release_conn()
+        self._released = True
+    
+    def close(self):
+        if not self._released:
+            self._released = True
+            self.response.close()
 
 
 class ServiceProxy:
@@ -12,95 +119,358 @@ class ServiceProxy:
     
     def __init__(self):
         self.services = getattr(settings, 'SERVICES', {})
-        self.timeout = 10
+        pool_config = getattr(settings, 'PROXY_POOL', {})
+        self.pool_connections = pool_config.get('POOL_CONNECTIONS', 10)
+        self.pool_maxsize = pool_config.get('POOL_MAXSIZE', 20)
+        self.max_idle = pool_config.get('MAX_IDLE_SECONDS', 60)
+        self._fanout = ThreadPoolExecutor(
+            max_workers=pool_config.get('FANOUT_WORKERS', 32),
+            thread_name_prefix='proxy-fanout'
+        )
+        self.timeouts = getattr(settings, 'SERVICE_TIMEOUTS', {})
+        self.timeout = self.timeouts.get('default', (2, 10))
+        self._sessions: Dict[str, PooledSession] = {}
+        self._sessions_lock = threading.Lock()
+        self.response_cache = response_cache
+        self.circuit_breakers = circuit_breakers
+        self.load_balancers = load_balancers
+        self.single_flight = SingleFlight()
+        self.hedging = hedging_policy
+        # Separate from the fan-out pool so gathered calls can hedge without starving it
+        self._hedge_pool = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'REQUEST_HEDGING', {}).get('WORKERS', 64),
+            thread_name_prefix='proxy-hedge'
+        )
+        health_config = getattr(settings, 'HEALTH_CHECK', {})
+        self.health_timeout = health_config.get('TIMEOUT_SECONDS', 2)
+        self.health_monitor = HealthMonitor(
+            self.services,
+            self._probe,
+            freshness=health_config.get('FRESHNESS_SECONDS', 5)
+        )
+    
+    def _get_balancer(self, service_name: str) -> Optional[LoadBalancer]:
+        """Get the instance balancer for a service, None if not configured"""
+        return self.load_balancers.get(service_name)
+    
+    def _get_timeout(self, service_name: str) -> Tuple[float, float]:
+        """Get (connect, read) timeout for a service"""
+        return self.timeouts.get(service_name, self.timeout)
+    
+    def _get_session(self, service_name: str) -> PooledSession:
+        """Get the pooled keep-alive session for a service"""
+        session = self._sessions.get(service_name)
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(service_name)
+                if session is None:
+                    session = PooledSession(self.pool_connections, self.pool_maxsize, self.max_idle)
+                    self._sessions[service_name] = session
+        return session
     
-    def _get_service_url(self, service_name: str) -> Optional[str]:
-        """Get service URL from configuration"""
-        return self.services.get(service_name)
+    @staticmethod
+    def _passthrough_headers(response: requests.Response, encoded: bool = False) -> Dict[str, str]:
+        """Downstream headers forwarded to the client on passthrough"""
+        headers = {
+            name: response.headers[name]
+            for name in ('Content-Type', 'ETag', 'Last-Modified')
+            if name in response.headers
+        }
+        # Only undecoded (streamed) bodies still carry their content encoding
+        if encoded and 'Content-Encoding' in response.headers:
+            headers['Content-Encoding'] = response.headers['Content-Encoding']
+        return headers
     
     def _make_request(
-        self, 
-        method: str, 
-        service_name: str, 
-        path: str, 
-        data: Dict = None, 
-        params: Dict = None
+        self,
+        method: str,
+        service_name: str,
+        path: str,
+        data: Dict = None,
+        params: Dict = None,
+        raw: bool = False,
+        stream: bool = False,
+        tried: List[Instance] = None,
+        extra_headers: Dict[str, str] = None
     ) -> Dict[str, Any]:
-        """Make request to downstream service"""
-        base_url = self._get_service_url(service_name)
-        if not base_url:
+        """Make request to downstream service
+        
+        Raw results carry the undecoded body in 'content' plus passthrough
+        headers instead of parsed 'data'; stream makes 'content' an iterator.
+        Instances in tried are avoided and the chosen one is appended to it.
+        """
+        balancer = self._get_balancer(service_name)
+        if balancer is None:
             return {
                 'success': False,
                 'status_code': 503,
                 'error': f'Service {service_name} not configured'
             }
         
-        url = f"{base_url}/api/{path}"
+        headers = {}
+        cache_key = entry = None
+        if method == 'GET' and not stream:
+            cache_key, cache_ttl, entry = self.response_cache.lookup(service_name, path, params)
+            if entry is not None:
+                if entry.is_fresh():
+                    return entry.result(raw)
+                if entry.etag:
+                    headers['If-None-Match'] = entry.etag
         
+        # Reject early when the request's deadline has passed
         try:
-            response = requests.request(
-                method=method,
-                url=url,
-                json=data if method in ['POST', 'PUT', 'PATCH'] else None,
-                params=params,
-                timeout=self.timeout
-            )
+            timeout = clamp_timeout(self._get_timeout(service_name))
+        except DeadlineExceeded:
+            upstream.rejected(service_name, 'deadline')
+            return {
+                'success': False,
+                'status_code': 504,
+                'error': f'Service {service_name} deadline exceeded'
+            }
+        headers.update(outgoing_headers())
+        if extra_headers:
+            headers.update(extra_headers)
+        
+        # Fast-fail while the service's circuit is open
+        breaker = self.circuit_breakers.get(service_name)
+        if not breaker.allow():
+            upstream.rejected(service_name, 'circuit_open')
+            note_fast_fail(service_name)
+            return {
+                'success': False,
+                'status_code': 503,
+                'error': f'Service {service_name} circuit open'
+            }
+        
+        instance = balancer.acquire(exclude=tried or ())
+        if tried is not None:
+            tried.append(instance)
+        healthy = False
+        error = None
+        timer = upstream.started(service_name)
+        try:
+            started = time.monotonic()
+            try:
+                response = self._get_session(service_name).request(
+                    method=method,
+                    url=f"{instance.url}/api/{path}",
+                    json=data if method in ['POST', 'PUT', 'PATCH'] else None,
+                    params=params,
+                    headers=headers,
+                    timeout=timeout,
+                    stream=stream
+                )
+            except Exception:
+                breaker.record(False, time.monotonic() - started)
+                raise
+            healthy = response.status_code < 500
+            duration = time.monotonic() - started
+            breaker.record(healthy, duration)
+            if method == 'GET' and healthy:
+                self.hedging.observe(service_name, duration)
+            
+            if stream:
+                return {
+                    'success': True,
+                    'status_code': response.status_code,
+                    'content': RawBody(response),
+                    'headers': self._passthrough_headers(response, encoded=True)
+                }
             
+            if cache_key is not None and response.status_code == 304 and entry is not None:
+                return self.response_cache.revalidated(cache_key, cache_ttl, entry).result(raw)
+            
+            passthrough_headers = self._passthrough_headers(response)
+            if cache_key is not None:
+                self.response_cache.store(
+                    cache_key, cache_ttl, response.status_code, response.content, passthrough_headers
+                )
+            elif method != 'GET':
+                self.response_cache.invalidate_after_write(service_name, path)
+            
+            if raw:
+                return {
+                    'success': True,
+                    'status_code': response.status_code,
+                    'content': response.content,
+                    'headers': passthrough_headers
+                }
             return {
                 'success': True,
                 'status_code': response.status_code,
                 'data': response.json() if response.content else None
             }
         except requests.exceptions.Timeout:
+            error = 'timeout'
             return {
                 'success': False,
                 'status_code': 504,
                 'error': f'Service {service_name} timeout'
             }
         except requests.exceptions.ConnectionError:
+            error = 'unavailable'
             return {
                 'success': False,
                 'status_code': 503,
                 'error': f'Service {service_name} unavailable'
             }
         except Exception as e:
+            error = 'error'
             return {
                 'success': False,
                 'status_code': 500,
                 'error': str(e)
             }
+        finally:
+            balancer.release(instance, healthy)
+            upstream.finished(service_name, method, timer, error or (None if healthy else 'server_error'))
+    
+    @staticmethod
+    def _answered(result: Dict[str, Any]) -> bool:
+        return result['success'] and result['status_code'] < 500
+    
+    @staticmethod
+    def _discard(future) -> None:
+        """Release the body of a hedged call that lost the race"""
+        content = future.result().get('content')
+        if hasattr(content, 'close'):
+            content.close()
+    
+    def _hedged_get(self, service_name: str, path: str, params: Dict = None, **options) -> Dict[str, Any]:
+        """GET that sends a second copy, preferably to another instance, when slow
+        
+        The copy goes out once the call has run longer than the service's
+        percentile latency and the hedge budget allows it. The first good
+        answer wins; the loser finishes in the background and is discarded.
+        """
+        call = partial(self._make_request, 'GET', service_name, path, params=params, **options)
+        if self.response_cache.has_fresh(service_name, path, params):
+            return call()
+        delay = self.hedging.delay_for(service_name)
+        if delay is None:
+            return call()
+        
+        tried: List[Instance] = []
+        primary = self._hedge_pool.submit(copy_context().run, call, tried=tried)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self.hedging.try_hedge(service_name):
+            return primary.result()
+        
+        hedge = self._hedge_pool.submit(copy_context().run, call, tried=tried)
+        done, _ = wait((primary, hedge), return_when=FIRST_COMPLETED)
+        winner, loser = (primary, hedge) if primary in done else (hedge, primary)
+        if not self._answered(winner.result()):
+            # The first copy failed - the other one may still succeed
+            wait((loser,))
+            if self._answered(loser.result()):
+                winner, loser = loser, winner
+        if winner is hedge:
+            self.hedging.record_win(service_name)
+        loser.add_done_callback(self._discard)
+        return winner.result()
     
     def get(self, service_name: str, path: str, params: Dict = None) -> Dict[str, Any]:
-        return self._make_request('GET', service_name, path, params=params)
+        # Identical concurrent GETs share one downstream call, unless a write came in between
+        key = self.response_cache.flight_key(service_name, path, params)
+        return self.single_flight.do(key, lambda: self._hedged_get(service_name, path, params))
+    
+    def passthrough(self, service_name: str, path: str, params: Dict = None) -> Dict[str, Any]:
+        """GET returning the raw downstream body for routes that only forward it
+        
+        Cacheable routes are buffered so the cache and coalesced callers can
+        share the bytes; other routes stream straight from the connection.
+        """
+        if self.response_cache.ttl_for(service_name, path) is None:
+            return self._hedged_get(service_name, path, params, stream=True)
+        key = self.response_cache.flight_key(service_name, path, params, raw=True)
+        return self.single_flight.do(
+            key, lambda: self._hedged_get(service_name, path, params, raw=True)
+        )
     
-    def post(self, service_name: str, path: str, data: Dict = None) -> Dict[str, Any]:
-        return self._make_request('POST', service_name, path, data=data)
+    def post(self, service_name: str, path: str, data: Dict = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return self._make_request('POST', service_name, path, data=data, extra_headers=headers)
     
-    def put(self, service_name: str, path: str, data: Dict = None) -> Dict[str, Any]:
-        return self._make_request('PUT', service_name, path, data=data)
+    def put(self, service_name: str, path: str, data: Dict = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return self._make_request('PUT', service_name, path, data=data, extra_headers=headers)
     
-    def patch(self, service_name: str, path: str, data: Dict = None) -> Dict[str, Any]:
-        return self._make_request('PATCH', service_name, path, data=data)
+    def patch(self, service_name: str, path: str, data: Dict = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return self._make_request('PATCH', service_name, path, data=data, extra_headers=headers)
     
-    def delete(self, service_name: str, path: str) -> Dict[str, Any]:
-        return self._make_request('DELETE', service_name, path)
+    def delete(self, service_name: str, path: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        return self._make_request('DELETE', service_name, path, extra_headers=headers)
+    
+    def gather(self, *calls: Callable[[], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run several downstream calls concurrently, each in a copy of the caller's context"""
+        futures = [self._fanout.submit(copy_context().run, call) for call in calls]
+        return [future.result() for future in futures]
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Response cache hit/miss and request coalescing counters"""
+        return {**self.response_cache.stats(), 'single_flight': self.single_flight.stats()}
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool occupancy and reuse counters per service, plus instance load"""
+        balancer_stats = self.load_balancers.stats()
+        return {
+            service_name: {
+                **self._get_session(service_name).stats(),
+                'instances': balancer_stats.get(service_name, []),
+                'hedging': self.hedging.stats(service_name)
+            }
+            for service_name in self.services
+        }
+    
+    def _probe_instance(self, service_name: str, instance: Instance) -> Dict[str, Any]:
+        """Probe one instance's health endpoint"""
+        try:
+            response = self._get_session(service_name).request(
+                'GET',
+                f"{instance.url}/health/",
+                timeout=(self._get_timeout(service_name)[0], self.health_timeout)
+            )
+            return {
+                'healthy': response.status_code == 200,
+                'status_code': response.status_code
+            }
+        except requests.RequestException:
+            return {
+                'healthy': False,
+                'error': 'Connection failed'
+            }
+    
+    def _probe(self, service_name: str) -> Dict[str, Any]:
+        """Probe every instance of a service - healthy if any instance is
+        
+        Probe outcomes feed the balancer, so a recovered instance is re-added
+        without waiting for its ejection to lapse.
+        """
+        balancer = self._get_balancer(service_name)
+        if balancer is None:
+            return {'healthy': False, 'error': 'Not configured'}
+        results = self.gather(*(
+            lambda instance=instance: self._probe_instance(service_name, instance)
+            for instance in balancer.instances
+        ))
+        instances = {}
+        for instance, result in zip(balancer.instances, results):
+            balancer.record(instance, result['healthy'])
+            instances[instance.url] = result
+        healthy = [result for result in results if result['healthy']]
+        return {
+            **(healthy[0] if healthy else results[0]),
+            'healthy_instances': len(healthy),
+            'instances': instances
+        }
     
     def health_check(self) -> Dict[str, Any]:
-        """Check health of all services"""
-        results = {}
-        for service_name, base_url in self.services.items():
-            try:
-                response = requests.get(f"{base_url}/health/", timeout=2)
-                results[service_name] = {
-                    'healthy': response.status_code == 200,
-                    'status_code': response.status_code
-                }
-            except:
-                results[service_name] = {
-                    'healthy': False,
-                    'error': 'Connection failed'
-                }
-        return results
+        """Check health of all services - served from the health monitor cache"""
+        health = self.health_monitor.snapshot()
+        for service_name, result in health.items():
+            result['circuit_breaker'] = self.circuit_breakers.get(service_name).state_info()
+        return health
 
 
 # Singleton instance
@@ -0,0 +1,103 @@
+"""
+Request Coalescing for API Gateway
+Concurrent identical calls share one in-flight downstream request
+"""
+import asyncio
+import threading
+from typing import Callable, Awaitable, Dict, Any, Hashable
+
+
+class _Call:
+    """In-flight call shared by the leader and its followers"""
+    
+    __slots__ = ('event', 'result', 'error')
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls with the same key across threads"""
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+    
+    def do(self, key: Hashable, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Run fn once for all concurrent callers with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return dict(call.result)
+        
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+    
+    def stats(self) -> Dict[str, int]:
+        return {'leaders': self.leaders, 'coalesced': self.coalesced}
+
+
+class AsyncSingleFlight:
+    """Deduplicates concurrent coroutine calls with the same key on an event loop"""
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Await fn once for all concurrent callers with the same key"""
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        future = self._calls.get(loop_key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return dict(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled - make the call ourselves
+                return await fn()
+        
+        future = self._calls[loop_key] = loop.create_future()
+        self.leaders += 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._calls[loop_key]
+    
+    def stats(self) -> Dict[str, int]:
+        return {'leaders': self.leaders, 'coalesced': self.coalesced}
@@ -0,0 +1,596 @@
+"""Tests for API Gateway"""
+import asyncio
+import json
+import threading
+import time
+from unittest import mock
+import requests
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase
+from common.balancer import LoadBalancer, instance_urls
+from .admission import AdaptiveLimiter, AdmissionMiddleware
+from .breaker import CircuitBreaker, CircuitBreakerRegistry, note_fast_fail
+from .cache import ResponseCache
+from .hedging import HedgingPolicy
+from .proxy import ServiceProxy
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+
+def downstream_response(status_code=200, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode() if body is not None else b''
+    response.headers.update({'Content-Type': 'application/json', **(headers or {})})
+    return response
+
+
+class FakeClock:
+    """Stands in for a module's time, so TTLs and windows pass without sleeping"""
+    
+    def __init__(self, now=1000.0):
+        self.now = now
+    
+    def monotonic(self):
+        return self.now
+    
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ResponseCacheTests(SimpleTestCase):
+    """TTL entries, generations and invalidation"""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('gateway.cache.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ResponseCache(
+            routes={'book': [(r'^books/[^/]+/$', 60), (r'^books/$', 30)]},
+            max_entries=2,
+            invalidates={'cart': [(r'^carts/[^/]+/checkout/$', ['book'])]}
+        )
+    
+    def store(self, path, body, etag=None):
+        key, ttl, _ = self.cache.lookup('book', path)
+        self.cache.store(key, ttl, 200, json.dumps(body).encode(), {'ETag': etag} if etag else {})
+        return key
+    
+    def test_only_listed_routes_are_cached(self):
+        self.assertEqual(self.cache.ttl_for('book', 'books/1/'), 60)
+        self.assertIsNone(self.cache.ttl_for('book', 'books/1/check_stock/'))
+        self.assertIsNone(self.cache.ttl_for('cart', 'carts/1/'))
+        self.assertEqual(self.cache.lookup('cart', 'carts/1/'), (None, None, None))
+    
+    def test_entries_expire_after_their_ttl(self):
+        self.store('books/1/', {'stock': 5})
+        _, _, entry = self.cache.lookup('book', 'books/1/')
+        self.assertEqual(entry.result()['data'], {'stock': 5})
+        self.clock.advance(61)
+        _, _, entry = self.cache.lookup('book', 'books/1/')
+        self.assertFalse(entry.is_fresh())
+        self.assertEqual(self.cache.stats()['hits'], 1)
+    
+    def test_least_recently_used_entry_is_evicted(self):
+        self.store('books/1/', {})
+        self.store('books/2/', {})
+        self.cache.lookup('book', 'books/1/')
+        self.store('books/3/', {})
+        self.assertTrue(self.cache.has_fresh('book', 'books/1/'))
+        self.assertFalse(self.cache.has_fresh('book', 'books/2/'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+    
+    def test_invalidate_bumps_the_generation(self):
+        key = self.store('books/1/', {'stock': 5})
+        self.cache.invalidate('book')
+        self.assertFalse(self.cache.has_fresh('book', 'books/1/'))
+        self.assertNotEqual(self.cache.make_key('book', 'books/1/'), key)
+        self.assertNotEqual(self.cache.flight_key('book', 'books/1/'), ('data',) + key)
+        # A miss started before the write must not store what it read
+        self.cache.store(key, 60, 200, b'{"stock": 5}', {})
+        self.assertFalse(self.cache.has_fresh('book', 'books/1/'))
+    
+    def test_writes_invalidate_the_services_they_change(self):
+        self.store('books/1/', {'stock': 5})
+        self.cache.invalidate_after_write('cart', 'carts/1/add-item/')
+        self.assertTrue(self.cache.has_fresh('book', 'books/1/'))
+        self.cache.invalidate_after_write('cart', 'carts/1/checkout/')
+        self.assertFalse(self.cache.has_fresh('book', 'books/1/'))
+    
+    def test_revalidated_entry_gets_a_new_ttl(self):
+        key = self.store('books/1/', {'stock': 5}, etag='"v1"')
+        self.clock.advance(61)
+        _, ttl, entry = self.cache.lookup('book', 'books/1/')
+        renewed = self.cache.revalidated(key, ttl, entry)
+        self.assertTrue(renewed.is_fresh())
+        self.assertEqual(renewed.etag, '"v1"')
+        self.assertTrue(self.cache.has_fresh('book', 'books/1/'))
+        self.assertEqual(self.cache.stats()['revalidations'], 1)
+
+
+class ProxyRevalidationTests(SimpleTestCase):
+    """ServiceProxy sends If-None-Match for stale entries and reuses them on 304"""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('gateway.cache.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.proxy = ServiceProxy()
+        self.proxy.response_cache = ResponseCache(routes={'book': [(r'^books/[^/]+/$', 60)]})
+        self.proxy.circuit_breakers = CircuitBreakerRegistry()
+        self.session = mock.Mock()
+        self.proxy._get_session = lambda service_name: self.session
+    
+    def sent_headers(self):
+        return self.session.request.call_args.kwargs['headers']
+    
+    def test_fresh_entry_skips_the_call(self):
+        self.session.request.return_value = downstream_response(body={'stock': 5}, headers={'ETag': '"v1"'})
+        self.assertEqual(self.proxy.get('book', 'books/1/')['data'], {'stock': 5})
+        self.assertEqual(self.proxy.get('book', 'books/1/')['data'], {'stock': 5})
+        self.assertEqual(self.session.request.call_count, 1)
+    
+    def test_stale_entry_is_revalidated_by_etag(self):
+        self.session.request.return_value = downstream_response(body={'stock': 5}, headers={'ETag': '"v1"'})
+        self.proxy.get('book', 'books/1/')
+        self.clock.advance(61)
+        self.session.request.return_value = downstream_response(304)
+        result = self.proxy.get('book', 'books/1/')
+        self.assertEqual(self.sent_headers()['If-None-Match'], '"v1"')
+        self.assertEqual((result['status_code'], result['data']), (200, {'stock': 5}))
+        # Renewed - the next GET is served from the cache again
+        self.proxy.get('book', 'books/1/')
+        self.assertEqual(self.session.request.call_count, 2)
+    
+    def test_changed_resource_replaces_the_entry(self):
+        self.session.request.return_value = downstream_response(body={'stock': 5}, headers={'ETag': '"v1"'})
+        self.proxy.get('book', 'books/1/')
+        self.clock.advance(61)
+        self.session.request.return_value = downstream_response(body={'stock': 3}, headers={'ETag': '"v2"'})
+        self.assertEqual(self.proxy.get('book', 'books/1/')['data'], {'stock': 3})
+        self.assertEqual(self.proxy.get('book', 'books/1/')['data'], {'stock': 3})
+        self.assertEqual(self.session.request.call_count, 2)
+    
+    def test_write_drops_cached_responses(self):
+        self.session.request.return_value = downstream_response(body={'stock': 5}, headers={'ETag': '"v1"'})
+        self.proxy.get('book', 'books/1/')
+        self.proxy.post('book', 'books/1/update_stock/', {'quantity': 1, 'operation': 'reduce'})
+        self.proxy.get('book', 'books/1/')
+        self.assertNotIn('If-None-Match', self.sent_headers())
+        self.assertEqual(self.session.request.call_count, 3)
+
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Concurrent calls with one key share one result"""
+    
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {'data': len(calls)}
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Every follower is waiting on the leader before it answers
+        while flight.stats()['coalesced'] < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [{'data': 1}] * 5)
+        self.assertEqual(flight.stats(), {'leaders': 1, 'coalesced': 4})
+        # Followers get copies, so one caller's changes cannot leak into another's
+        self.assertEqual(len({id(result) for result in results}), 5)
+    
+    def test_later_calls_run_again(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: {'data': 1}), {'data': 1})
+        self.assertEqual(flight.do('key', lambda: {'data': 2}), {'data': 2})
+        self.assertEqual(flight.stats()['leaders'], 2)
+    
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do('key', mock.Mock(side_effect=ValueError('boom')))
+        self.assertEqual(flight.do('key', lambda: {'data': 1}), {'data': 1})
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+    """Concurrent coroutines with one key share one result"""
+    
+    def test_concurrent_callers_share_one_call(self):
+        flight = AsyncSingleFlight()
+        calls = []
+        
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'data': len(calls)}
+        
+        async def main():
+            return await asyncio.gather(*[flight.do('key', fetch) for _ in range(5)], flight.do('other', fetch))
+        
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results[:5], [results[0]] * 5)
+        self.assertEqual(flight.stats(), {'leaders': 2, 'coalesced': 4})
+    
+    def test_errors_reach_every_caller(self):
+        flight = AsyncSingleFlight()
+        
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+        
+        async def main():
+            return await asyncio.gather(*[flight.do('key', fetch) for _ in range(3)], return_exceptions=True)
+        
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+    
+    def test_follower_runs_the_call_when_the_leader_is_cancelled(self):
+        flight = AsyncSingleFlight()
+        calls = []
+        
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'data': len(calls)}
+        
+        async def main():
+            leader = asyncio.ensure_future(flight.do('key', fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do('key', fetch))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+        
+        self.assertEqual(asyncio.run(main()), {'data': 2})
+        self.assertEqual(len(calls), 2)
+
+
+class ProxySingleFlightTests(SimpleTestCase):
+    """ServiceProxy.get coalesces identical GETs, but never across a write"""
+    
+    def setUp(self):
+        self.proxy = ServiceProxy()
+        self.proxy.response_cache = ResponseCache()
+        self.release = threading.Event()
+        self.calls = []
+        
+        def hedged_get(service_name, path, params=None, **options):
+            self.calls.append(path)
+            self.release.wait(5)
+            return {'success': True, 'status_code': 200, 'data': len(self.calls)}
+        
+        self.proxy._hedged_get = hedged_get
+    
+    def get_in_thread(self, results):
+        thread = threading.Thread(target=lambda: results.append(self.proxy.get('cart', 'carts/by-customer/1/')))
+        thread.start()
+        return thread
+    
+    def test_get_after_a_write_does_not_join_an_earlier_call(self):
+        results = []
+        before = self.get_in_thread(results)
+        while not self.calls:
+            threading.Event().wait(0.001)
+        self.proxy.response_cache.invalidate_after_write('cart', 'carts/1/add-item/')
+        after = self.get_in_thread(results)
+        while len(self.calls) < 2:
+            threading.Event().wait(0.001)
+        self.release.set()
+        before.join()
+        after.join()
+        self.assertEqual(self.proxy.single_flight.stats(), {'leaders': 2, 'coalesced': 0})
+
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Closed, open and half-open transitions"""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('gateway.breaker.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(
+            window_size=10, minimum_calls=4, failure_rate_threshold=0.5,
+            slow_call_seconds=1.0, slow_call_rate_threshold=0.75, open_seconds=10, half_open_calls=2
+        )
+    
+    def record(self, *outcomes, duration=0.1):
+        for success in outcomes:
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(success, duration)
+    
+    def trip(self):
+        self.record(True, True, False, False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+    
+    def test_stays_closed_below_the_minimum_calls(self):
+        self.record(False, False, False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_opens_on_the_failure_rate(self):
+        self.record(True, True, True, False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.record(False, False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+    
+    def test_opens_on_the_slow_call_rate(self):
+        self.record(True, True, True, duration=2.0)
+        self.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+    
+    def test_open_breaker_fails_fast(self):
+        self.trip()
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(9)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state_info()['rejected'], 2)
+        self.assertEqual(self.breaker.state_info()['retry_in_seconds'], 1)
+    
+    def test_half_open_trials_close_it(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        # Only half_open_calls trials at a time
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(True, 0.1)
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.state_info()['calls_in_window'], 0)
+    
+    def test_failed_trial_reopens_it(self):
+        self.trip()
+        self.clock.advance(10)
+        self.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state_info()['times_opened'], 2)
+    
+    def test_abandoned_trial_frees_its_slot(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        self.breaker.abandon()
+        self.assertTrue(self.breaker.allow())
+    
+    def test_open_circuit_fast_fails_proxy_calls(self):
+        proxy = ServiceProxy()
+        proxy.circuit_breakers = CircuitBreakerRegistry()
+        proxy.circuit_breakers.get('book')._open()
+        proxy._get_session = mock.Mock()
+        result = proxy.post('book', 'books/')
+        self.assertEqual((result['status_code'], result['error']), (503, 'Service book circuit open'))
+        proxy._get_session.assert_not_called()
+
+
+
+class LoadBalancerTests(SimpleTestCase):
+    """Instance choice and ejection of failing instances"""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('common.balancer.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.balancer = LoadBalancer(
+            ['http://a', 'http://b'], failure_threshold=2, ejection_seconds=10, max_ejection_seconds=25
+        )
+        self.a, self.b = self.balancer.instances
+    
+    def fail(self, instance, times=1):
+        for _ in range(times):
+            self.balancer.record(instance, False)
+    
+    def picks(self, count=4):
+        picked = []
+        for _ in range(count):
+            instance = self.balancer.acquire()
+            self.balancer.release(instance, None)
+            picked.append(instance.url)
+        return picked
+    
+    def test_instance_urls(self):
+        self.assertEqual(instance_urls('http://a/, http://b'), ['http://a', 'http://b'])
+        self.assertEqual(instance_urls(['http://a', '']), ['http://a'])
+    
+    def test_round_robin(self):
+        self.assertEqual(self.picks(), ['http://a', 'http://b', 'http://a', 'http://b'])
+    
+    def test_least_outstanding(self):
+        balancer = LoadBalancer(['http://a', 'http://b'], strategy=LoadBalancer.LEAST_OUTSTANDING)
+        busy = balancer.acquire()
+        self.assertIsNot(balancer.acquire(), busy)
+        self.assertIsNot(balancer.acquire(exclude=[busy]), busy)
+    
+    def test_consecutive_failures_eject(self):
+        self.fail(self.a)
+        self.balancer.record(self.a, True)
+        self.fail(self.a)
+        self.assertEqual(self.picks(2), ['http://a', 'http://b'])
+        self.fail(self.a)
+        self.assertEqual(self.picks(), ['http://b'] * 4)
+        self.clock.advance(10)
+        self.assertIn('http://a', self.picks())
+    
+    def test_ejection_backs_off_and_success_resets_it(self):
+        self.fail(self.a, 2)
+        self.clock.advance(10)
+        # Back on probation - one failure ejects it for twice as long
+        self.fail(self.a)
+        self.assertEqual(self.balancer.stats()[0]['ejected_for_seconds'], 20)
+        self.clock.advance(20)
+        self.fail(self.a)
+        self.assertEqual(self.balancer.stats()[0]['ejected_for_seconds'], 25)
+        self.clock.advance(25)
+        self.balancer.record(self.a, True)
+        self.fail(self.a)
+        self.assertFalse(self.balancer.stats()[0]['ejected'])
+    
+    def test_all_ejected_uses_the_first_due_back(self):
+        self.fail(self.a, 2)
+        self.clock.advance(1)
+        self.fail(self.b, 2)
+        self.assertEqual(self.picks(2), ['http://a', 'http://a'])
+
+
+
+class HedgingPolicyTests(SimpleTestCase):
+    """Hedge delay from the latency percentile and the hedge token budget"""
+    
+    def setUp(self):
+        self.policy = HedgingPolicy(
+            services=['book'], percentile=90, min_delay=0.01, min_samples=10, budget_percent=25, max_tokens=2
+        )
+    
+    def warm_up(self):
+        for index in range(1, 11):
+            self.policy.observe('book', index / 100)
+    
+    def test_no_hedging_without_enough_samples(self):
+        self.policy.observe('book', 0.5)
+        self.assertIsNone(self.policy.delay_for('book'))
+        self.assertIsNone(self.policy.delay_for('cart'))
+    
+    def test_delay_is_the_latency_percentile(self):
+        self.warm_up()
+        self.assertEqual(self.policy.delay_for('book'), 0.1)
+    
+    def test_budget_earns_a_token_per_four_requests(self):
+        self.warm_up()
+        for _ in range(3):
+            self.policy.delay_for('book')
+        self.assertFalse(self.policy.try_hedge('book'))
+        self.policy.delay_for('book')
+        self.assertTrue(self.policy.try_hedge('book'))
+        self.assertFalse(self.policy.try_hedge('book'))
+        stats = self.policy.stats('book')
+        self.assertEqual((stats['requests'], stats['hedges'], stats['budget_exhausted']), (4, 1, 2))
+    
+    def test_saved_tokens_are_capped(self):
+        for _ in range(40):
+            self.policy.delay_for('book')
+        self.assertEqual(self.policy.stats('book')['budget_tokens'], 2)
+        self.assertTrue(self.policy.try_hedge('book'))
+        self.assertTrue(self.policy.try_hedge('book'))
+        self.assertFalse(self.policy.try_hedge('book'))
+
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+    """Slots below limit * headroom, and AIMD changes to the limit"""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('gateway.admission.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = AdaptiveLimiter('test', initial_limit=10, min_limit=5, max_limit=11, slow_seconds=2.0)
+    
+    def test_headroom_caps_admission(self):
+        self.assertEqual([self.limiter.acquire(0.5, 0) for _ in range(6)], [1, 1, 1, 1, 1, 0])
+        self.assertEqual(self.limiter.acquire(1.0, 0), 1)
+        self.assertEqual(self.limiter.stats()['shed'], 1)
+    
+    def test_weight_takes_several_slots_up_to_capacity(self):
+        self.assertEqual(self.limiter.acquire(1.0, 0, weight=4), 4)
+        self.assertEqual(self.limiter.acquire(1.0, 0, weight=7), 0)
+        self.limiter.release(self.clock.now, False, 4)
+        # More than the whole limit still runs, alone
+        self.assertEqual(self.limiter.acquire(1.0, 0, weight=50), 10)
+        self.assertEqual(self.limiter.stats()['in_flight'], 10)
+    
+    def test_waiter_gets_a_released_slot(self):
+        for _ in range(10):
+            self.limiter.acquire(1.0, 0)
+        slots = []
+        waiter = threading.Thread(target=lambda: slots.append(self.limiter.acquire(1.0, 5)))
+        waiter.start()
+        self.limiter.release(self.clock.now, False)
+        waiter.join(5)
+        self.assertEqual(slots, [1])
+        self.assertEqual(self.limiter.acquire(1.0, 0), 0)
+    
+    def test_async_acquire(self):
+        async def main():
+            first = await self.limiter.aacquire(1.0, 0, weight=10)
+            shed = await self.limiter.aacquire(1.0, 0)
+            return first, shed
+        
+        self.assertEqual(asyncio.run(main()), (10, 0))
+    
+    def test_limit_grows_while_in_use_and_shrinks_on_failure(self):
+        for _ in range(6):
+            self.limiter.acquire(1.0, 0)
+        self.limiter.release(self.clock.now, False)
+        self.assertEqual(self.limiter.limit, 10.1)
+        # Under half the limit in use - no growth
+        self.limiter.release(self.clock.now, False)
+        self.assertEqual(self.limiter.limit, 10.1)
+        self.clock.advance(1)
+        self.limiter.release(self.clock.now - 0.5, True)
+        self.assertAlmostEqual(self.limiter.limit, 9.09)
+        # A request started before that cut does not cut again
+        self.limiter.release(self.clock.now - 0.5, True)
+        self.assertAlmostEqual(self.limiter.limit, 9.09)
+        self.clock.advance(1)
+        self.limiter.release(self.clock.now - 3, False)
+        self.assertAlmostEqual(self.limiter.limit, 9.09)
+        self.clock.advance(5)
+        self.limiter.release(self.clock.now - 3, False)
+        self.assertAlmostEqual(self.limiter.limit, 8.181)
+    
+    def test_limit_stays_within_bounds(self):
+        for _ in range(10):
+            self.limiter.acquire(1.0, 0)
+        for _ in range(50):
+            self.limiter.release(self.clock.now, False)
+            self.limiter.acquire(1.0, 0)
+        self.assertEqual(self.limiter.limit, 11)
+        for _ in range(10):
+            self.limiter.release(self.clock.now, False)
+        for _ in range(20):
+            self.clock.advance(1)
+            self.limiter.acquire(1.0, 0)
+            self.limiter.release(self.clock.now, True)
+        self.assertEqual(self.limiter.limit, 5)
+
+
+class AdmissionMiddlewareTests(SimpleTestCase):
+    """Dropped responses shrink the limit unless the gateway's breaker produced them"""
+    
+    def respond(self, status_code, fast_fail=False):
+        limiter = AdaptiveLimiter('book', initial_limit=10, min_limit=5)
+        
+        def view(request):
+            request._admission = (limiter, time.monotonic(), limiter.acquire(1.0, 0))
+            if fast_fail:
+                note_fast_fail('book')
+            return JsonResponse({}, status=status_code)
+        
+        AdmissionMiddleware(view)(RequestFactory().get('/api/books/'))
+        return limiter.limit
+    
+    def test_downstream_503_shrinks_the_limit(self):
+        self.assertEqual(self.respond(503), 9)
+    
+    def test_breaker_503_leaves_the_limit(self):
+        self.assertEqual(self.respond(503, fast_fail=True), 10)
+    
+    def test_other_failures_still_shrink_it(self):
+        self.assertEqual(self.respond(504, fast_fail=True), 9)
@@ -1,30 +1,36 @@
 """URLs for API Gateway"""
+from django.conf import settings
 from django.urls import path
-from .views import (
-    HealthCheckView,
-    CustomerListView, CustomerDetailView,
-    BookListView, BookDetailView,
-    CartView, CartAddItemView, CartRemoveItemView,
-    CartUpdateQuantityView, CartClearView, CartCheckoutView
-)
+from . import views
+
+# Async mode (ASGI) serves the same routes through non-blocking views
+if getattr(settings, 'GATEWAY_ASYNC', False):
+    from . import async_views as views
 
 urlpatterns = [
     # Health check
-    path('services/health/', HealthCheckView.as_view(), name='services-health'),
+    path('services/health/', views.HealthCheckView.as_view(), name='services-health'),
+    path('services/pool/', views.PoolStatsView.as_view(), name='services-pool'),
+    path('services/cache/', views.CacheStatsView.as_view(), name='services-cache'),
+    path('services/admission/', views.AdmissionStatsView.as_view(), name='services-admission'),
+    
+    # Batch of sub-requests dispatched through the routes below
+    path('batch/', views.BatchView.as_view(), name='batch'),
     
     # Customer routes
-    path('customers/', CustomerListView.as_view(), name='customer-list'),
-    path('customers/<str:customer_id>/', CustomerDetailView.as_view(), name='customer-detail'),
+    path('customers/', views.CustomerListView.as_view(), name='customer-list'),
+    path('customers/<str:customer_id>/', views.CustomerDetailView.as_view(), name='customer-detail'),
+    path('customers/<str:customer_id>/dashboard/', views.CustomerDashboardView.as_view(), name='customer-dashboard'),
     
     # Book routes
-    path('books/', BookListView.as_view(), name='book-list'),
-    path('books/<str:book_id>/', BookDetailView.as_view(), name='book-detail'),
+    path('books/', views.BookListView.as_view(), name='book-list'),
+    path('books/<str:book_id>/', views.BookDetailView.as_view(), name='book-detail'),
     
     # Cart routes
-    path('customers/<str:customer_id>/cart/', CartView.as_view(), name='cart'),
-    path('customers/<str:customer_id>/cart/items/', CartAddItemView.as_view(), name='cart-add-item'),
-    path('customers/<str:customer_id>/cart/items/<str:book_id>/', CartRemoveItemView.as_view(), name='cart-remove-item'),
-    path('customers/<str:customer_id>/cart/items/<str:book_id>/quantity/', CartUpdateQuantityView.as_view(), name='cart-update-quantity'),
-    path('customers/<str:customer_id>/cart/clear/', CartClearView.as_view(), name='cart-clear'),
-    path('customers/<str:customer_id>/cart/checkout/', CartCheckoutView.as_view(), name='cart-checkout'),
+    path('customers/<str:customer_id>/cart/', views.CartView.as_view(), name='cart'),
+    path('customers/<str:customer_id>/cart/items/', views.CartAddItemView.as_view(), name='cart-add-item'),
+    path('customers/<str:customer_id>/cart/items/<str:book_id>/', views.CartRemoveItemView.as_view(), name='cart-remove-item'),
+    path('customers/<str:customer_id>/cart/items/<str:book_id>/quantity/', views.CartUpdateQuantityView.as_view(), name='cart-update-quantity'),
+    path('customers/<str:customer_id>/cart/clear/', views.CartClearView.as_view(), name='cart-clear'),
+    path('customers/<str:customer_id>/cart/checkout/', views.CartCheckoutView.as_view(), name='cart-checkout'),
 ]
@@ -2,12 +2,49 @@
 API Gateway Views
 Routes requests to appropriate microservices
 """
+from contextvars import copy_context
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import Resolver404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from common.idempotency import idempotency_headers
+from .admission import admission_controller
+from .batch import (
+    BatchError, batch_executor, build_subrequest, not_found,
+    parse_batch, plan_groups, render_subresponse, subrequest_handler
+)
+from .cache import not_modified
+from .composition import cart_book_ids, compose_dashboard
 from .proxy import service_proxy
 
 
+def passthrough_response(result, error_default=None, request=None):
+    """Send a raw proxy result to the client without decoding the body
+    
+    Given the request, a client whose conditional headers still match the
+    downstream validators gets 304 instead of the body.
+    """
+    if not result['success']:
+        return Response({'error': result.get('error', error_default)}, status=result['status_code'])
+    if request is not None and result['status_code'] == 200 and isinstance(result['content'], bytes):
+        response = not_modified(request, result['headers'])
+        if response is not None:
+            return response
+    if isinstance(result['content'], bytes):
+        response = HttpResponse(result['content'], status=result['status_code'])
+    else:
+        response = StreamingHttpResponse(result['content'], status=result['status_code'])
+    for header, value in result['headers'].items():
+        response[header] = value
+    return response
+
+
+def book_page_params(query) -> dict:
+    """Keyset pagination parameters to forward to book-service list endpoints"""
+    return {name: query[name] for name in ('cursor', 'page_size') if query.get(name)}
+
+
 class HealthCheckView(APIView):
     """Health check for all services"""
     
@@ -21,16 +58,64 @@ class HealthCheckView(APIView):
         })
 
 
+class PoolStatsView(APIView):
+    """Connection pool occupancy and reuse counters per service"""
+    
+    def get(self, request):
+        return Response(service_proxy.pool_stats())
+
+
+class CacheStatsView(APIView):
+    """Response cache hit/miss counters"""
+    
+    def get(self, request):
+        return Response(service_proxy.cache_stats())
+
+
+class AdmissionStatsView(APIView):
+    """Adaptive concurrency limits and shed counters per service"""
+    
+    def get(self, request):
+        return Response(admission_controller.stats())
+
+
+class BatchView(APIView):
+    """Several gateway calls in one round trip - consecutive reads run in parallel"""
+    
+    def post(self, request):
+        try:
+            items = parse_batch(request.data)
+        except BatchError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = [None] * len(items)
+        for group in plan_groups(items):
+            if len(group) == 1:
+                results[group[0]] = self._dispatch(request, items[group[0]])
+                continue
+            futures = [
+                batch_executor.submit(copy_context().run, self._dispatch, request, items[index])
+                for index in group
+            ]
+            for index, future in zip(group, futures):
+                results[index] = future.result()
+        return Response({'responses': results})
+    
+    def _dispatch(self, request, item):
+        try:
+            sub_request = build_subrequest(request._request, item)
+        except Resolver404:
+            return not_found(item)
+        return render_subresponse(subrequest_handler().get_response(sub_request))
+
+
 # ==================== Customer Routes ====================
 
 class CustomerListView(APIView):
     """Proxy for customer list/create"""
     
     def get(self, request):
-        result = service_proxy.get('customer', 'customers/')
-        if result['success']:
-            return Response(result['data'], status=result['status_code'])
-        return Response({'error': result['error']}, status=result['status_code'])
+        return passthrough_response(service_proxy.passthrough('customer', 'customers/'))
     
     def post(self, request):
         result = service_proxy.post('customer', 'customers/', data=request.data)
@@ -43,10 +128,8 @@ class CustomerDetailView(APIView):
     """Proxy for customer detail/update/delete"""
     
     def get(self, request, customer_id):
-        result = service_proxy.get('customer', f'customers/{customer_id}/')
-        if result['success']:
-            return Response(result['data'], status=result['status_code'])
-        return Response({'error': result.get('error', 'Not found')}, status=result['status_code'])
+        result = service_proxy.passthrough('customer', f'customers/{customer_id}/')
+        return passthrough_response(result, 'Not found')
     
     def put(self, request, customer_id):
         result = service_proxy.put('customer', f'customers/{customer_id}/', data=request.data)
@@ -61,23 +144,40 @@ class CustomerDetailView(APIView):
         return Response({'error': result['error']}, status=result['status_code'])
 
 
+class CustomerDashboardView(APIView):
+    """Customer, cart and current book data in one response"""
+    
+    def get(self, request, customer_id):
+        customer, cart = service_proxy.gather(
+            lambda: service_proxy.get('customer', f'customers/{customer_id}/'),
+            lambda: service_proxy.get('cart', f'carts/by-customer/{customer_id}/'),
+        )
+        if not customer['success']:
+            return Response({'error': customer['error']}, status=customer['status_code'])
+        if customer['status_code'] != 200:
+            return Response(customer['data'], status=customer['status_code'])
+        
+        books = None
+        book_ids = cart_book_ids(cart)
+        if book_ids:
+            books = service_proxy.get('book', 'books/bulk_get/', params={'ids': ','.join(book_ids)})
+        return Response(compose_dashboard(customer, cart, books))
+
+
 # ==================== Book Routes ====================
 
 class BookListView(APIView):
     """Proxy for book list/create"""
     
     def get(self, request):
-        params = {}
+        page_params = book_page_params(request.query_params)
         if request.query_params.get('q'):
-            result = service_proxy.get('book', 'books/search/', params={'q': request.query_params['q']})
+            result = service_proxy.passthrough('book', 'books/search/', params={'q': request.query_params['q'], **page_params})
         elif request.query_params.get('in_stock'):
-            result = service_proxy.get('book', 'books/in_stock/')
+            result = service_proxy.passthrough('book', 'books/in_stock/', params=page_params)
         else:
-            result = service_proxy.get('book', 'books/')
-        
-        if result['success']:
-            return Response(result['data'], status=result['status_code'])
-        return Response({'error': result['error']}, status=result['status_code'])
+            result = service_proxy.passthrough('book', 'books/', params=page_params)
+        return passthrough_response(result, request=request)
     
     def post(self, request):
         result = service_proxy.post('book', 'books/', data=request.data)
@@ -90,10 +190,8 @@ class BookDetailView(APIView):
     """Proxy for book detail/update/delete"""
     
     def get(self, request, book_id):
-        result = service_proxy.get('book', f'books/{book_id}/')
-        if result['success']:
-            return Response(result['data'], status=result['status_code'])
-        return Response({'error': result.get('error', 'Not found')}, status=result['status_code'])
+        result = service_proxy.passthrough('book', f'books/{book_id}/')
+        return passthrough_response(result, 'Not found', request)
     
     def put(self, request, book_id):
         result = service_proxy.put('book', f'books/{book_id}/', data=request.data)
@@ -114,17 +212,17 @@ class CartView(APIView):
     """Proxy for cart operations"""
     
     def get(self, request, customer_id):
-        result = service_proxy.get('cart', f'carts/by-customer/{customer_id}/')
-        if result['success']:
-            return Response(result['data'], status=result['status_code'])
-        return Response({'error': result['error']}, status=result['status_code'])
+        result = service_proxy.passthrough('cart', f'carts/by-customer/{customer_id}/')
+        return passthrough_response(result)
 
 
 class CartAddItemView(APIView):
     """Proxy for adding item to cart"""
     
     def post(self, request, customer_id):
-        result = service_proxy.post('cart', f'carts/{customer_id}/add-item/', data=request.data)
+        result = service_proxy.post(
+            'cart', f'carts/{customer_id}/add-item/', data=request.data, headers=idempotency_headers(request)
+        )
         if result['success']:
             return Response(result['data'], status=result['status_code'])
         return Response({'error': result.get('error', result.get('data', 'Error'))}, status=result['status_code'])
@@ -164,7 +262,7 @@ class CartCheckoutView(APIView):
     """Proxy for cart checkout"""
     
     def post(self, request, customer_id):
-        result = service_proxy.post('cart', f'carts/{customer_id}/checkout/')
+        result = service_proxy.post('cart', f'carts/{customer_id}/checkout/', headers=idempotency_headers(request))
         if result['success']:
             return Response(result['data'], status=result['status_code'])
         return Response(result.get('data', {'error': result['error']}), status=result['status_code'])
@@ -0,0 +1,18 @@
+"""App configuration for Book Service"""
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def _create_triggers(sender, using='default', **kwargs):
+    from .conditional import ensure_catalog_version
+    from .search import ensure_search_index
+    ensure_search_index(using)
+    ensure_catalog_version(using)
+
+
+class BooksConfig(AppConfig):
+    name = 'books'
+
+    def ready(self):
+        # The FTS5 table and the triggers are raw SQL, so migrate (or syncdb) creates them here
+        post_migrate.connect(_create_triggers, sender=self)
@@ -0,0 +1,200 @@
+"""
+Catalog Import for Book Service
+Streams CSV or JSONL book feeds into the books table with batched bulk upserts
+"""
+import csv
+import json
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from .models import Book
+
+_import_config = getattr(settings, 'BOOK_IMPORT', {})
+BATCH_SIZE = _import_config.get('BATCH_SIZE', 1000)
+MAX_ERRORS_REPORTED = _import_config.get('MAX_ERRORS_REPORTED', 100)
+
+FORMATS = ('csv', 'jsonl')
+# Upload content types accepted by the import endpoint
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/x-jsonlines': 'jsonl',
+}
+# What to do with a row whose id already exists
+ON_CONFLICT = ('update', 'ignore')
+
+# Columns written on an upsert - created_at keeps its first value
+_UPDATE_FIELDS = ['title', 'author', 'price', 'stock', 'updated_at']
+
+_id_field = Book._meta.get_field('id')
+_title_field = Book._meta.get_field('title')
+_author_field = Book._meta.get_field('author')
+_price_field = Book._meta.get_field('price')
+
+
+class ImportStats:
+    """Running totals of an import
+
+    imported counts the valid rows sent to the database; with on_conflict
+    'ignore' the ones whose id already existed are among them, untouched.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def reject(self, line: int, error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS_REPORTED:
+            self.errors.append({'line': line, 'error': error})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': self.errors,
+        }
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[Tuple[int, Any]]:
+    """(line number, row dict) per CSV record - the first line holds the column names"""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator[Tuple[int, Any]]:
+    """(line number, decoded object) per non-blank line, or the decode error message"""
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, f'Invalid JSON: {e}'
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def parse_book(row: Any) -> Book:
+    """Unsaved Book from one input record - raises ValueError naming the bad field"""
+    if isinstance(row, str):
+        raise ValueError(row)
+    if not isinstance(row, dict):
+        raise ValueError('Expected an object with title, author, price and stock')
+
+    book_id = row.get('id')
+    book_id = str(book_id).strip() if book_id not in (None, '') else str(uuid.uuid4())
+    if len(book_id) > _id_field.max_length:
+        raise ValueError(f'id is longer than {_id_field.max_length} characters')
+
+    values = {}
+    for field in (_title_field, _author_field):
+        value = row.get(field.name)
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            raise ValueError(f'{field.name} is required')
+        if len(value) > field.max_length:
+            raise ValueError(f'{field.name} is longer than {field.max_length} characters')
+        values[field.name] = value
+
+    try:
+        price = Decimal(str(row.get('price')).strip())
+    except InvalidOperation:
+        raise ValueError('price must be a number') from None
+    if not price.is_finite() or price < 0:
+        raise ValueError('price must be a non-negative number')
+    try:
+        price = price.quantize(Decimal(1).scaleb(-_price_field.decimal_places))
+    except InvalidOperation:
+        price = None
+    if price is None or len(price.as_tuple().digits) > _price_field.max_digits:
+        raise ValueError(f'price has more than {_price_field.max_digits} digits')
+
+    stock = row.get('stock', 0)
+    try:
+        stock = int(str(stock).strip() or 0) if not isinstance(stock, bool) else None
+    except ValueError:
+        stock = None
+    if stock is None or stock < 0:
+        raise ValueError('stock must be a non-negative integer')
+
+    return Book(id=book_id, price=price, stock=stock, **values)
+
+
+def _write_batch(books: Dict[str, Book], on_conflict: str) -> None:
+    options = {'ignore_conflicts': True} if on_conflict == 'ignore' else {
+        'update_conflicts': True, 'unique_fields': ['id'], 'update_fields': _UPDATE_FIELDS,
+    }
+    with transaction.atomic():
+        Book.objects.bulk_create(books.values(), **options)
+
+
+def import_books(
+    records: Iterable[Tuple[int, Any]],
+    batch_size: int = BATCH_SIZE,
+    on_conflict: str = 'update',
+    progress: Callable[[ImportStats], None] = None,
+    stats: ImportStats = None
+) -> ImportStats:
+    """Write records to the books table, batch_size rows per INSERT and transaction
+
+    Records are (line number, row) pairs from read_csv or read_jsonl and
+    are consumed as they arrive, so memory stays at one batch whatever the
+    feed's size. Rows with an existing id update that book (on_conflict
+    'update') or are skipped ('ignore'); rows without an id are new books.
+    Invalid rows are counted and reported, never written. Each batch
+    commits on its own, so a failure keeps the batches before it.
+    progress, if given, is called after every batch; pass stats to keep
+    the totals of an import that ends in an exception.
+    """
+    if on_conflict not in ON_CONFLICT:
+        raise ValueError(f'on_conflict must be one of {", ".join(ON_CONFLICT)}')
+    stats = stats if stats is not None else ImportStats()
+    # By id, so a feed repeating a book within a batch keeps its last row
+    batch: Dict[str, Book] = {}
+
+    def flush():
+        _write_batch(batch, on_conflict)
+        stats.imported += len(batch)
+        stats.batches += 1
+        batch.clear()
+        if progress is not None:
+            progress(stats)
+
+    for line, row in records:
+        stats.rows += 1
+        try:
+            book = parse_book(row)
+        except ValueError as e:
+            stats.reject(line, str(e))
+            continue
+        batch[book.id] = book
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    stats.finished = time.monotonic()
+    return stats
@@ -0,0 +1,70 @@
+"""Stream a CSV or JSONL supplier feed into the catalog"""
+import csv
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from books.importer import BATCH_SIZE, FORMATS, ON_CONFLICT, READERS, ImportStats, import_books
+
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV or JSONL file (or - for stdin) in batched bulk upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file, or - to read stdin')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--on-conflict', choices=ON_CONFLICT, default='update',
+                            help='Update books whose id already exists, or leave them as they are')
+        parser.add_argument('--progress-every', type=int, default=10000, help='Rows between progress lines (0 for none)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or self._format_from_path(path)
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        reported = [0]
+
+        def progress(stats):
+            every = options['progress_every']
+            if every and stats.rows - reported[0] >= every:
+                reported[0] = stats.rows
+                self.stdout.write(
+                    f'{stats.rows} rows read, {stats.imported} imported, {stats.rejected} rejected '
+                    f'({stats.rows_per_second:.0f} rows/s)'
+                )
+
+        stats = ImportStats()
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            import_books(
+                READERS[input_format](stream),
+                batch_size=options['batch_size'],
+                on_conflict=options['on_conflict'],
+                progress=progress,
+                stats=stats
+            )
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise CommandError(
+                f'Unreadable input after {stats.rows} row(s) - {stats.imported} book(s) already imported: {e}'
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in stats.errors:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats.imported} book(s) from {stats.rows} row(s), {stats.rejected} rejected, '
+            f'in {stats.elapsed:.2f}s ({stats.rows_per_second:.0f} rows/s)'
+        ))
+
+    @staticmethod
+    def _format_from_path(path):
+        if path.endswith('.csv'):
+            return 'csv'
+        if path.endswith(('.jsonl', '.ndjson')):
+            return 'jsonl'
+        raise CommandError('Cannot tell the format from the file name - pass --format')
@@ -0,0 +1,23 @@
+"""Backfill the full-text search index from the books table"""
+import time
+from django.core.management.base import BaseCommand, CommandError
+from books.search import ensure_search_index, optimize_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Create the book search index if missing and re-index every book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--no-optimize', action='store_true', help='Skip merging the index afterwards')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not ensure_search_index(using):
+            raise CommandError('The search index needs an SQLite database with FTS5')
+        started = time.monotonic()
+        indexed = rebuild_search_index(using)
+        if not options['no_optimize']:
+            optimize_search_index(using)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} book(s) in {elapsed:.2f}s'))
@@ -0,0 +1,19 @@
+"""Expire abandoned stock reservations and return their stock"""
+from django.core.management.base import BaseCommand
+from books.reservations import SWEEP_BATCH_SIZE, sweep_expired
+
+
+class Command(BaseCommand):
+    help = 'Expire pending stock reservations past their deadline and return their stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            expired = sweep_expired(options['batch_size'])
+            total += expired
+            if expired < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Expired {total} reservation(s)'))
@@ -16,6 +16,11 @@ class Book(models.Model):
     class Meta:
         db_table = 'books'
         ordering = ['title']
+        indexes = [
+            # Keyset pages seek on (title, id) - see books.pagination
+            models.Index(fields=['title', 'id'], name='books_title_id_idx'),
+            models.Index(fields=['title', 'id'], name='books_in_stock_title_id_idx', condition=models.Q(stock__gt=0)),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author}"
@@ -36,3 +41,60 @@ class Book(models.Model):
     def increase_stock(self, quantity):
         self.stock += quantity
         self.save()
+
+
+class StockReservation(models.Model):
+    """Stock held back for a pending checkout until it is committed, released or expires"""
+    PENDING = 'pending'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+        (EXPIRED, 'Expired'),
+    ]
+
+    id = models.CharField(max_length=100, primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stock_reservations'
+        indexes = [models.Index(fields=['status', 'expires_at'])]
+
+    def __str__(self):
+        return f"Reservation {self.id} ({self.status})"
+
+
+class ReservationItem(models.Model):
+    """Quantity of one book held by a reservation"""
+    reservation = models.ForeignKey(StockReservation, on_delete=models.CASCADE, related_name='items')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reservation_items')
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'stock_reservation_items'
+
+    def __str__(self):
+        return f"{self.quantity}x {self.book_id}"
+
+
+class CatalogVersion(models.Model):
+    """Single-row counter bumped by database triggers on every change to the books table
+
+    Book lists (and their pages) change only when it does, which makes it
+    their ETag - see books.conditional.
+    """
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'catalog_version'
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
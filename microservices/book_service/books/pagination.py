@@ -0,0 +1,97 @@
+"""
+Keyset Pagination for Book Service
+Pages resume after the last row seen, so page 1000 costs the same as page 1
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from typing import Any, Callable, List, Optional, Sequence
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pages ordered by (title, id)
+
+    Unlike page numbers there is no COUNT(*) and no OFFSET: the cursor
+    holds the sort key of the last row served and the next page is read
+    with WHERE (title, id) > cursor from the (title, id) index. Pages only
+    go forward; the response carries the next page's cursor, to send back
+    as ?cursor= on the same URL. There is no absolute next link, which
+    would name this service's host instead of the gateway's.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 10
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request, kinds: Sequence[type]) -> Optional[List[Any]]:
+        """The position in the cursor parameter - one value per sort key, of the given types"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (UnicodeError, binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(position, list)
+            or len(position) != len(kinds)
+            or not all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(position, kinds))
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    @staticmethod
+    def encode_cursor(position: Sequence[Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(list(position)).encode('utf-8')).decode('ascii')
+
+    def paginate_keyset(self, request, fetch: Callable[[Optional[List[Any]], int], List[Any]],
+                        key: Callable[[Any], Sequence[Any]], kinds: Sequence[type]) -> List[Any]:
+        """One page of rows from fetch(after, limit), which returns rows past position after in key order"""
+        self.request = request
+        size = self.get_page_size(request)
+        rows = fetch(self.decode_cursor(request, kinds), size + 1)
+        # The extra row only tells whether there is a next page
+        self.next_cursor = self.encode_cursor(key(rows[size - 1])) if len(rows) > size else None
+        return rows[:size]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        def fetch(after, limit):
+            books = queryset.order_by('title', 'id')
+            if after is not None:
+                title, book_id = after
+                # title >= seeks the index; the OR only filters rows sharing the cursor's title
+                books = books.filter(Q(title__gte=title), Q(title__gt=title) | Q(id__gt=book_id))
+            return list(books[:limit])
+
+        return self.paginate_keyset(request, fetch, lambda book: (book.title, book.id), (str, str))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next_cursor', self.next_cursor),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
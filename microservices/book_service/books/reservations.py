@@ -0,0 +1,183 @@
+"""
+Stock Reservations for Book Service
+Holds stock for a checkout until it is committed or released, and expires abandoned holds
+"""
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from typing import Dict, Any, List, Optional, Tuple
+from .models import Book, StockReservation, ReservationItem
+from .stock import StockShortage, merge_quantities, take_stock
+
+_reservation_config = getattr(settings, 'STOCK_RESERVATIONS', {})
+DEFAULT_TTL_SECONDS = _reservation_config.get('TTL_SECONDS', 120)
+MAX_TTL_SECONDS = _reservation_config.get('MAX_TTL_SECONDS', 900)
+SWEEP_INTERVAL_SECONDS = _reservation_config.get('SWEEP_INTERVAL_SECONDS', 30)
+SWEEP_BATCH_SIZE = _reservation_config.get('SWEEP_BATCH_SIZE', 500)
+
+
+class ReservationError(Exception):
+    """Stock could not be reserved - items holds the per-item outcome"""
+
+    def __init__(self, message: str, items: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.items = items
+
+
+def reserve(items: List[Dict[str, Any]], ttl_seconds: Optional[int] = None) -> Tuple[StockReservation, List[Dict[str, Any]]]:
+    """Hold stock for every item or for none of them
+
+    The stock is taken off the books straight away, in one conditional
+    UPDATE, so a committed reservation needs no further stock change and a
+    released or expired one gives it back.
+    """
+    quantities = merge_quantities(items)
+    ttl = min(ttl_seconds or DEFAULT_TTL_SECONDS, MAX_TTL_SECONDS)
+    now = timezone.now()
+
+    with transaction.atomic():
+        try:
+            books = take_stock(quantities, now)
+        except StockShortage as shortage:
+            results = []
+            for book_id, quantity in quantities.items():
+                if book_id in shortage.missing:
+                    results.append({'book_id': book_id, 'error': 'Book not found'})
+                elif book_id in shortage.short:
+                    results.append({
+                        'book_id': book_id,
+                        'error': 'Insufficient stock',
+                        'available_stock': shortage.books[book_id].stock
+                    })
+                else:
+                    results.append(_held(book_id, quantity, shortage.books[book_id]))
+            raise ReservationError('Some items could not be reserved', results) from None
+
+        reservation = StockReservation.objects.create(expires_at=now + timedelta(seconds=ttl))
+        ReservationItem.objects.bulk_create([
+            ReservationItem(reservation=reservation, book_id=book_id, quantity=quantity)
+            for book_id, quantity in quantities.items()
+        ])
+
+    sweeper.ensure_started()
+    return reservation, [_held(book_id, quantity, books[book_id]) for book_id, quantity in quantities.items()]
+
+
+def _held(book_id: str, quantity: int, book: Book) -> Dict[str, Any]:
+    return {'book_id': book_id, 'quantity': quantity, 'title': book.title, 'price': str(book.price)}
+
+
+def _restore_stock(reservation_id: str, now) -> None:
+    """Give the stock held by a reservation back to its books"""
+    for book_id, quantity in ReservationItem.objects.filter(
+        reservation_id=reservation_id
+    ).values_list('book_id', 'quantity'):
+        Book.objects.filter(id=book_id).update(stock=F('stock') + quantity, updated_at=now)
+
+
+def _expire(reservation_id: str, now) -> bool:
+    """Mark a pending reservation past its deadline expired - call inside transaction.atomic()"""
+    return bool(StockReservation.objects.filter(
+        id=reservation_id, status=StockReservation.PENDING, expires_at__lte=now
+    ).update(status=StockReservation.EXPIRED, updated_at=now))
+
+
+def commit(reservation_id: str) -> Tuple[bool, Optional[StockReservation]]:
+    """Make a pending, unexpired reservation final
+
+    Returns (committed, reservation); committing twice succeeds, and the
+    reservation is None when it does not exist. A pending reservation past
+    its deadline that the sweeper has not reached yet is expired here, its
+    stock returned, so the caller sees status expired rather than pending.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        committed = StockReservation.objects.filter(
+            id=reservation_id, status=StockReservation.PENDING, expires_at__gt=now
+        ).update(status=StockReservation.COMMITTED, updated_at=now)
+        if not committed and _expire(reservation_id, now):
+            _restore_stock(reservation_id, now)
+    reservation = StockReservation.objects.filter(id=reservation_id).first()
+    if reservation is None:
+        return False, None
+    return bool(committed) or reservation.status == StockReservation.COMMITTED, reservation
+
+
+def release(reservation_id: str) -> Tuple[bool, Optional[StockReservation]]:
+    """Cancel a pending reservation and return its stock
+
+    Returns (released, reservation); releasing twice succeeds, and a
+    committed reservation cannot be released.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        released = StockReservation.objects.filter(
+            id=reservation_id, status=StockReservation.PENDING
+        ).update(status=StockReservation.RELEASED, updated_at=now)
+        if released:
+            _restore_stock(reservation_id, now)
+    reservation = StockReservation.objects.filter(id=reservation_id).first()
+    if reservation is None:
+        return False, None
+    return bool(released) or reservation.status in (StockReservation.RELEASED, StockReservation.EXPIRED), reservation
+
+
+def sweep_expired(batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Expire pending reservations past their deadline - returns how many were expired"""
+    now = timezone.now()
+    expired_ids = list(
+        StockReservation.objects.filter(
+            status=StockReservation.PENDING, expires_at__lte=now
+        ).values_list('id', flat=True)[:batch_size]
+    )
+    expired = 0
+    for reservation_id in expired_ids:
+        with transaction.atomic():
+            # A commit or release may have won the race since the query above
+            if _expire(reservation_id, now):
+                _restore_stock(reservation_id, now)
+                expired += 1
+    return expired
+
+
+class ReservationSweeper:
+    """Background thread expiring abandoned reservations
+
+    Started by the first reservation call, so management commands such as
+    migrate do not spawn it; the sweep_reservations command does the same
+    work on demand.
+    """
+
+    def __init__(self, interval: float = SWEEP_INTERVAL_SECONDS):
+        self.interval = interval
+        self.sweeps = 0
+        self.expired = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.expired += sweep_expired()
+                self.sweeps += 1
+            except DatabaseError:
+                pass  # Retried on the next sweep
+            finally:
+                close_old_connections()
+
+
+# Singleton instance
+sweeper = ReservationSweeper()
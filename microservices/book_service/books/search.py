@@ -0,0 +1,133 @@
+"""
+Full-text Search for Book Service
+SQLite FTS5 index over book title and author, kept in sync by triggers
+"""
+import re
+from django.db import OperationalError, connections
+from typing import Dict, List, Optional, Tuple
+from .models import Book
+
+FTS_TABLE = 'books_fts'
+BOOK_TABLE = Book._meta.db_table
+
+# Title matches weigh more than author matches in bm25() ranking
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 5.0
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# External-content table: the index stores no copy of the text, just the
+# tokens keyed by the books table's rowid. Prefix indexes keep "dun*"
+# style queries from scanning the whole term list.
+_CREATE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author,
+        content='{BOOK_TABLE}', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {BOOK_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author) VALUES (new.rowid, new.title, new.author);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {BOOK_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, author ON {BOOK_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+        INSERT INTO {FTS_TABLE}(rowid, title, author) VALUES (new.rowid, new.title, new.author);
+    END""",
+]
+
+# Whether each database has the index, once known
+_available: Dict[str, bool] = {}
+
+
+def _table_exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [name])
+    return cursor.fetchone() is not None
+
+
+def ensure_search_index(using: str = 'default') -> bool:
+    """Create the index and its triggers if missing, indexing existing books
+
+    Returns False when the database cannot hold the index (not SQLite or
+    built without FTS5), in which case search falls back to LIKE.
+    """
+    if _available.get(using) is not None:
+        return _available[using]
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        _available[using] = False
+        return False
+    with connection.cursor() as cursor:
+        if not _table_exists(cursor, BOOK_TABLE):
+            return False  # Not migrated yet - asked again after migrate
+        created = not _table_exists(cursor, FTS_TABLE)
+        try:
+            for statement in _CREATE_STATEMENTS:
+                cursor.execute(statement)
+        except OperationalError as e:
+            if 'fts5' not in str(e).lower():
+                raise
+            _available[using] = False
+            return False
+    if created:
+        rebuild_search_index(using)
+    _available[using] = True
+    return True
+
+
+def rebuild_search_index(using: str = 'default') -> int:
+    """Re-read every book into the index - returns the number of books indexed"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"SELECT COUNT(*) FROM {BOOK_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def optimize_search_index(using: str = 'default') -> None:
+    """Merge the index b-trees - worth running after a large backfill"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def match_expression(text: str) -> Optional[str]:
+    """FTS5 MATCH expression for free text typed into a search box
+
+    Each word becomes a quoted prefix term, so "dun herb" matches
+    "Dune" by "Frank Herbert", and FTS5 operators in the input are
+    treated as plain words. None when the text has no words.
+    """
+    tokens = _TOKEN.findall(text)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_matches(text: str, limit: int, after: Optional[Tuple[float, str]] = None,
+                   using: str = 'default') -> List[Tuple[float, str]]:
+    """(score, book id) of the best matching books, best (lowest bm25 score) first
+
+    after is the (score, id) of the last match already served, for keyset
+    pagination - the next page starts right after it.
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    params: list = [expression]
+    seek = ''
+    if after is not None:
+        seek = 'WHERE score > %s OR (score = %s AND id > %s)'
+        params += [after[0], after[0], after[1]]
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"""SELECT score, id FROM (
+                    SELECT bm25({FTS_TABLE}, {TITLE_WEIGHT}, {AUTHOR_WEIGHT}) AS score, b.id AS id
+                    FROM {FTS_TABLE} JOIN {BOOK_TABLE} AS b ON b.rowid = {FTS_TABLE}.rowid
+                    WHERE {FTS_TABLE} MATCH %s
+                ) {seek}
+                ORDER BY score, id
+                LIMIT %s""",
+            params + [limit]
+        )
+        return [(score, book_id) for score, book_id in cursor.fetchall()]
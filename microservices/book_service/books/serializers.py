@@ -17,3 +17,15 @@ class StockUpdateSerializer(serializers.Serializer):
     """Serializer for updating stock"""
     quantity = serializers.IntegerField()
     operation = serializers.ChoiceField(choices=['reduce', 'increase'], default='reduce')
+
+
+class ReservationItemSerializer(serializers.Serializer):
+    """One line of a stock reservation request"""
+    book_id = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReserveStockSerializer(serializers.Serializer):
+    """Serializer for reserving stock for a checkout"""
+    items = ReservationItemSerializer(many=True, allow_empty=False)
+    ttl_seconds = serializers.IntegerField(min_value=1, required=False)
@@ -0,0 +1,85 @@
+"""
+Stock Changes for Book Service
+Set-based stock reductions - one read and one conditional UPDATE for any number of books
+"""
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+from typing import Dict, Any, Iterable, List, Optional, Set
+from .models import Book
+
+
+class StockShortage(Exception):
+    """Some books are missing or short - nothing was reduced"""
+
+    def __init__(self, books: Dict[str, Book], missing: Set[str], short: Set[str]):
+        super().__init__('Insufficient stock')
+        self.books = books
+        self.missing = missing
+        self.short = short
+
+
+def valid_quantity(quantity: Any) -> bool:
+    return isinstance(quantity, int) and not isinstance(quantity, bool) and quantity > 0
+
+
+def merge_quantities(items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Total quantity per book id, in first-seen order"""
+    quantities: Dict[str, int] = {}
+    for item in items:
+        # A missing id stays None, which take_stock reports as a missing book
+        book_id = item.get('book_id')
+        quantities[book_id] = quantities.get(book_id, 0) + item['quantity']
+    return quantities
+
+
+def take_stock(quantities: Dict[str, int], now=None) -> Dict[str, Book]:
+    """Reduce every book's stock by its quantity, or no book's at all
+
+    Call inside transaction.atomic(). The books are read in one id__in
+    query and reduced in one UPDATE whose WHERE clause requires enough
+    stock for each of them; if a concurrent change makes that UPDATE miss
+    a row, StockShortage is raised so the caller's transaction rolls back.
+    Returns the books as read before the reduction; no quantities reduce nothing.
+    """
+    if not quantities:
+        return {}
+    books = Book.objects.select_for_update().in_bulk(list(quantities))
+    missing = {book_id for book_id in quantities if book_id not in books}
+    short = {
+        book_id for book_id, quantity in quantities.items()
+        if book_id in books and books[book_id].stock < quantity
+    }
+    if missing or short:
+        raise StockShortage(books, missing, short)
+
+    enough_stock = Q()
+    for book_id, quantity in quantities.items():
+        enough_stock |= Q(id=book_id, stock__gte=quantity)
+    reduced = Book.objects.filter(enough_stock).update(
+        stock=Case(
+            *[When(id=book_id, then=F('stock') - quantity) for book_id, quantity in quantities.items()],
+            output_field=PositiveIntegerField()
+        ),
+        updated_at=now or timezone.now()
+    )
+    if reduced != len(quantities):
+        # Stock changed after the read - which book fell short is no longer known
+        raise StockShortage(books, set(), set(quantities))
+    return books
+
+
+def shortage_results(items: List[Dict[str, Any]], shortage: Optional[StockShortage], invalid: Set[int] = frozenset()) -> List[Dict[str, Any]]:
+    """Per-item failure results of a batch that reduced nothing, in bulk_reduce's format"""
+    results = []
+    for index, item in enumerate(items):
+        book_id = item.get('book_id')
+        if index in invalid:
+            error = 'Invalid quantity'
+        elif shortage is not None and book_id in shortage.missing:
+            error = 'Book not found'
+        elif shortage is not None and book_id in shortage.short:
+            error = 'Insufficient stock'
+        else:
+            error = 'Not reduced - another item in the batch failed'
+        results.append({'book_id': book_id, 'success': False, 'error': error})
+    return results
@@ -0,0 +1,489 @@
+"""Tests for Book Service (Microservices)"""
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .importer import import_books, read_csv, read_jsonl
+from .models import Book, StockReservation
+from .pagination import KeysetPagination
+from .search import match_expression, rebuild_search_index
+from .stock import StockShortage, take_stock
+from . import reservations
+
+
+def make_book(title='Dune', author='Frank Herbert', stock=5, **fields):
+    # Ids arrive over HTTP as strings, not the UUID the field default gives
+    fields.setdefault('id', str(uuid.uuid4()))
+    return Book.objects.create(title=title, author=author, price=Decimal('9.99'), stock=stock, **fields)
+
+
+@mock.patch.object(reservations.sweeper, 'ensure_started')
+class ReservationTests(TestCase):
+    """reserve, commit, release and expiry of stock holds"""
+
+    def setUp(self):
+        self.dune = make_book('Dune', stock=5)
+        self.emma = make_book('Emma', author='Jane Austen', stock=2)
+        self.client = APIClient()
+
+    def stock(self, book):
+        book.refresh_from_db()
+        return book.stock
+
+    def overdue(self, reservation):
+        StockReservation.objects.filter(id=reservation.id).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_reserve_holds_stock_for_every_item(self, ensure_started):
+        reservation, items = reservations.reserve([
+            {'book_id': self.dune.id, 'quantity': 2},
+            {'book_id': self.emma.id, 'quantity': 1},
+            {'book_id': self.dune.id, 'quantity': 1},
+        ])
+        self.assertEqual(reservation.status, StockReservation.PENDING)
+        self.assertEqual([(item['book_id'], item['quantity']) for item in items], [(self.dune.id, 3), (self.emma.id, 1)])
+        self.assertEqual(self.stock(self.dune), 2)
+        self.assertEqual(self.stock(self.emma), 1)
+
+    def test_reserve_holds_nothing_on_a_shortage(self, ensure_started):
+        with self.assertRaises(reservations.ReservationError) as caught:
+            reservations.reserve([
+                {'book_id': self.dune.id, 'quantity': 2},
+                {'book_id': self.emma.id, 'quantity': 3},
+                {'book_id': 'missing', 'quantity': 1},
+            ])
+        errors = {item['book_id']: item.get('error') for item in caught.exception.items}
+        self.assertEqual(errors, {self.dune.id: None, self.emma.id: 'Insufficient stock', 'missing': 'Book not found'})
+        self.assertEqual(self.stock(self.dune), 5)
+        self.assertEqual(self.stock(self.emma), 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_commit_keeps_the_stock_sold(self, ensure_started):
+        reservation, _ = reservations.reserve([{'book_id': self.dune.id, 'quantity': 2}])
+        self.assertEqual(reservations.commit(reservation.id)[0], True)
+        self.assertEqual(reservations.commit(reservation.id)[0], True)
+        self.assertEqual(reservations.release(reservation.id)[0], False)
+        self.assertEqual(self.stock(self.dune), 3)
+
+    def test_release_returns_the_stock(self, ensure_started):
+        reservation, _ = reservations.reserve([{'book_id': self.dune.id, 'quantity': 2}])
+        self.assertEqual(reservations.release(reservation.id)[0], True)
+        self.assertEqual(reservations.release(reservation.id)[0], True)
+        self.assertEqual(reservations.commit(reservation.id)[0], False)
+        self.assertEqual(self.stock(self.dune), 5)
+
+    def test_sweep_expires_overdue_reservations(self, ensure_started):
+        overdue, _ = reservations.reserve([{'book_id': self.dune.id, 'quantity': 2}])
+        current, _ = reservations.reserve([{'book_id': self.emma.id, 'quantity': 1}])
+        self.overdue(overdue)
+        self.assertEqual(reservations.sweep_expired(), 1)
+        self.assertEqual(reservations.sweep_expired(), 0)
+        overdue.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual(overdue.status, StockReservation.EXPIRED)
+        self.assertEqual(current.status, StockReservation.PENDING)
+        self.assertEqual(self.stock(self.dune), 5)
+        self.assertEqual(self.stock(self.emma), 1)
+
+    def test_commit_expires_an_overdue_reservation(self, ensure_started):
+        reservation, _ = reservations.reserve([{'book_id': self.dune.id, 'quantity': 2}])
+        self.overdue(reservation)
+        committed, reservation = reservations.commit(reservation.id)
+        self.assertFalse(committed)
+        self.assertEqual(reservation.status, StockReservation.EXPIRED)
+        self.assertEqual(self.stock(self.dune), 5)
+        self.assertEqual(reservations.sweep_expired(), 0)
+        self.assertEqual(self.stock(self.dune), 5)
+
+    def test_reservation_endpoints(self, ensure_started):
+        response = self.client.post('/api/reservations/', {
+            'items': [{'book_id': self.dune.id, 'quantity': 4}], 'ttl_seconds': 60
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        reservation_id = response.data['reservation_id']
+
+        response = self.client.post('/api/reservations/', {
+            'items': [{'book_id': self.dune.id, 'quantity': 4}]
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['items'][0]['available_stock'], 1)
+
+        response = self.client.post(f'/api/reservations/{reservation_id}/commit/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], StockReservation.COMMITTED)
+        response = self.client.post(f'/api/reservations/{reservation_id}/release/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.post('/api/reservations/missing/commit/').status_code, 404)
+
+    def test_commit_endpoint_reports_expired(self, ensure_started):
+        reservation, _ = reservations.reserve([{'book_id': self.dune.id, 'quantity': 2}])
+        self.overdue(reservation)
+        response = self.client.post(f'/api/reservations/{reservation.id}/commit/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['status'], StockReservation.EXPIRED)
+
+
+class StockTests(TestCase):
+    """take_stock and the bulk_check / bulk_reduce endpoints"""
+
+    def setUp(self):
+        self.dune = make_book('Dune', stock=5)
+        self.emma = make_book('Emma', author='Jane Austen', stock=2)
+        self.client = APIClient()
+
+    def stock(self, book):
+        book.refresh_from_db()
+        return book.stock
+
+    def test_take_stock_reduces_every_book(self):
+        books = take_stock({self.dune.id: 3, self.emma.id: 2})
+        self.assertEqual(books[self.dune.id].stock, 5)
+        self.assertEqual(self.stock(self.dune), 2)
+        self.assertEqual(self.stock(self.emma), 0)
+
+    def test_take_stock_reduces_nothing_on_a_shortage(self):
+        with self.assertRaises(StockShortage) as caught:
+            take_stock({self.dune.id: 1, self.emma.id: 3, 'missing': 1})
+        self.assertEqual(caught.exception.short, {self.emma.id})
+        self.assertEqual(caught.exception.missing, {'missing'})
+        self.assertEqual(self.stock(self.dune), 5)
+        self.assertEqual(self.stock(self.emma), 2)
+
+    def bulk_reduce(self, items):
+        response = self.client.post('/api/books/bulk_reduce/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_bulk_reduce_duplicate_ids(self):
+        results = self.bulk_reduce([
+            {'book_id': self.dune.id, 'quantity': 2},
+            {'book_id': self.emma.id, 'quantity': 1},
+            {'book_id': self.dune.id, 'quantity': 3},
+        ])
+        self.assertEqual([result['success'] for result in results], [True, True, True])
+        self.assertEqual([result['new_stock'] for result in results], [3, 1, 0])
+        self.assertEqual(self.stock(self.dune), 0)
+
+    def test_bulk_reduce_duplicates_counted_together(self):
+        # 3 + 3 exceeds the stock of 5 although each item alone fits
+        results = self.bulk_reduce([
+            {'book_id': self.dune.id, 'quantity': 3},
+            {'book_id': self.dune.id, 'quantity': 3},
+        ])
+        self.assertEqual([result['error'] for result in results], ['Insufficient stock'] * 2)
+        self.assertEqual(self.stock(self.dune), 5)
+
+    def test_bulk_reduce_shortage_reduces_nothing(self):
+        results = self.bulk_reduce([
+            {'book_id': self.dune.id, 'quantity': 1},
+            {'book_id': self.emma.id, 'quantity': 3},
+            {'book_id': 'missing', 'quantity': 1},
+        ])
+        self.assertEqual([result['error'] for result in results], [
+            'Not reduced - another item in the batch failed', 'Insufficient stock', 'Book not found'
+        ])
+        self.assertEqual(self.stock(self.dune), 5)
+        self.assertEqual(self.stock(self.emma), 2)
+
+    def test_bulk_reduce_no_items(self):
+        self.assertEqual(self.bulk_reduce([]), [])
+        self.assertEqual(take_stock({}), {})
+        self.assertEqual(self.stock(self.dune), 5)
+        self.assertEqual(self.stock(self.emma), 2)
+
+    def test_bulk_reduce_item_without_book_id(self):
+        results = self.bulk_reduce([
+            {'book_id': self.dune.id, 'quantity': 1},
+            {'quantity': 1},
+        ])
+        self.assertEqual([result['error'] for result in results], [
+            'Not reduced - another item in the batch failed', 'Book not found'
+        ])
+        self.assertIsNone(results[1]['book_id'])
+        self.assertEqual(self.stock(self.dune), 5)
+
+    def test_bulk_reduce_invalid_quantity(self):
+        results = self.bulk_reduce([
+            {'book_id': self.dune.id, 'quantity': 1},
+            {'book_id': self.emma.id, 'quantity': 0},
+        ])
+        self.assertEqual(results[1]['error'], 'Invalid quantity')
+        self.assertEqual(self.stock(self.dune), 5)
+
+    def test_bulk_check(self):
+        response = self.client.post('/api/books/bulk_check/', {'items': [
+            {'book_id': self.dune.id, 'quantity': 5},
+            {'book_id': self.emma.id, 'quantity': 3},
+            {'book_id': 'missing', 'quantity': 1},
+        ]}, format='json')
+        self.assertFalse(response.data['all_available'])
+        items = response.data['items']
+        self.assertTrue(items[0]['has_sufficient_stock'])
+        self.assertFalse(items[1]['has_sufficient_stock'])
+        self.assertEqual(items[1]['available_stock'], 2)
+        self.assertEqual(items[2]['error'], 'Book not found')
+
+
+class SearchTests(TestCase):
+    """FTS5 prefix search, ranking and the LIKE fallback"""
+
+    def setUp(self):
+        self.dune = make_book('Dune', author='Frank Herbert')
+        self.messiah = make_book('Dune Messiah', author='Frank Herbert')
+        self.emma = make_book('Emma', author='Jane Austen')
+        self.herbs = make_book('Herbs of the World', author='A. Gardener')
+        self.client = APIClient()
+
+    def search(self, q):
+        response = self.client.get('/api/books/search/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [book['title'] for book in response.data['results']]
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('dun herb'), '"dun"* "herb"*')
+        self.assertEqual(match_expression('title:"x" OR'), '"title"* "x"* "OR"*')
+        self.assertIsNone(match_expression(' -* '))
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(sorted(self.search('dun herb')), ['Dune', 'Dune Messiah'])
+        self.assertEqual(self.search('austen'), ['Emma'])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('herb')[0], 'Herbs of the World')
+
+    def test_index_follows_book_changes(self):
+        Book.objects.filter(id=self.emma.id).update(title='Persuasion')
+        self.assertEqual(self.search('emma'), [])
+        self.assertEqual(self.search('persua'), ['Persuasion'])
+        Book.objects.filter(id=self.dune.id).delete()
+        self.assertEqual(self.search('dune'), ['Dune Messiah'])
+        self.assertEqual(rebuild_search_index(), 3)
+        self.assertEqual(self.search('dune'), ['Dune Messiah'])
+
+    def test_operators_are_plain_words(self):
+        self.assertEqual(self.search('dune OR emma'), [])
+        self.assertEqual(self.search('"dune'), ['Dune', 'Dune Messiah'])
+
+    def test_empty_query_lists_every_book(self):
+        self.assertEqual(len(self.search('')), 4)
+
+    def test_like_fallback_without_the_index(self):
+        with mock.patch('books.views.ensure_search_index', return_value=False):
+            # The whole query is one substring: infixes match, words in another order do not
+            self.assertEqual(self.search('dune herb'), [])
+            self.assertEqual(self.search('une'), ['Dune', 'Dune Messiah'])
+            self.assertEqual(self.search('austen'), ['Emma'])
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages over (title, id) and (score, id)"""
+
+    def setUp(self):
+        # Three books share a title, so the id breaks the tie inside a page and across pages
+        for index in range(3):
+            make_book('Dune', id=f'dune-{index}', stock=index)
+        make_book('Emma', id='emma', author='Jane Austen')
+        make_book('Anna Karenina', id='anna', author='Leo Tolstoy', stock=0)
+        self.client = APIClient()
+
+    def walk(self, url, **params):
+        """Every page of a list, following next_cursor"""
+        pages = []
+        cursor = None
+        while True:
+            query = {**params, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.data), ['next_cursor', 'results'])
+            pages.append([book['id'] for book in response.data['results']])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_pages_follow_title_then_id(self):
+        self.assertEqual(self.walk('/api/books/', page_size=2), [
+            ['anna', 'dune-0'], ['dune-1', 'dune-2'], ['emma']
+        ])
+
+    def test_exact_last_page_has_no_cursor(self):
+        self.assertEqual(self.walk('/api/books/', page_size=5), [['anna', 'dune-0', 'dune-1', 'dune-2', 'emma']])
+
+    def test_in_stock_pages(self):
+        self.assertEqual(self.walk('/api/books/in_stock/', page_size=1), [['dune-1'], ['dune-2'], ['emma']])
+
+    def test_search_pages_by_score(self):
+        pages = self.walk('/api/books/search/', q='dune', page_size=2)
+        self.assertEqual(sorted(sum(pages, [])), ['dune-0', 'dune-1', 'dune-2'])
+        self.assertEqual([len(page) for page in pages], [2, 1])
+
+    def test_page_size_is_clamped(self):
+        response = self.client.get('/api/books/', {'page_size': 0})
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get('/api/books/', {'page_size': 'many'})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_bad_cursors_are_rejected(self):
+        for cursor in [
+            'not base64!',
+            KeysetPagination.encode_cursor(['Dune']),
+            KeysetPagination.encode_cursor(['Dune', 7]),
+            KeysetPagination.encode_cursor([1.5, 'dune-0']),
+        ]:
+            response = self.client.get('/api/books/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+        response = self.client.get('/api/books/search/', {'q': 'dune', 'cursor': KeysetPagination.encode_cursor(['Dune', 'x'])})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTests(TestCase):
+    """ETag and Last-Modified on book detail and list responses"""
+
+    def setUp(self):
+        self.dune = make_book('Dune')
+        make_book('Emma', author='Jane Austen')
+        self.client = APIClient()
+
+    def test_detail_if_none_match(self):
+        url = f'/api/books/{self.dune.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        Book.objects.filter(id=self.dune.id).update(stock=1, updated_at=timezone.now())
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['stock'], 1)
+
+    def test_detail_if_modified_since(self):
+        url = f'/api/books/{self.dune.id}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_if_none_match_runs_one_query(self):
+        response = self.client.get('/api/books/', {'page_size': 1})
+        etag = response['ETag']
+        # Only the catalog version is read - no list query, no serializer
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/books/', {'page_size': 1}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_validators_differ_per_page_and_query(self):
+        first = self.client.get('/api/books/', {'page_size': 1})['ETag']
+        self.assertNotEqual(self.client.get('/api/books/', {'page_size': 2})['ETag'], first)
+        self.assertNotEqual(self.client.get('/api/books/search/', {'q': 'dune'})['ETag'], first)
+
+    def test_list_changes_with_any_book(self):
+        for url, query in [('/api/books/', {}), ('/api/books/in_stock/', {}), ('/api/books/search/', {'q': 'emma'})]:
+            etag = self.client.get(url, query)['ETag']
+            self.assertEqual(self.client.get(url, query, headers={'If-None-Match': etag}).status_code, 304)
+            make_book('Persuasion', author='Jane Austen')
+            response = self.client.get(url, query, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_if_modified_since(self):
+        last_modified = self.client.get('/api/books/')['Last-Modified']
+        response = self.client.get('/api/books/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+
+class ImportTests(TestCase):
+    """CSV and JSONL catalog import - upserts, conflicts and bad rows"""
+
+    CSV = (
+        'id,title,author,price,stock\n'
+        'dune,Dune,Frank Herbert,9.99,5\n'
+        'emma,Emma,Jane Austen,not-a-price,2\n'
+        ',Persuasion,Jane Austen,7.50,\n'
+    )
+
+    def setUp(self):
+        make_book('Dune (old edition)', id='dune', stock=1)
+        self.client = APIClient()
+
+    def test_csv_updates_existing_books(self):
+        stats = import_books(read_csv(self.CSV.splitlines(keepends=True)), batch_size=2)
+        self.assertEqual((stats.rows, stats.imported, stats.rejected, stats.batches), (3, 2, 1, 1))
+        self.assertEqual(stats.errors, [{'line': 3, 'error': 'price must be a number'}])
+        dune = Book.objects.get(id='dune')
+        self.assertEqual((dune.title, dune.stock), ('Dune', 5))
+        self.assertEqual(Book.objects.get(title='Persuasion').stock, 0)
+        self.assertFalse(Book.objects.filter(id='emma').exists())
+
+    def test_ignore_leaves_existing_books(self):
+        stats = import_books(read_csv(self.CSV.splitlines(keepends=True)), on_conflict='ignore')
+        self.assertEqual(stats.imported, 2)
+        dune = Book.objects.get(id='dune')
+        self.assertEqual((dune.title, dune.stock), ('Dune (old edition)', 1))
+        self.assertTrue(Book.objects.filter(title='Persuasion').exists())
+
+    def test_jsonl_malformed_rows(self):
+        lines = [
+            json.dumps({'id': 'emma', 'title': 'Emma', 'author': 'Jane Austen', 'price': 5.5, 'stock': 2}),
+            '{"id": "broken",',
+            '',
+            json.dumps(['not', 'an', 'object']),
+            json.dumps({'id': 'anna', 'title': 'Anna Karenina', 'author': '', 'price': 3}),
+            json.dumps({'id': 'war', 'title': 'War and Peace', 'author': 'Leo Tolstoy', 'price': 3, 'stock': -1}),
+        ]
+        stats = import_books(read_jsonl(lines))
+        self.assertEqual((stats.rows, stats.imported, stats.rejected), (5, 1, 4))
+        self.assertEqual([error['line'] for error in stats.errors], [2, 4, 5, 6])
+        self.assertTrue(stats.errors[0]['error'].startswith('Invalid JSON'))
+        self.assertEqual(stats.errors[2]['error'], 'author is required')
+        self.assertEqual(Book.objects.get(id='emma').price, Decimal('5.50'))
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_repeated_id_keeps_the_last_row(self):
+        lines = [
+            json.dumps({'id': 'dune', 'title': 'Dune', 'author': 'Frank Herbert', 'price': 9, 'stock': stock})
+            for stock in (3, 4)
+        ]
+        import_books(read_jsonl(lines))
+        self.assertEqual(Book.objects.get(id='dune').stock, 4)
+
+    def test_imported_books_are_searchable(self):
+        import_books(read_csv(self.CSV.splitlines(keepends=True)))
+        response = self.client.get('/api/books/search/', {'q': 'persua'})
+        self.assertEqual([book['title'] for book in response.data['results']], ['Persuasion'])
+
+    def test_import_endpoint(self):
+        response = self.client.generic(
+            'POST', '/api/books/import/?on_conflict=ignore', self.CSV, content_type='text/csv'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['imported'], response.data['rejected']), (2, 1))
+        self.assertEqual(Book.objects.get(id='dune').stock, 1)
+        response = self.client.generic('POST', '/api/books/import/', self.CSV, content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+        response = self.client.generic(
+            'POST', '/api/books/import/?on_conflict=replace', self.CSV, content_type='text/csv'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as feed:
+            feed.write(self.CSV)
+        self.addCleanup(os.remove, feed.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_books', feed.name, '--batch-size', '1', stdout=out, stderr=err)
+        self.assertIn('Imported 2 book(s) from 3 row(s), 1 rejected', out.getvalue())
+        self.assertIn('Line 3: price must be a number', err.getvalue())
+        self.assertEqual(Book.objects.get(id='dune').title, 'Dune')
@@ -1,10 +1,11 @@
 """URLs for Book Service (Microservices)"""
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BookViewSet
+from .views import BookViewSet, ReservationViewSet
 
 router = DefaultRouter()
 router.register(r'books', BookViewSet)
+router.register(r'reservations', ReservationViewSet, basename='reservation')
 
 urlpatterns = [
     path('', include(router.urls)),
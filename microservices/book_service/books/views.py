@@ -1,31 +1,132 @@
 """Views for Book Service (Microservices)"""
+import codecs
+import csv
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
 from django.db.models import Q
-from .models import Book
-from .serializers import BookSerializer, StockUpdateSerializer
+from .conditional import book_validators, list_validators, not_modified, set_validators
+from .importer import CONTENT_TYPES, ON_CONFLICT, READERS, ImportStats, import_books
+from .models import Book, StockReservation
+from .pagination import KeysetPagination
+from .reservations import ReservationError, commit, release, reserve, sweeper
+from .search import ensure_search_index, match_expression, search_matches
+from .serializers import BookSerializer, ReserveStockSerializer, StockUpdateSerializer
+from .stock import StockShortage, merge_quantities, shortage_results, take_stock, valid_quantity
+
+# Upper bound on ids accepted by bulk_get
+BULK_GET_LIMIT = 100
 
 
 class BookViewSet(viewsets.ModelViewSet):
     """ViewSet for Book - Single Responsibility"""
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    pagination_class = KeysetPagination
+
+    def _conditional_list(self, request, build):
+        """A list response with catalog validators, or 304 before build() runs any query"""
+        validators = list_validators(request)
+        response = not_modified(request, validators)
+        if response is None:
+            response = set_validators(build(), validators)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional_list(request, lambda: super(BookViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        book = self.get_object()
+        validators = book_validators(request, book)
+        response = not_modified(request, validators)
+        if response is None:
+            response = set_validators(Response(self.get_serializer(book).data), validators)
+        return response
 
     @action(detail=False, methods=['get'])
     def in_stock(self, request):
         """Get all books that are in stock"""
+        return self._conditional_list(request, lambda: self._in_stock(request))
+
+    def _in_stock(self, request):
         books = Book.objects.filter(stock__gt=0)
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(books)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def search(self, request):
-        """Search books by title or author"""
+        """Search books by title or author - best matches first, words match as prefixes"""
+        return self._conditional_list(request, lambda: self._search(request))
+
+    def _search(self, request):
         query = request.query_params.get('q', '')
-        books = Book.objects.filter(
-            Q(title__icontains=query) | Q(author__icontains=query)
-        )
+        
+        if not match_expression(query):
+            page = self.paginate_queryset(Book.objects.all())
+        elif ensure_search_index():
+            # Ranked pages seek on (score, id) rather than (title, id)
+            matches = self.paginator.paginate_keyset(
+                request,
+                lambda after, limit: search_matches(query, limit, after),
+                lambda match: match,
+                (float, str)
+            )
+            found = Book.objects.in_bulk([book_id for _, book_id in matches])
+            page = [found[book_id] for _, book_id in matches if book_id in found]
+        else:
+            page = self.paginate_queryset(Book.objects.filter(
+                Q(title__icontains=query) | Q(author__icontains=query)
+            ))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """Import a CSV or JSONL feed streamed in the request body - for supplier catalogs
+        
+        The body is read line by line and written in batches, so feeds far
+        larger than memory are fine. Existing ids are updated unless
+        ?on_conflict=ignore.
+        """
+        content_type = request.content_type.split(';')[0].strip().lower()
+        input_format = CONTENT_TYPES.get(content_type)
+        if input_format is None:
+            return Response(
+                {'error': f'Content-Type must be one of {", ".join(CONTENT_TYPES)}'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        on_conflict = request.query_params.get('on_conflict', 'update')
+        if on_conflict not in ON_CONFLICT:
+            return Response(
+                {'error': f'on_conflict must be one of {", ".join(ON_CONFLICT)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # The raw stream, not request.data, so the body is never held in memory
+        body = request.stream
+        lines = codecs.iterdecode(iter(body.readline, b''), 'utf-8-sig') if body is not None else iter(())
+        stats = ImportStats()
+        try:
+            import_books(READERS[input_format](lines), on_conflict=on_conflict, stats=stats)
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response(
+                {'error': f'Unreadable input - batches before it were imported: {e}', **stats.as_dict()},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(stats.as_dict())
+
+    @action(detail=False, methods=['get'])
+    def bulk_get(self, request):
+        """Get several books by id in one query - for composite gateway views"""
+        ids = [book_id for book_id in request.query_params.get('ids', '').split(',') if book_id]
+        if len(ids) > BULK_GET_LIMIT:
+            return Response(
+                {'error': f'At most {BULK_GET_LIMIT} ids per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        books = Book.objects.filter(id__in=ids)
         serializer = self.get_serializer(books, many=True)
         return Response(serializer.data)
 
@@ -54,9 +155,19 @@ class BookViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def check_stock(self, request, pk=None):
-        """Check if book has sufficient stock - for inter-service communication"""
+        """Check if book has sufficient stock - for inter-service communication
+        
+        Also carries the book's title and price, so a cart can validate and
+        price an item in one call.
+        """
+        try:
+            quantity = int(request.query_params.get('quantity', 1))
+        except ValueError:
+            return Response(
+                {'error': 'quantity must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         book = self.get_object()
-        quantity = int(request.query_params.get('quantity', 1))
         return Response({
             'book_id': book.id,
             'title': book.title,
@@ -69,6 +180,8 @@ class BookViewSet(viewsets.ModelViewSet):
     def bulk_check(self, request):
         """Bulk check stock for multiple books - for checkout"""
         items = request.data.get('items', [])
+        # Every book in one id__in query
+        books = Book.objects.in_bulk([item.get('book_id') for item in items])
         results = []
         all_available = True
         
@@ -76,24 +189,31 @@ class BookViewSet(viewsets.ModelViewSet):
             book_id = item.get('book_id')
             quantity = item.get('quantity', 1)
             
-            try:
-                book = Book.objects.get(id=book_id)
-                has_stock = book.has_sufficient_stock(quantity)
-                if not has_stock:
-                    all_available = False
+            book = books.get(book_id)
+            if book is None:
+                all_available = False
                 results.append({
                     'book_id': book_id,
-                    'title': book.title,
-                    'price': str(book.price),
-                    'has_sufficient_stock': has_stock,
-                    'available_stock': book.stock
+                    'error': 'Book not found'
                 })
-            except Book.DoesNotExist:
+                continue
+            if not valid_quantity(quantity):
                 all_available = False
                 results.append({
                     'book_id': book_id,
-                    'error': 'Book not found'
+                    'error': 'Invalid quantity'
                 })
+                continue
+            has_stock = book.has_sufficient_stock(quantity)
+            if not has_stock:
+                all_available = False
+            results.append({
+                'book_id': book_id,
+                'title': book.title,
+                'price': str(book.price),
+                'has_sufficient_stock': has_stock,
+                'available_stock': book.stock
+            })
         
         return Response({
             'all_available': all_available,
@@ -102,33 +222,111 @@ class BookViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['post'])
     def bulk_reduce(self, request):
-        """Bulk reduce stock for multiple books - for checkout"""
-        items = request.data.get('items', [])
-        results = []
+        """Bulk reduce stock for multiple books - for checkout
         
-        for item in items:
-            book_id = item.get('book_id')
-            quantity = item.get('quantity', 1)
-            
-            try:
-                book = Book.objects.get(id=book_id)
-                if book.reduce_stock(quantity):
-                    results.append({
-                        'book_id': book_id,
-                        'success': True,
-                        'new_stock': book.stock
-                    })
-                else:
-                    results.append({
-                        'book_id': book_id,
-                        'success': False,
-                        'error': 'Insufficient stock'
-                    })
-            except Book.DoesNotExist:
-                results.append({
-                    'book_id': book_id,
-                    'success': False,
-                    'error': 'Book not found'
-                })
+        All items are reduced together or none is: one read, one
+        conditional UPDATE and one re-read, in a single transaction.
+        """
+        items = [
+            {**item, 'quantity': item.get('quantity', 1)}
+            for item in request.data.get('items', [])
+        ]
+        if not items:
+            return Response({'results': []})
+        invalid = {index for index, item in enumerate(items) if not valid_quantity(item['quantity'])}
+        if invalid:
+            return Response({'results': shortage_results(items, None, invalid)})
         
+        try:
+            with transaction.atomic():
+                take_stock(merge_quantities(items))
+                stock = dict(Book.objects.filter(
+                    id__in=[item['book_id'] for item in items]
+                ).values_list('id', 'stock'))
+        except StockShortage as shortage:
+            return Response({'results': shortage_results(items, shortage)})
+        
+        # Walk back from the final stock so a book listed twice reports each step
+        results = []
+        for item in reversed(items):
+            results.append({
+                'book_id': item['book_id'],
+                'success': True,
+                'new_stock': stock[item['book_id']]
+            })
+            stock[item['book_id']] += item['quantity']
+        results.reverse()
         return Response({'results': results})
+
+
+class ReservationViewSet(viewsets.ViewSet):
+    """Stock reservations - reserve, then commit or release, for checkout"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Expire reservations left behind by an earlier run of this process
+        sweeper.ensure_started()
+
+    @staticmethod
+    def _reservation_data(reservation: StockReservation, items=None) -> dict:
+        if items is None:
+            items = [
+                {'book_id': item.book_id, 'quantity': item.quantity}
+                for item in reservation.items.all()
+            ]
+        return {
+            'reservation_id': reservation.id,
+            'status': reservation.status,
+            'expires_at': reservation.expires_at,
+            'items': items
+        }
+
+    def create(self, request):
+        """Reserve stock for all items, or for none of them"""
+        serializer = ReserveStockSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            reservation, items = reserve(
+                serializer.validated_data['items'],
+                serializer.validated_data.get('ttl_seconds')
+            )
+        except ReservationError as e:
+            return Response(
+                {'error': str(e), 'items': e.items},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(self._reservation_data(reservation, items), status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        reservation = StockReservation.objects.filter(id=pk).first()
+        if reservation is None:
+            return Response({'error': 'Reservation not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._reservation_data(reservation))
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        """Make the reservation final - the held stock stays sold"""
+        committed, reservation = commit(pk)
+        if reservation is None:
+            return Response({'error': 'Reservation not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not committed:
+            return Response(
+                {'error': f'Reservation is {reservation.status}', 'status': reservation.status},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(self._reservation_data(reservation))
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        """Cancel the reservation and put its stock back"""
+        released, reservation = release(pk)
+        if reservation is None:
+            return Response({'error': 'Reservation not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not released:
+            return Response(
+                {'error': f'Reservation is {reservation.status}', 'status': reservation.status},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(self._reservation_data(reservation))
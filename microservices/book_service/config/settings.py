@@ -1,8 +1,12 @@
 """Settings for Book Service (Microservices)"""
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Shared helpers in microservices/common
+sys.path.append(str(BASE_DIR.parent))
+
 SECRET_KEY = 'django-insecure-book-service-secret-key'
 DEBUG = True
 ALLOWED_HOSTS = ['*']
@@ -19,6 +23,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.metrics.MetricsMiddleware',
+    'common.deadline.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +73,20 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Stock held for a checkout between reserve and commit
+STOCK_RESERVATIONS = {
+    'TTL_SECONDS': 120,             # Default hold when the caller gives no ttl_seconds
+    'MAX_TTL_SECONDS': 900,
+    'SWEEP_INTERVAL_SECONDS': 30,   # Background expiry of abandoned holds (0 disables it)
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+# Bulk catalog import (import_books command and POST /api/books/import/)
+BOOK_IMPORT = {
+    'BATCH_SIZE': 1000,             # Rows per bulk INSERT and per transaction
+    'MAX_ERRORS_REPORTED': 100,     # Rejected rows listed in the report; later ones are only counted
+}
+
 # Service Discovery
 SERVICE_NAME = 'book-service'
 SERVICE_PORT = 8002
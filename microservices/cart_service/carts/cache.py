@@ -0,0 +1,118 @@
+"""
+Cart Cache for Cart Service
+Serialized carts by customer id, kept current by writing through on every cart change
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from common.metrics import registry
+
+
+CART_CACHE_REQUESTS = registry.counter(
+    'cart_cache_requests_total', 'Cart reads by cache outcome', ('outcome',)
+)
+
+
+class LocalCartCache:
+    """In-process LRU with a TTL per entry"""
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000, **options):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DjangoCartCache:
+    """Entries in a Django cache (CACHES alias) - memcached or Redis share them across instances"""
+
+    def __init__(self, ttl: float = 30, alias: str = 'default', **options):
+        self.ttl = ttl
+        self.cache = caches[alias]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.cache.set(key, value, self.ttl)
+
+    def delete(self, key: str) -> None:
+        self.cache.delete(key)
+
+
+class CartCache:
+    """Serialized carts by customer id on a pluggable backend
+
+    Views store the cart they just serialized after every change, so reads
+    between changes never touch the database. An older cart (by updated_at)
+    never replaces a newer one, which keeps racing writers from going back
+    in time.
+    """
+
+    KEY_PREFIX = 'cart:'
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, customer_id: str) -> Optional[Dict[str, Any]]:
+        data = self.backend.get(self.KEY_PREFIX + customer_id)
+        CART_CACHE_REQUESTS.labels('miss' if data is None else 'hit').inc()
+        return data
+
+    def put(self, customer_id: str, data: Dict[str, Any]) -> None:
+        key = self.KEY_PREFIX + customer_id
+        current = self.backend.get(key)
+        if current is not None and self._updated_at(current) > self._updated_at(data):
+            return
+        self.backend.set(key, dict(data))
+
+    @staticmethod
+    def _updated_at(data: Dict[str, Any]) -> str:
+        value = data.get('updated_at')
+        parsed = parse_datetime(value) if isinstance(value, str) else value
+        # ISO format with fixed microseconds orders the same as the datetimes
+        return parsed.isoformat(timespec='microseconds') if parsed is not None else ''
+
+    def invalidate(self, customer_id: str) -> None:
+        self.backend.delete(self.KEY_PREFIX + customer_id)
+
+
+def _build_cart_cache(config: Dict[str, Any]) -> CartCache:
+    backend_class = import_string(config.get('BACKEND', 'carts.cache.LocalCartCache'))
+    return CartCache(backend_class(
+        ttl=config.get('TTL_SECONDS', 30),
+        max_entries=config.get('MAX_ENTRIES', 10000),
+        alias=config.get('CACHE_ALIAS', 'default')
+    ))
+
+
+# Singleton instance
+cart_cache = _build_cart_cache(getattr(settings, 'CART_CACHE', {}))
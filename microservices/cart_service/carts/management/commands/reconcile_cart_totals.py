@@ -0,0 +1,48 @@
+"""Recompute the stored cart totals from the cart items"""
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from carts.cache import cart_cache
+from carts.models import Cart, CartItem
+
+CENT = Decimal('0.01')
+
+
+class Command(BaseCommand):
+    help = 'Recompute Cart.total_price and Cart.total_items with SQL aggregation and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted carts without fixing them')
+
+    def handle(self, *args, **options):
+        # One grouped query for the real totals of every cart with items
+        actual = {
+            row['cart_id']: (row['items'], Decimal(row['price']).quantize(CENT))
+            for row in CartItem.objects.values('cart_id').annotate(
+                items=Sum('quantity'),
+                price=Sum(ExpressionWrapper(
+                    F('book_price') * F('quantity'),
+                    output_field=DecimalField(max_digits=12, decimal_places=2)
+                ))
+            )
+        }
+
+        drifted = []
+        for cart in Cart.objects.only('id', 'customer_id', 'total_items', 'total_price').iterator(chunk_size=options['batch_size']):
+            items, price = actual.get(cart.id, (0, Decimal('0.00')))
+            if cart.total_items != items or cart.total_price.quantize(CENT) != price:
+                cart.total_items = items
+                cart.total_price = price
+                drifted.append(cart)
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                Cart.objects.bulk_update(drifted, ['total_items', 'total_price'], batch_size=options['batch_size'])
+            # Cached carts may hold the drifted totals - shared cache backends see this too
+            for cart in drifted:
+                cart_cache.invalidate(cart.customer_id)
+
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(drifted)} cart(s) with drifted totals'))
@@ -1,6 +1,8 @@
 """Cart Models for Cart Service (Microservices)"""
 import uuid
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 from decimal import Decimal
 
 
@@ -8,6 +10,8 @@ class Cart(models.Model):
     """Cart model - stores cart with customer reference"""
     id = models.CharField(max_length=100, primary_key=True, default=uuid.uuid4, editable=False)
     customer_id = models.CharField(max_length=100, unique=True)  # Reference to Customer Service
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))  # Kept in step with items
+    total_items = models.PositiveIntegerField(default=0)  # Kept in step with items
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -17,15 +21,21 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for customer {self.customer_id}"
 
-    @property
-    def total_price(self):
-        """Calculate total price of all items"""
-        return sum(item.subtotal for item in self.items.all())
-
-    @property
-    def total_items(self):
-        """Count total items in cart"""
-        return sum(item.quantity for item in self.items.all())
+    def adjust_totals(self, items_delta: int, price_delta: Decimal) -> None:
+        """Shift the stored totals in SQL - call in the same transaction as the item change"""
+        Cart.objects.filter(pk=self.pk).update(
+            total_items=F('total_items') + items_delta,
+            total_price=F('total_price') + price_delta,
+            updated_at=timezone.now()
+        )
+
+    def reset_totals(self) -> None:
+        """Zero the stored totals - call in the same transaction that empties the cart"""
+        Cart.objects.filter(pk=self.pk).update(
+            total_items=0,
+            total_price=Decimal('0'),
+            updated_at=timezone.now()
+        )
 
 
 class CartItem(models.Model):
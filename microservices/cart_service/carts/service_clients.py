@@ -1,21 +1,109 @@
 """Service Clients for Cart Service (Microservices)
 Handles inter-service communication
 """
+import threading
 import requests
 from django.conf import settings
+from common.balancer import LoadBalancer
+from common.deadline import DeadlineExceeded, clamp_timeout, expired, outgoing_headers
+from common.metrics import registry, upstream
+from common.pooling import pool_counters, pooled_session, retry_count
 
 
-class CustomerServiceClient:
+CONNECTIONS = registry.counter(
+    'upstream_connections_total', 'Connections used for downstream calls, new or reused from the pool', ('service', 'kind')
+)
+RETRIES = registry.counter(
+    'upstream_retries_total', 'Downstream calls resent after a refused or reset connection', ('service',)
+)
+
+
+class ServiceClient:
+    """Base client spreading calls across the instances of one service
+    
+    Calls share one keep-alive session, so consecutive calls reuse pooled
+    connections instead of opening a new one each time.
+    """
+    
+    def __init__(self, service_name: str, url_setting: str, default_url: str):
+        self.service_name = service_name
+        self.balancer = LoadBalancer.from_config(
+            getattr(settings, url_setting, default_url),
+            getattr(settings, 'LOAD_BALANCER', {})
+        )
+        pool_config = getattr(settings, 'SERVICE_CLIENT_POOL', {})
+        self.session = pooled_session(
+            pool_config.get('POOL_CONNECTIONS', 10),
+            pool_config.get('POOL_MAXSIZE', 20),
+            retries=pool_config.get('RETRIES', 2),
+            backoff_factor=pool_config.get('RETRY_BACKOFF', 0)
+        )
+        # Pool counters already turned into metrics
+        self._counted = (0, 0)
+        self._counted_lock = threading.Lock()
+    
+    def _count_connections(self) -> None:
+        """Add new and reused connections since the last call to the metrics"""
+        requests_count, connections, _ = pool_counters(self.session)
+        with self._counted_lock:
+            counted_requests, counted_connections = self._counted
+            self._counted = (max(requests_count, counted_requests), max(connections, counted_connections))
+        new = connections - counted_connections
+        reused = (requests_count - counted_requests) - new
+        if new > 0:
+            CONNECTIONS.labels(self.service_name, 'new').inc(new)
+        if reused > 0:
+            CONNECTIONS.labels(self.service_name, 'reused').inc(reused)
+    
+    def _request(self, method: str, path: str, timeout: float = 5, **kwargs) -> requests.Response:
+        """Send a request to one instance - 5xx and connection errors count against it
+        
+        Refused connections are retried, and so are resets of idempotent calls.
+        
+        The timeout is capped at the request's remaining deadline, which is
+        passed on in X-Deadline-Ms; DeadlineExceeded is raised once it is spent.
+        """
+        try:
+            timeout = clamp_timeout(timeout)
+        except DeadlineExceeded:
+            upstream.rejected(self.service_name, 'deadline')
+            raise
+        kwargs['headers'] = {**kwargs.get('headers', {}), **outgoing_headers()}
+        instance = self.balancer.acquire()
+        healthy = False
+        error = 'unavailable'
+        timer = upstream.started(self.service_name)
+        try:
+            response = self.session.request(method, f"{instance.url}/api/{path}", timeout=timeout, **kwargs)
+            retried = retry_count(response)
+            if retried:
+                RETRIES.labels(self.service_name).inc(retried)
+            healthy = response.status_code < 500
+            error = None if healthy else 'server_error'
+            return response
+        except requests.Timeout:
+            error = 'timeout'
+            if expired():
+                raise DeadlineExceeded('Request deadline exceeded') from None
+            raise
+        finally:
+            self.balancer.release(instance, healthy)
+            upstream.finished(self.service_name, method, timer, error)
+            self._count_connections()
+
+
+class CustomerServiceClient(ServiceClient):
     """Client for Customer Service"""
     
     def __init__(self):
-        self.base_url = getattr(settings, 'CUSTOMER_SERVICE_URL', 'http://localhost:8001')
+        super().__init__('customer', 'CUSTOMER_SERVICE_URL', 'http://localhost:8001')
     
     def verify_customer(self, customer_id: str) -> dict:
         """Verify customer exists"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/customers/{customer_id}/verify/",
+            response = self._request(
+                'POST',
+                f"customers/{customer_id}/verify/",
                 timeout=5
             )
             if response.status_code == 200:
@@ -27,8 +115,9 @@ class CustomerServiceClient:
     def get_customer(self, customer_id: str) -> dict:
         """Get customer details"""
         try:
-            response = requests.get(
-                f"{self.base_url}/api/customers/{customer_id}/",
+            response = self._request(
+                'GET',
+                f"customers/{customer_id}/",
                 timeout=5
             )
             if response.status_code == 200:
@@ -38,17 +127,18 @@ class CustomerServiceClient:
             return None
 
 
-class BookServiceClient:
+class BookServiceClient(ServiceClient):
     """Client for Book Service"""
     
     def __init__(self):
-        self.base_url = getattr(settings, 'BOOK_SERVICE_URL', 'http://localhost:8002')
+        super().__init__('book', 'BOOK_SERVICE_URL', 'http://localhost:8002')
     
     def get_book(self, book_id: str) -> dict:
         """Get book details"""
         try:
-            response = requests.get(
-                f"{self.base_url}/api/books/{book_id}/",
+            response = self._request(
+                'GET',
+                f"books/{book_id}/",
                 timeout=5
             )
             if response.status_code == 200:
@@ -58,10 +148,11 @@ class BookServiceClient:
             return None
     
     def check_stock(self, book_id: str, quantity: int) -> dict:
-        """Check if book has sufficient stock"""
+        """Check if book has sufficient stock - the result also has its title and price"""
         try:
-            response = requests.get(
-                f"{self.base_url}/api/books/{book_id}/check_stock/",
+            response = self._request(
+                'GET',
+                f"books/{book_id}/check_stock/",
                 params={'quantity': quantity},
                 timeout=5
             )
@@ -74,8 +165,9 @@ class BookServiceClient:
     def bulk_check_stock(self, items: list) -> dict:
         """Bulk check stock for multiple books"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/books/bulk_check/",
+            response = self._request(
+                'POST',
+                'books/bulk_check/',
                 json={'items': items},
                 timeout=10
             )
@@ -88,8 +180,9 @@ class BookServiceClient:
     def bulk_reduce_stock(self, items: list) -> dict:
         """Bulk reduce stock for multiple books"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/books/bulk_reduce/",
+            response = self._request(
+                'POST',
+                'books/bulk_reduce/',
                 json={'items': items},
                 timeout=10
             )
@@ -98,6 +191,52 @@ class BookServiceClient:
             return {'results': [], 'error': 'Failed to reduce stock'}
         except requests.RequestException:
             return {'results': [], 'error': 'Book service unavailable'}
+    
+    def reserve_stock(self, items: list, ttl_seconds: int = None) -> dict:
+        """Hold stock for all items at once - the result has a reservation_id on success"""
+        payload = {'items': items}
+        if ttl_seconds:
+            payload['ttl_seconds'] = ttl_seconds
+        try:
+            response = self._request(
+                'POST',
+                'reservations/',
+                json=payload,
+                timeout=10
+            )
+            if response.status_code == 201:
+                return response.json()
+            if response.status_code == 409:
+                return {**response.json(), 'out_of_stock': True}
+            return {'error': 'Failed to reserve stock'}
+        except requests.RequestException:
+            return {'error': 'Book service unavailable'}
+    
+    def commit_reservation(self, reservation_id: str) -> dict:
+        """Make a reservation final"""
+        return self._finish_reservation(reservation_id, 'commit')
+    
+    def release_reservation(self, reservation_id: str) -> dict:
+        """Give a reservation's stock back"""
+        return self._finish_reservation(reservation_id, 'release')
+    
+    def _finish_reservation(self, reservation_id: str, operation: str) -> dict:
+        try:
+            response = self._request(
+                'POST',
+                f"reservations/{reservation_id}/{operation}/",
+                timeout=10
+            )
+            if response.status_code == 200:
+                return {**response.json(), 'success': True}
+            body = response.json()
+            return {
+                'success': False,
+                'status': body.get('status'),
+                'error': body.get('error', f'Failed to {operation} reservation')
+            }
+        except (requests.RequestException, ValueError):
+            return {'success': False, 'error': 'Book service unavailable'}
 
 
 # Singleton instances
@@ -0,0 +1,334 @@
+"""Tests for Cart Service (Microservices)"""
+import json
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from common.idempotency import REPLAYED_HEADER, idempotency_store
+from common.pooling import pool_counters
+from .cache import CartCache, LocalCartCache, cart_cache
+from .models import Cart, CartItem
+from .service_clients import CONNECTIONS, RETRIES, BookServiceClient
+
+CUSTOMER_ID = 'customer-1'
+
+
+def stock_check(title='Dune', price='9.99', has_sufficient_stock=True):
+    return {'title': title, 'price': price, 'has_sufficient_stock': has_sufficient_stock}
+
+
+class CartTestCase(TestCase):
+    """Book Service calls are mocked; caches shared by the process start empty"""
+
+    def setUp(self):
+        patcher = mock.patch('carts.views.book_client')
+        self.book_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.book_client.check_stock.return_value = stock_check()
+        self.book_client.reserve_stock.return_value = {'reservation_id': 'reservation-1'}
+        self.book_client.commit_reservation.return_value = {'success': True}
+        idempotency_store._entries.clear()
+        cart_cache.invalidate(CUSTOMER_ID)
+        self.client = APIClient()
+
+    def add_item(self, book_id='book-1', quantity=1, **headers):
+        return self.client.post(
+            f'/api/carts/{CUSTOMER_ID}/add-item/',
+            {'book_id': book_id, 'quantity': quantity},
+            format='json',
+            headers=headers
+        )
+
+    def checkout(self, **headers):
+        return self.client.post(f'/api/carts/{CUSTOMER_ID}/checkout/', headers=headers)
+
+
+class IdempotencyTests(CartTestCase):
+    """Idempotency-Key on add-item and checkout"""
+
+    def test_add_item_retry_is_replayed(self):
+        first = self.add_item(quantity=2, **{'Idempotency-Key': 'add-1'})
+        retry = self.add_item(quantity=2, **{'Idempotency-Key': 'add-1'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry[REPLAYED_HEADER], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+        self.book_client.check_stock.assert_called_once()
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.add_item(quantity=2, **{'Idempotency-Key': 'add-1'})
+        response = self.add_item(quantity=3, **{'Idempotency-Key': 'add-1'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+    def test_requests_without_a_key_run_each_time(self):
+        self.add_item()
+        self.add_item()
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+    def test_checkout_retry_is_replayed(self):
+        self.add_item(quantity=2)
+        first = self.checkout(**{'Idempotency-Key': 'checkout-1'})
+        retry = self.checkout(**{'Idempotency-Key': 'checkout-1'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['total'], 19.98)
+        self.assertEqual(retry[REPLAYED_HEADER], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.book_client.reserve_stock.assert_called_once()
+        self.book_client.commit_reservation.assert_called_once()
+
+    def test_server_errors_are_not_stored(self):
+        self.add_item()
+        self.book_client.reserve_stock.return_value = {'error': 'Book service unavailable'}
+        self.assertEqual(self.checkout(**{'Idempotency-Key': 'checkout-1'}).status_code, 500)
+        self.book_client.reserve_stock.return_value = {'reservation_id': 'reservation-1'}
+        retry = self.checkout(**{'Idempotency-Key': 'checkout-1'})
+        self.assertEqual(retry.status_code, 200)
+        self.assertFalse(retry.has_header(REPLAYED_HEADER))
+
+
+class CartTotalsTests(CartTestCase):
+    """Stored Cart.total_items and Cart.total_price after every item change"""
+
+    def totals(self):
+        cart = Cart.objects.get(customer_id=CUSTOMER_ID)
+        return cart.total_items, cart.total_price
+
+    def test_add_item(self):
+        self.add_item('book-1', 2)
+        self.book_client.check_stock.return_value = stock_check('Emma', '5.50')
+        response = self.add_item('book-2', 1)
+        self.add_item('book-2', 3)
+        self.assertEqual(self.totals(), (6, Decimal('41.98')))
+        self.assertEqual(response.data['total_items'], 3)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('25.48'))
+
+    def test_add_item_out_of_stock_leaves_totals(self):
+        self.add_item('book-1', 2)
+        self.book_client.check_stock.return_value = stock_check(has_sufficient_stock=False)
+        self.assertEqual(self.add_item('book-2', 1).status_code, 400)
+        self.assertEqual(self.totals(), (2, Decimal('19.98')))
+
+    def test_update_quantity(self):
+        self.add_item('book-1', 2)
+        response = self.client.put(
+            f'/api/carts/{CUSTOMER_ID}/update-quantity/book-1/', {'quantity': 5}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.totals(), (5, Decimal('49.95')))
+        self.client.put(f'/api/carts/{CUSTOMER_ID}/update-quantity/book-1/', {'quantity': 1}, format='json')
+        self.assertEqual(self.totals(), (1, Decimal('9.99')))
+
+    def test_remove_item(self):
+        self.add_item('book-1', 2)
+        self.book_client.check_stock.return_value = stock_check('Emma', '5.50')
+        self.add_item('book-2', 1)
+        response = self.client.delete(f'/api/carts/{CUSTOMER_ID}/remove-item/book-1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.totals(), (1, Decimal('5.50')))
+        self.client.delete(f'/api/carts/{CUSTOMER_ID}/remove-item/book-1/')
+        self.assertEqual(self.totals(), (1, Decimal('5.50')))
+
+    def test_cart_item_endpoints(self):
+        self.add_item('book-1', 2)
+        item = CartItem.objects.get()
+        self.client.patch(f'/api/cart-items/{item.pk}/', {'quantity': 4}, format='json')
+        self.assertEqual(self.totals(), (4, Decimal('39.96')))
+        self.client.delete(f'/api/cart-items/{item.pk}/')
+        self.assertEqual(self.totals(), (0, Decimal('0')))
+
+    def test_clear_and_checkout_reset_totals(self):
+        self.add_item('book-1', 2)
+        self.client.delete(f'/api/carts/{CUSTOMER_ID}/clear/')
+        self.assertEqual(self.totals(), (0, Decimal('0')))
+        self.add_item('book-1', 1)
+        self.assertEqual(self.checkout().status_code, 200)
+        self.assertEqual(self.totals(), (0, Decimal('0')))
+
+    def test_cached_cart_follows_changes(self):
+        self.add_item('book-1', 2)
+        self.client.delete(f'/api/carts/{CUSTOMER_ID}/remove-item/book-1/')
+        response = self.client.get(f'/api/carts/by-customer/{CUSTOMER_ID}/')
+        self.assertEqual(response.data['total_items'], 0)
+        self.assertEqual(response.data['items'], [])
+
+    def test_reconcile_fixes_drifted_totals(self):
+        self.add_item('book-1', 2)
+        Cart.objects.filter(customer_id=CUSTOMER_ID).update(total_items=7, total_price=Decimal('1.00'))
+        call_command('reconcile_cart_totals', '--dry-run', stdout=StringIO())
+        self.assertEqual(self.totals(), (7, Decimal('1.00')))
+        out = StringIO()
+        call_command('reconcile_cart_totals', stdout=out)
+        self.assertIn('Fixed 1 cart(s)', out.getvalue())
+        self.assertEqual(self.totals(), (2, Decimal('19.98')))
+
+
+class BookServiceStub(BaseHTTPRequestHandler):
+    """Book Service stand-in answering every call with a keep-alive 200"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.answer()
+
+    def answer(self):
+        self.server.calls.append((self.command, self.path))
+        if self.server.resets:
+            # Close without answering, as a restarting instance would
+            self.server.resets -= 1
+            self.close_connection = True
+            return
+        body = json.dumps({**stock_check(), 'reservation_id': 'reservation-1'}).encode()
+        self.send_response(201 if self.command == 'POST' else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledClientTests(SimpleTestCase):
+    """Service clients keep connections alive and resend idempotent calls after a reset"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BookServiceStub)
+        self.server.calls = []
+        self.server.resets = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        with override_settings(BOOK_SERVICE_URL=f'http://127.0.0.1:{self.server.server_port}'):
+            self.client = BookServiceClient()
+        self.addCleanup(self.client.session.close)
+
+    def test_calls_reuse_one_connection(self):
+        reused = CONNECTIONS.labels('book', 'reused').value
+        for _ in range(3):
+            self.assertTrue(self.client.check_stock('book-1', 1)['has_sufficient_stock'])
+        self.assertEqual(pool_counters(self.client.session), (3, 1, 1))
+        self.assertEqual(CONNECTIONS.labels('book', 'reused').value - reused, 2)
+
+    def test_reset_get_is_resent(self):
+        retries = RETRIES.labels('book').value
+        self.server.resets = 1
+        self.assertTrue(self.client.check_stock('book-1', 1)['has_sufficient_stock'])
+        self.assertEqual(len(self.server.calls), 2)
+        self.assertEqual(RETRIES.labels('book').value - retries, 1)
+
+    def test_reset_post_is_not_resent(self):
+        self.server.resets = 1
+        self.assertEqual(self.client.reserve_stock([{'book_id': 'book-1', 'quantity': 1}]), {'error': 'Book service unavailable'})
+        self.assertEqual(self.server.calls, [('POST', '/api/reservations/')])
+
+    def test_check_stock_is_one_call(self):
+        result = self.client.check_stock('book-1', 2)
+        self.assertEqual((result['title'], result['price']), ('Dune', '9.99'))
+        self.assertEqual(self.server.calls, [('GET', '/api/books/book-1/check_stock/?quantity=2')])
+
+
+class BookValidationTests(CartTestCase):
+    """add_item and update_quantity validate with one check_stock call, which also prices the item"""
+
+    def test_add_item_makes_one_call(self):
+        self.book_client.check_stock.return_value = stock_check('Emma', '5.50')
+        response = self.add_item('book-2', 3)
+        self.assertEqual(response.status_code, 200)
+        self.book_client.check_stock.assert_called_once_with('book-2', 3)
+        self.book_client.get_book.assert_not_called()
+        item = CartItem.objects.get()
+        self.assertEqual((item.book_title, item.book_price), ('Emma', Decimal('5.50')))
+        self.assertEqual(Cart.objects.get().total_price, Decimal('16.50'))
+
+    def test_unknown_book_is_not_added(self):
+        self.book_client.check_stock.return_value = {'has_sufficient_stock': False, 'error': 'Book not found'}
+        self.assertEqual(self.add_item().status_code, 404)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_update_quantity_makes_one_call(self):
+        self.add_item('book-1', 2)
+        self.book_client.reset_mock()
+        self.client.put(f'/api/carts/{CUSTOMER_ID}/update-quantity/book-1/', {'quantity': 4}, format='json')
+        self.book_client.check_stock.assert_called_once_with('book-1', 4)
+        self.book_client.get_book.assert_not_called()
+        self.assertEqual(Cart.objects.get().total_items, 4)
+
+    def test_adjust_and_reset_totals(self):
+        cart = Cart.objects.create(customer_id=CUSTOMER_ID)
+        cart.adjust_totals(3, Decimal('29.97'))
+        cart.adjust_totals(-1, Decimal('-9.99'))
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_items, cart.total_price), (2, Decimal('19.98')))
+        cart.reset_totals()
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_items, cart.total_price), (0, Decimal('0')))
+
+
+class CartCacheTests(CartTestCase):
+    """Serialized carts by customer id, written through on every change"""
+
+    def get_cart(self):
+        return self.client.get(f'/api/carts/by-customer/{CUSTOMER_ID}/')
+
+    def test_local_backend_expires_and_evicts(self):
+        patcher = mock.patch('carts.cache.time')
+        clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        clock.monotonic.return_value = 100.0
+        backend = LocalCartCache(ttl=30, max_entries=2)
+        backend.set('a', {'id': 'a'})
+        backend.set('b', {'id': 'b'})
+        backend.get('a')
+        backend.set('c', {'id': 'c'})
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), {'id': 'a'})
+        clock.monotonic.return_value = 130.0
+        self.assertIsNone(backend.get('a'))
+
+    def test_older_cart_never_replaces_newer(self):
+        cache = CartCache(LocalCartCache())
+        cache.put(CUSTOMER_ID, {'total_items': 2, 'updated_at': '2024-01-01T10:00:00.000002Z'})
+        cache.put(CUSTOMER_ID, {'total_items': 1, 'updated_at': '2024-01-01T10:00:00.000001Z'})
+        self.assertEqual(cache.get(CUSTOMER_ID)['total_items'], 2)
+        cache.put(CUSTOMER_ID, {'total_items': 3, 'updated_at': '2024-01-01T10:00:01Z'})
+        self.assertEqual(cache.get(CUSTOMER_ID)['total_items'], 3)
+
+    def test_writes_refresh_the_cached_cart(self):
+        self.add_item('book-1', 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_cart().data['total_items'], 2)
+        self.client.put(f'/api/carts/{CUSTOMER_ID}/update-quantity/book-1/', {'quantity': 5}, format='json')
+        with self.assertNumQueries(0):
+            response = self.get_cart()
+        self.assertEqual(response.data['total_items'], 5)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('49.95'))
+        self.client.delete(f'/api/carts/{CUSTOMER_ID}/remove-item/book-1/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_cart().data['items'], [])
+
+    def test_cart_item_writes_invalidate_the_cached_cart(self):
+        self.add_item('book-1', 2)
+        item = CartItem.objects.get()
+        self.client.patch(f'/api/cart-items/{item.pk}/', {'quantity': 4}, format='json')
+        self.assertIsNone(cart_cache.get(CUSTOMER_ID))
+        self.assertEqual(self.get_cart().data['total_items'], 4)
+        self.client.delete(f'/api/cart-items/{item.pk}/')
+        self.assertIsNone(cart_cache.get(CUSTOMER_ID))
+        self.assertEqual(self.get_cart().data['total_items'], 0)
+
+    def test_reconcile_drops_the_drifted_cached_cart(self):
+        self.add_item('book-1', 2)
+        Cart.objects.filter(customer_id=CUSTOMER_ID).update(total_items=7)
+        cart_cache.invalidate(CUSTOMER_ID)
+        self.assertEqual(self.get_cart().data['total_items'], 7)
+        call_command('reconcile_cart_totals', stdout=StringIO())
+        self.assertEqual(self.get_cart().data['total_items'], 2)
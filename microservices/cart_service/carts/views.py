@@ -3,6 +3,10 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .cache import cart_cache
 from .models import Cart, CartItem
 from .serializers import (
     CartSerializer, CartItemSerializer, AddToCartSerializer,
@@ -21,6 +25,20 @@ class CartViewSet(viewsets.ModelViewSet):
         cart, created = Cart.objects.get_or_create(customer_id=customer_id)
         return cart
 
+    def _cart_response(self, cart: Cart) -> Response:
+        """Serialize the cart and write it through to the cart cache"""
+        data = CartSerializer(cart).data
+        cart_cache.put(cart.customer_id, data)
+        return Response(data)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        cart_cache.invalidate(serializer.instance.customer_id)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        cart_cache.invalidate(instance.customer_id)
+
     @action(detail=False, methods=['get'], url_path='by-customer/(?P<customer_id>[^/.]+)')
     def by_customer(self, request, customer_id=None):
         """Get cart by customer ID"""
@@ -29,8 +47,12 @@ class CartViewSet(viewsets.ModelViewSet):
         # if not verification.get('exists'):
         #     return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
         
+        cached = cart_cache.get(customer_id)
+        if cached is not None:
+            return Response(cached)
+        
         cart = self._get_or_create_cart(customer_id)
-        return Response(CartSerializer(cart).data)
+        return self._cart_response(cart)
 
     @action(detail=False, methods=['post'], url_path='(?P<customer_id>[^/.]+)/add-item')
     def add_item(self, request, customer_id=None):
@@ -42,44 +64,53 @@ class CartViewSet(viewsets.ModelViewSet):
         book_id = serializer.validated_data['book_id']
         quantity = serializer.validated_data['quantity']
         
-        # Check book exists and has stock via Book Service
-        book_data = book_client.get_book(book_id)
-        if not book_data:
+        # Check book exists and has stock via Book Service - one call, which also returns title and price
+        stock_check = book_client.check_stock(book_id, quantity)
+        if stock_check.get('error'):
             return Response({'error': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        stock_check = book_client.check_stock(book_id, quantity)
         if not stock_check.get('has_sufficient_stock'):
             return Response(
                 {'error': 'Insufficient stock'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Add to cart
+        # Add to cart - the item and the cart totals change together
         cart = self._get_or_create_cart(customer_id)
         
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            book_id=book_id,
-            defaults={
-                'book_title': book_data.get('title', ''),
-                'book_price': Decimal(str(book_data.get('price', 0))),
-                'quantity': quantity
-            }
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
-        
-        return Response(CartSerializer(cart).data)
+        with transaction.atomic():
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=cart,
+                book_id=book_id,
+                defaults={
+                    'book_title': stock_check.get('title', ''),
+                    'book_price': Decimal(str(stock_check.get('price', 0))),
+                    'quantity': quantity
+                }
+            )
+            
+            if not created:
+                CartItem.objects.filter(pk=cart_item.pk).update(
+                    quantity=F('quantity') + quantity,
+                    updated_at=timezone.now()
+                )
+            cart.adjust_totals(quantity, cart_item.book_price * quantity)
+        
+        cart.refresh_from_db()
+        return self._cart_response(cart)
 
     @action(detail=False, methods=['delete'], url_path='(?P<customer_id>[^/.]+)/remove-item/(?P<book_id>[^/.]+)')
     def remove_item(self, request, customer_id=None, book_id=None):
         """Remove item from cart"""
         try:
             cart = Cart.objects.get(customer_id=customer_id)
-            CartItem.objects.filter(cart=cart, book_id=book_id).delete()
-            return Response(CartSerializer(cart).data)
+            with transaction.atomic():
+                cart_item = CartItem.objects.select_for_update().filter(cart=cart, book_id=book_id).first()
+                if cart_item is not None:
+                    cart_item.delete()
+                    cart.adjust_totals(-cart_item.quantity, -cart_item.subtotal)
+            cart.refresh_from_db()
+            return self._cart_response(cart)
         except Cart.DoesNotExist:
             return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -102,10 +133,14 @@ class CartViewSet(viewsets.ModelViewSet):
         
         try:
             cart = Cart.objects.get(customer_id=customer_id)
-            cart_item = CartItem.objects.get(cart=cart, book_id=book_id)
-            cart_item.quantity = quantity
-            cart_item.save()
-            return Response(CartSerializer(cart).data)
+            with transaction.atomic():
+                cart_item = CartItem.objects.select_for_update().get(cart=cart, book_id=book_id)
+                delta = quantity - cart_item.quantity
+                cart_item.quantity = quantity
+                cart_item.save(update_fields=['quantity', 'updated_at'])
+                cart.adjust_totals(delta, cart_item.book_price * delta)
+            cart.refresh_from_db()
+            return self._cart_response(cart)
         except (Cart.DoesNotExist, CartItem.DoesNotExist):
             return Response({'error': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -114,8 +149,11 @@ class CartViewSet(viewsets.ModelViewSet):
         """Clear all items from cart"""
         try:
             cart = Cart.objects.get(customer_id=customer_id)
-            cart.items.all().delete()
-            return Response(CartSerializer(cart).data)
+            with transaction.atomic():
+                cart.items.all().delete()
+                cart.reset_totals()
+            cart.refresh_from_db()
+            return self._cart_response(cart)
         except Cart.DoesNotExist:
             return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -142,30 +180,43 @@ class CartViewSet(viewsets.ModelViewSet):
             for item in cart.items.all()
         ]
         
-        # Check stock for all items
-        stock_check = book_client.bulk_check_stock(items)
-        if not stock_check.get('all_available'):
+        # Hold stock for all items in one call - stock cannot change between check and reduce
+        reservation = book_client.reserve_stock(items)
+        if reservation.get('out_of_stock'):
             return Response(
                 {'success': False, 'message': 'Some items are out of stock', 'total': 0},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if not reservation.get('reservation_id'):
+            return Response(
+                {'success': False, 'message': 'Failed to process checkout', 'total': 0},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
         
         # Calculate total
         total = cart.total_price
         
-        # Reduce stock in Book Service
-        reduce_result = book_client.bulk_reduce_stock(items)
-        
-        # Check if all reductions were successful
-        all_success = all(r.get('success', False) for r in reduce_result.get('results', []))
-        if not all_success:
+        # Make the reservation final - on failure give the stock back (expiry does it otherwise)
+        commit_result = book_client.commit_reservation(reservation['reservation_id'])
+        if not commit_result.get('success'):
+            if commit_result.get('status') == 'expired':
+                # Book Service already gave the stock back - the whole checkout can be retried
+                return Response(
+                    {'success': False, 'message': 'Stock hold expired before checkout finished, retry', 'total': 0},
+                    status=status.HTTP_409_CONFLICT
+                )
+            book_client.release_reservation(reservation['reservation_id'])
             return Response(
                 {'success': False, 'message': 'Failed to process checkout', 'total': 0},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
         # Clear cart
-        cart.items.all().delete()
+        with transaction.atomic():
+            cart.items.all().delete()
+            cart.reset_totals()
+        cart.refresh_from_db()
+        cart_cache.put(customer_id, CartSerializer(cart).data)
         
         return Response({
             'success': True,
@@ -178,3 +229,17 @@ class CartItemViewSet(viewsets.ModelViewSet):
     """ViewSet for CartItem"""
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous_quantity = CartItem.objects.select_for_update().get(pk=serializer.instance.pk).quantity
+            cart_item = serializer.save()
+            delta = cart_item.quantity - previous_quantity
+            cart_item.cart.adjust_totals(delta, cart_item.book_price * delta)
+        cart_cache.invalidate(cart_item.cart.customer_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            instance.cart.adjust_totals(-instance.quantity, -instance.subtotal)
+        cart_cache.invalidate(instance.cart.customer_id)
@@ -1,8 +1,12 @@
 """Settings for Cart Service (Microservices)"""
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Shared helpers in microservices/common
+sys.path.append(str(BASE_DIR.parent))
+
 SECRET_KEY = 'django-insecure-cart-service-secret-key'
 DEBUG = True
 ALLOWED_HOSTS = ['*']
@@ -19,6 +23,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.metrics.MetricsMiddleware',
+    'common.deadline.DeadlineMiddleware',
+    'common.idempotency.IdempotencyMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,10 +74,42 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
-# Service Discovery - Other Services
+# Service Discovery - Other Services (a base URL or a list of instance URLs)
 CUSTOMER_SERVICE_URL = 'http://localhost:8001'
 BOOK_SERVICE_URL = 'http://localhost:8002'
 
+# Client-side load balancing across the instances above
+LOAD_BALANCER = {
+    'STRATEGY': 'least_outstanding',  # or 'round_robin'
+    'FAILURE_THRESHOLD': 3,
+    'EJECTION_SECONDS': 10,
+    'MAX_EJECTION_SECONDS': 120,
+}
+
+# Keep-alive connection pools for the customer- and book-service clients
+SERVICE_CLIENT_POOL = {
+    'POOL_CONNECTIONS': 10,     # Host pools kept per client (one per instance)
+    'POOL_MAXSIZE': 20,         # Keep-alive connections per instance
+    'RETRIES': 2,               # Resends after a refused connection, or a reset on an idempotent call
+    'RETRY_BACKOFF': 0,         # urllib3 backoff factor between resends
+}
+
+# Idempotency-Key support - the first response to a keyed write is replayed to retries
+IDEMPOTENCY = {
+    'ROUTES': ['cart-add-item', 'cart-checkout'],   # URL names
+    'TTL_SECONDS': 3600,
+    'MAX_ENTRIES': 10000,
+    'MAX_RESPONSE_BYTES': 1024 * 1024,
+}
+
+# Serialized carts by customer id, written through on every change
+CART_CACHE = {
+    'BACKEND': 'carts.cache.LocalCartCache',  # or 'carts.cache.DjangoCartCache' to use CACHES[CACHE_ALIAS]
+    'TTL_SECONDS': 30,
+    'MAX_ENTRIES': 10000,       # LocalCartCache only
+    'CACHE_ALIAS': 'default',   # DjangoCartCache only
+}
+
 # Service Discovery
 SERVICE_NAME = 'cart-service'
 SERVICE_PORT = 8003
@@ -0,0 +1 @@
+"""Helpers shared by the microservices (added to sys.path from each service's settings)"""
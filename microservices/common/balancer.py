@@ -0,0 +1,174 @@
+"""
+Client-side Load Balancing
+Spreads calls to a service across its instances and ejects failing ones
+"""
+import threading
+import time
+from typing import Dict, Any, Iterable, List, Optional, Union
+
+
+def instance_urls(value: Union[str, Iterable[str]]) -> List[str]:
+    """Normalise a setting holding one base URL, a comma-separated string or a list"""
+    if isinstance(value, str):
+        value = value.split(',')
+    return [url.strip().rstrip('/') for url in value if url and url.strip()]
+
+
+class Instance:
+    """One base URL of a service plus its load and ejection state"""
+    
+    __slots__ = ('url', 'outstanding', 'requests', 'failures', 'consecutive_failures', 'ejected_until', 'ejections')
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        # Ejections since the last success - drives the ejection backoff
+        self.ejections = 0
+    
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+class LoadBalancer:
+    """Picks an instance per call by round robin or least outstanding requests
+    
+    An instance failing failure_threshold calls in a row is ejected for
+    ejection_seconds, doubling on each repeat up to max_ejection_seconds.
+    Once the ejection lapses it takes traffic again; a single failure
+    re-ejects it and a success (call or health probe) re-adds it for good.
+    """
+    
+    ROUND_ROBIN = 'round_robin'
+    LEAST_OUTSTANDING = 'least_outstanding'
+    
+    def __init__(
+        self,
+        urls: Iterable[str],
+        strategy: str = ROUND_ROBIN,
+        failure_threshold: int = 3,
+        ejection_seconds: float = 10.0,
+        max_ejection_seconds: float = 120.0
+    ):
+        self.instances = [Instance(url) for url in urls]
+        if strategy not in (self.ROUND_ROBIN, self.LEAST_OUTSTANDING):
+            raise ValueError(f'Unknown load balancing strategy: {strategy}')
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, urls: Union[str, Iterable[str]], config: Dict[str, Any] = None) -> 'LoadBalancer':
+        """Build a balancer from a URL setting and a LOAD_BALANCER settings dict"""
+        config = config or {}
+        return cls(
+            instance_urls(urls),
+            strategy=config.get('STRATEGY', cls.ROUND_ROBIN),
+            failure_threshold=config.get('FAILURE_THRESHOLD', 3),
+            ejection_seconds=config.get('EJECTION_SECONDS', 10.0),
+            max_ejection_seconds=config.get('MAX_EJECTION_SECONDS', 120.0),
+        )
+    
+    def acquire(self, exclude: Iterable[Instance] = ()) -> Instance:
+        """Pick an instance for a call - release() it when the call is done
+        
+        Ejected instances are skipped; when every candidate is ejected the
+        one due back first is used rather than failing the call outright.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [instance for instance in self.instances if instance not in exclude] or self.instances
+            available = [instance for instance in candidates if not instance.is_ejected(now)]
+            if not available:
+                available = [min(candidates, key=lambda instance: instance.ejected_until)]
+            
+            # Rotating the start point spreads ties between equally loaded instances
+            offset = self._next % len(available)
+            self._next += 1
+            if self.strategy == self.LEAST_OUTSTANDING:
+                ordered = available[offset:] + available[:offset]
+                instance = min(ordered, key=lambda candidate: candidate.outstanding)
+            else:
+                instance = available[offset]
+            instance.outstanding += 1
+            instance.requests += 1
+            return instance
+    
+    def release(self, instance: Instance, success: Optional[bool]) -> None:
+        """Finish a call started with acquire() and record its outcome
+        
+        None means the call was abandoned (e.g. cancelled) without an outcome.
+        """
+        with self._lock:
+            instance.outstanding -= 1
+            if success is not None:
+                self._record(instance, success)
+    
+    def record(self, instance: Instance, success: bool) -> None:
+        """Record an out-of-band outcome such as a health probe"""
+        with self._lock:
+            self._record(instance, success)
+    
+    def _record(self, instance: Instance, success: bool) -> None:
+        if success:
+            instance.consecutive_failures = 0
+            instance.ejections = 0
+            instance.ejected_until = 0.0
+            return
+        
+        instance.failures += 1
+        instance.consecutive_failures += 1
+        now = time.monotonic()
+        if instance.is_ejected(now):
+            return
+        # Instances back from an ejection are on probation until a success
+        if instance.ejections or instance.consecutive_failures >= self.failure_threshold:
+            instance.ejections += 1
+            instance.ejected_until = now + min(
+                self.ejection_seconds * 2 ** (instance.ejections - 1),
+                self.max_ejection_seconds
+            )
+            instance.consecutive_failures = 0
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """Load and ejection state per instance"""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    'url': instance.url,
+                    'outstanding': instance.outstanding,
+                    'requests': instance.requests,
+                    'failures': instance.failures,
+                    'ejected': instance.is_ejected(now),
+                    'ejected_for_seconds': round(max(instance.ejected_until - now, 0), 3),
+                    'ejections': instance.ejections,
+                }
+                for instance in self.instances
+            ]
+
+
+class LoadBalancerRegistry:
+    """One balancer per service from a {service: url or [urls]} mapping"""
+    
+    def __init__(self, services: Dict[str, Union[str, List[str]]], config: Dict[str, Any] = None):
+        self._balancers = {
+            service_name: LoadBalancer.from_config(urls, config)
+            for service_name, urls in services.items()
+        }
+    
+    def get(self, service_name: str) -> Optional[LoadBalancer]:
+        """Balancer for a service, None if it has no instances configured"""
+        balancer = self._balancers.get(service_name)
+        if balancer is None or not balancer.instances:
+            return None
+        return balancer
+    
+    def stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {service_name: balancer.stats() for service_name, balancer in self._balancers.items()}
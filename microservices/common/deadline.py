@@ -0,0 +1,140 @@
+"""
+Request Deadlines
+Carries the time left for a request across service hops and clamps downstream timeouts
+"""
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple, Union
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from .metrics import route_label
+
+
+# Remaining budget in whole milliseconds at the time the request was sent
+DEADLINE_HEADER = 'X-Deadline-Ms'
+_DEADLINE_META = 'HTTP_' + DEADLINE_HEADER.upper().replace('-', '_')
+
+# Absolute time.monotonic() deadline of the request being served, None if unbounded
+_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before the work could be done"""
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, None when it has no deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def shorten(seconds: float) -> None:
+    """Tighten the current deadline to at most seconds from now"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is None or deadline < current:
+        _deadline.set(deadline)
+
+
+def clamp_timeout(timeout: Union[float, Tuple[float, float]]) -> Union[float, Tuple[float, float]]:
+    """Cap a (connect, read) or single timeout at the remaining budget
+    
+    Raises DeadlineExceeded when nothing is left, so no call is started.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+    if isinstance(timeout, tuple):
+        return tuple(min(part, left) for part in timeout)
+    return min(timeout, left)
+
+
+def outgoing_headers() -> Dict[str, str]:
+    """Header passing the remaining budget to the next hop"""
+    left = remaining()
+    if left is None:
+        return {}
+    return {DEADLINE_HEADER: str(max(int(left * 1000), 0))}
+
+
+def _parse_header(value: Optional[str]) -> Optional[float]:
+    try:
+        return int(value) / 1000 if value is not None else None
+    except ValueError:
+        return None
+
+
+def deadline_exceeded_response() -> JsonResponse:
+    return JsonResponse({'error': 'Request deadline exceeded'}, status=504)
+
+
+class DeadlineMiddleware:
+    """Sets the request deadline and rejects work that is already out of time
+    
+    The deadline comes from the X-Deadline-Ms header; REQUEST_DEADLINES can
+    also give routes (by URL name) a budget, tightening any client header.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'REQUEST_DEADLINES', {})
+        self.default_budget = config.get('DEFAULT_MS')
+        self.route_budgets = config.get('ROUTES', {})
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Async handlers would run sync hooks in a worker thread
+            self.process_view = self._aprocess_view
+            self.process_exception = self._aprocess_exception
+    
+    def _start(self, request):
+        budget = _parse_header(request.META.get(_DEADLINE_META))
+        return _deadline.set(time.monotonic() + budget if budget is not None else None)
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _deadline.reset(token)
+    
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _deadline.reset(token)
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = self.route_budgets.get(route_label(request), self.default_budget)
+        if budget is not None:
+            shorten(budget / 1000)
+        if expired():
+            return deadline_exceeded_response()
+        return None
+    
+    def process_exception(self, request, exception):
+        if isinstance(exception, DeadlineExceeded):
+            return deadline_exceeded_response()
+        return None
+    
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return DeadlineMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+    
+    async def _aprocess_exception(self, request, exception):
+        return DeadlineMiddleware.process_exception(self, request, exception)
@@ -0,0 +1,191 @@
+"""
+Idempotent Requests
+Replays the stored result of a write when a client retries it with the same Idempotency-Key
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from .metrics import registry, route_label
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+_IDEMPOTENCY_META = 'HTTP_' + IDEMPOTENCY_HEADER.upper().replace('-', '_')
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENT_REQUESTS = registry.counter(
+    'idempotent_requests_total', 'Requests carrying an Idempotency-Key by outcome', ('route', 'outcome')
+)
+
+
+def idempotency_headers(request) -> Dict[str, str]:
+    """The request's Idempotency-Key header, to pass on to the service doing the work"""
+    key = request.META.get(_IDEMPOTENCY_META)
+    return {IDEMPOTENCY_HEADER: key} if key else {}
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'expires_at', 'status_code', 'content', 'content_type')
+    
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        # Unset while the first request is still being served
+        self.status_code: Optional[int] = None
+        self.content = b''
+        self.content_type = ''
+
+
+class IdempotencyStore:
+    """Bounded, expiring results of requests by idempotency key"""
+    
+    def __init__(self, ttl: float = 3600, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[str, ...], _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def begin(self, key: Tuple[str, ...], fingerprint: str) -> Tuple[str, Optional[_Entry]]:
+        """Claim a key - returns ('new' | 'replay' | 'in_progress' | 'mismatch', entry)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._entries[key] = _Entry(fingerprint, now + self.ttl)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return 'new', None
+            self._entries.move_to_end(key)
+            if entry.fingerprint != fingerprint:
+                return 'mismatch', entry
+            if entry.status_code is None:
+                return 'in_progress', entry
+            return 'replay', entry
+    
+    def complete(self, key: Tuple[str, ...], status_code: int, content: bytes, content_type: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.status_code = status_code
+                entry.content = content
+                entry.content_type = content_type
+    
+    def abandon(self, key: Tuple[str, ...]) -> None:
+        """Forget a key whose request failed, so a retry runs it again"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.status_code is None:
+                del self._entries[key]
+
+
+# Singleton instance shared by every handler of the process
+_idempotency_config = getattr(settings, 'IDEMPOTENCY', {})
+idempotency_store = IdempotencyStore(
+    _idempotency_config.get('TTL_SECONDS', 3600),
+    _idempotency_config.get('MAX_ENTRIES', 10000)
+)
+
+
+class IdempotencyMiddleware:
+    """Runs a keyed write once and replays its response to retries
+    
+    Only routes listed (by URL name) in IDEMPOTENCY['ROUTES'] are covered.
+    Final responses are stored; server errors, retryable conflicts and
+    exceptions free the key so the retry does the work. Reusing a key with
+    a different body is rejected with 422, and a retry racing the first
+    request gets 409.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    # Answers telling the client to try again later, e.g. a downstream key still in progress
+    RETRYABLE_STATUSES = (409, 429)
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.routes = set(_idempotency_config.get('ROUTES', ()))
+        self.max_body_bytes = _idempotency_config.get('MAX_RESPONSE_BYTES', 1024 * 1024)
+        self.store = idempotency_store
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Async handlers would run a sync process_view in a worker thread
+            self.process_view = self._aprocess_view
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        key = request.META.get(_IDEMPOTENCY_META)
+        if not key or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return None
+        route = route_label(request)
+        if route not in self.routes:
+            return None
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'error': f'{IDEMPOTENCY_HEADER} is too long'}, status=400)
+        
+        # Scoped to the route and its arguments, so one key cannot replay another endpoint
+        store_key = (route, request.method, request.path, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        outcome, entry = self.store.begin(store_key, fingerprint)
+        IDEMPOTENT_REQUESTS.labels(route, outcome).inc()
+        if outcome == 'new':
+            request._idempotency_key = store_key
+            return None
+        if outcome == 'replay':
+            response = HttpResponse(entry.content, status=entry.status_code, content_type=entry.content_type)
+            response[REPLAYED_HEADER] = 'true'
+            return response
+        if outcome == 'in_progress':
+            response = JsonResponse({'error': f'A request with this {IDEMPOTENCY_HEADER} is in progress'}, status=409)
+            response['Retry-After'] = '1'
+            return response
+        return JsonResponse(
+            {'error': f'{IDEMPOTENCY_HEADER} was already used with a different request body'},
+            status=422
+        )
+    
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return IdempotencyMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+    
+    def _finish(self, request, response) -> None:
+        store_key = getattr(request, '_idempotency_key', None)
+        if store_key is None:
+            return
+        if (
+            response is None
+            or response.status_code >= 500
+            or response.status_code in self.RETRYABLE_STATUSES
+            or getattr(response, 'streaming', False)
+            or len(response.content) > self.max_body_bytes
+        ):
+            self.store.abandon(store_key)
+            return
+        self.store.complete(
+            store_key, response.status_code, response.content, response.get('Content-Type', 'application/json')
+        )
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._finish(request, response)
+    
+    async def __acall__(self, request):
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._finish(request, response)
@@ -0,0 +1,310 @@
+"""
+Metrics
+In-process latency histograms, gauges and counters rendered in Prometheus text format
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
+
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow downstream calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+    
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+    
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+    
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    """A metric family - one child per combination of label values"""
+    
+    TYPE = ''
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, *values: Any):
+        """Child for the given label values, created on first use"""
+        key = tuple(map(str, values))
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        samples = self._samples()
+        if not samples:
+            return ''
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        lines.extend(samples)
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def _samples(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}'
+            for key, child in list(self._children.items())
+        ]
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+    
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                samples.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            samples.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            samples.append(f'{self.name}_count{labels} {cumulative}')
+        return samples
+
+
+class MetricsRegistry:
+    """Named metric families of one process"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+    
+    def _register(self, cls, name: str, *args, **kwargs) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} already registered as {metric.TYPE}')
+            return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+    
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(f'{text}\n' for text in map(Metric.render, metrics) if text)
+
+
+# Process-wide registry
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Time spent serving HTTP requests', ('method', 'route')
+)
+REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP responses by status code', ('method', 'route', 'status')
+)
+REQUEST_ERRORS = registry.counter(
+    'http_request_errors_total', 'HTTP requests answered with 5xx or an unhandled exception', ('method', 'route')
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served', ('route',)
+)
+
+
+class UpstreamMetrics:
+    """Hooks recording calls from this service to a downstream service"""
+    
+    def __init__(self, metrics: MetricsRegistry):
+        self.duration = metrics.histogram(
+            'upstream_request_duration_seconds', 'Latency of calls to downstream services', ('service', 'method')
+        )
+        self.in_flight = metrics.gauge(
+            'upstream_requests_in_flight', 'Calls to downstream services currently in flight', ('service',)
+        )
+        self.errors = metrics.counter(
+            'upstream_request_errors_total', 'Failed calls to downstream services by reason', ('service', 'reason')
+        )
+    
+    def started(self, service_name: str) -> float:
+        """Mark a call as in flight - returns its start time for finished()"""
+        self.in_flight.labels(service_name).inc()
+        return time.perf_counter()
+    
+    def finished(self, service_name: str, method: str, started: float, error: Optional[str] = None) -> None:
+        self.in_flight.labels(service_name).dec()
+        self.duration.labels(service_name, method).observe(time.perf_counter() - started)
+        if error:
+            self.errors.labels(service_name, error).inc()
+    
+    def rejected(self, service_name: str, reason: str) -> None:
+        """Count a call that was refused before reaching the service"""
+        self.errors.labels(service_name, reason).inc()
+
+
+upstream = UpstreamMetrics(registry)
+
+
+def route_label(request) -> str:
+    """Low-cardinality route of a request - URL name or pattern, never the raw path"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    if match.url_name:
+        return match.view_name
+    return match.route or 'unmatched'
+
+
+class MetricsMiddleware:
+    """Records latency, status and in-flight requests per route
+    
+    Put it first in MIDDLEWARE so the timings cover the whole stack.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Async handlers would run a sync process_view in a worker thread
+            self.process_view = self._aprocess_view
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The route is only known once the URL has been resolved
+        request._metrics_route = route_label(request)
+        REQUESTS_IN_FLIGHT.labels(request._metrics_route).inc()
+    
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        MetricsMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._record(request, response, started)
+    
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._record(request, response, started)
+    
+    @staticmethod
+    def _record(request, response, started: float) -> None:
+        route = getattr(request, '_metrics_route', None)
+        if route is not None:
+            REQUESTS_IN_FLIGHT.labels(route).dec()
+        else:
+            route = route_label(request)
+        REQUEST_DURATION.labels(request.method, route).observe(time.perf_counter() - started)
+        status = response.status_code if response is not None else 500
+        REQUESTS.labels(request.method, route, status).inc()
+        if status >= 500:
+            REQUEST_ERRORS.labels(request.method, route).inc()
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,73 @@
+"""
+Connection Pooling
+Keep-alive HTTP sessions for calls between services, and their reuse counters
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Tuple
+from urllib3.exceptions import NewConnectionError, TimeoutError as _TimeoutError
+from urllib3.util.retry import Retry
+
+
+# Methods that are safe to resend after the connection broke mid-request
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class ResetRetry(Retry):
+    """Retry that gives up on timeouts - resending would double the time spent"""
+    
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, _TimeoutError) and not isinstance(error, NewConnectionError):
+            # Fail exactly as an adapter without retries would
+            return Retry.increment(self.new(total=0, read=False), method, url, response, error, _pool, _stacktrace)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def pooled_session(pool_connections: int, pool_maxsize: int, retries: int = 0, backoff_factor: float = 0) -> requests.Session:
+    """Session keeping up to pool_maxsize keep-alive connections per host
+    
+    With retries, refused connects are retried for any method (nothing was
+    sent yet) and connection resets only for IDEMPOTENT_METHODS.
+    """
+    max_retries = ResetRetry(
+        total=None,
+        connect=retries,
+        read=retries,
+        status=0,
+        other=0,
+        redirect=False,
+        allowed_methods=IDEMPOTENT_METHODS,
+        backoff_factor=backoff_factor,
+        raise_on_status=False,
+    ) if retries else 0
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=max_retries,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def pool_counters(session: requests.Session) -> Tuple[int, int, int]:
+    """Return (requests, new connections, idle connections) for a session"""
+    requests_count = connections = idle = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_count += pool.num_requests
+            connections += pool.num_connections
+            if pool.pool is not None:
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+    return requests_count, connections, idle
+
+
+def retry_count(response: requests.Response) -> int:
+    """Attempts that were retried before this response arrived"""
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries is not None else 0
@@ -1,8 +1,12 @@
 """Settings for Customer Service (Microservices)"""
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Shared helpers in microservices/common
+sys.path.append(str(BASE_DIR.parent))
+
 SECRET_KEY = 'django-insecure-customer-service-secret-key'
 DEBUG = True
 ALLOWED_HOSTS = ['*']
@@ -19,6 +23,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.metrics.MetricsMiddleware',
+    'common.deadline.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',